@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Synthetic EAN/UPC image corpus for benchmarking the barcode scanner.
+
+Every sample is a rendered retail barcode on a white label, placed on a
+textured background and then degraded in exactly one controlled way, so hit
+rate and latency can be reported per degradation class. Generation is
+deterministic for a given seed.
+"""
+
+import io
+import os
+import sys
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.gtin import gtin_check_digit
+
+# === EAN/UPC encoding tables ===
+L_CODES = ["0001101", "0011001", "0010011", "0111101", "0100011",
+           "0110001", "0101111", "0111011", "0110111", "0001011"]
+G_CODES = ["0100111", "0110011", "0011011", "0100001", "0011101",
+           "0111001", "0000101", "0010001", "0001001", "0010111"]
+R_CODES = ["1110010", "1100110", "1101100", "1000010", "1011100",
+           "1001110", "1010000", "1000100", "1001000", "1110100"]
+# EAN-13: parity of the left half encodes the first digit
+EAN13_PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG",
+                "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+# UPC-E (number system 0): parity of the six digits encodes the check digit
+UPCE_PARITY = ["GGGLLL", "GGLGLL", "GGLLGL", "GGLLLG", "GLGGLL",
+               "GLLGGL", "GLLLGG", "GLGLGL", "GLGLLG", "GLLGLG"]
+
+# Degradation classes and the levels each one is sampled at
+DEGRADATIONS: Dict[str, List[float]] = {
+    "clean": [0],
+    "rotation": [15, 45, 90, 160],          # degrees
+    "blur": [1.0, 2.0, 3.0],                # gaussian sigma in px
+    "noise": [10, 25, 40],                  # gaussian noise std in grey levels
+    "glare": [0.5, 0.8, 0.95],              # peak brightness of the highlight over the label
+    "scale": [2.0, 1.5, 1.0],               # module width in px
+    "jpeg": [50, 25, 10],                   # JPEG quality
+}
+SYMBOLOGIES = ["EAN13", "EAN8", "UPCA", "UPCE"]
+
+
+@dataclass
+class Sample:
+    """One corpus image and what the scanner is expected to read from it"""
+    name: str
+    degradation: str
+    level: float
+    symbology: str
+    expected: str
+    image_bytes: bytes
+
+
+def random_code(symbology: str, rng: np.random.Generator) -> str:
+    """Random code with a valid check digit for the given symbology"""
+    if symbology == "UPCE":
+        # Keep the last digit at 5-9 so the UPC-A expansion is the simple "ddddd0000d" form
+        digits = "".join(str(d) for d in rng.integers(0, 10, 5)) + str(rng.integers(5, 10))
+        expanded = "0" + digits[:5] + "0000" + digits[5]
+        return "0" + digits + str(gtin_check_digit(expanded))
+    length = {"EAN13": 13, "EAN8": 8, "UPCA": 12}[symbology]
+    body = "".join(str(d) for d in rng.integers(0, 10, length - 1))
+    if symbology == "EAN13" and body[0] == "0":
+        body = "1" + body[1:]  # a leading zero would read back as UPC-A
+    return body + str(gtin_check_digit(body))
+
+
+def encode_modules(code: str, symbology: str) -> str:
+    """Bar pattern as a string of '1' (bar) and '0' (space) modules, without quiet zones"""
+    if symbology in ("EAN13", "UPCA"):
+        digits = code if symbology == "EAN13" else "0" + code
+        parity = EAN13_PARITY[int(digits[0])]
+        left = "".join((L_CODES if p == "L" else G_CODES)[int(d)] for p, d in zip(parity, digits[1:7]))
+        right = "".join(R_CODES[int(d)] for d in digits[7:])
+        return "101" + left + "01010" + right + "101"
+    if symbology == "EAN8":
+        left = "".join(L_CODES[int(d)] for d in code[:4])
+        right = "".join(R_CODES[int(d)] for d in code[4:])
+        return "101" + left + "01010" + right + "101"
+    if symbology == "UPCE":
+        parity = UPCE_PARITY[int(code[7])]
+        body = "".join((L_CODES if p == "L" else G_CODES)[int(d)] for p, d in zip(parity, code[1:7]))
+        return "101" + body + "010101"
+    raise ValueError(f"Unknown symbology {symbology}")
+
+
+def render_label(code: str, symbology: str, module: float) -> np.ndarray:
+    """White label with the barcode and a quiet zone of 10 modules on each side"""
+    modules = np.array([int(m) for m in encode_modules(code, symbology)], dtype=np.uint8)
+    quiet = 10
+    width = int(round((len(modules) + 2 * quiet) * module))
+    height = max(int(width * 0.45), 24)
+    label = np.full((height, width), 255, np.uint8)
+    # Sample the module pattern per pixel column so fractional module widths work
+    columns = ((np.arange(width) + 0.5) / module).astype(int) - quiet
+    inside = (columns >= 0) & (columns < len(modules))
+    bars = np.zeros(width, dtype=bool)
+    bars[inside] = modules[columns[inside]] == 1
+    margin = max(height // 10, 2)
+    label[margin:height - margin, bars] = 0
+    return label
+
+
+def _background(size: Tuple[int, int], rng: np.random.Generator) -> np.ndarray:
+    """Low-frequency texture so the localizer has something besides the label to reject"""
+    width, height = size
+    coarse = rng.integers(60, 200, (height // 64 + 2, width // 64 + 2)).astype(np.uint8)
+    texture = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    return np.clip(texture.astype(np.int16) + rng.normal(0, 6, texture.shape), 0, 255).astype(np.uint8)
+
+
+def render_scene(code: str, symbology: str, degradation: str, level: float,
+                 size: Tuple[int, int], rng: np.random.Generator) -> bytes:
+    """Place the label on a background, apply one degradation and encode the result"""
+    module = level if degradation == "scale" else 3.0
+    label = render_label(code, symbology, module)
+    scene = _background(size, rng)
+
+    height, width = label.shape
+    # Keep the label fully inside the frame at any rotation
+    radius = int(np.ceil(np.hypot(width, height) / 2))
+    cx = int(rng.integers(radius, max(scene.shape[1] - radius, radius + 1)))
+    cy = int(rng.integers(radius, max(scene.shape[0] - radius, radius + 1)))
+    x, y = max(cx - width // 2, 0), max(cy - height // 2, 0)
+    scene[y:y + height, x:x + width] = label[:scene.shape[0] - y, :scene.shape[1] - x]
+
+    if degradation == "rotation":
+        center = (x + width / 2, y + height / 2)
+        matrix = cv2.getRotationMatrix2D(center, level, 1.0)
+        scene = cv2.warpAffine(scene, matrix, (scene.shape[1], scene.shape[0]), borderMode=cv2.BORDER_REPLICATE)
+    elif degradation == "blur":
+        scene = cv2.GaussianBlur(scene, (0, 0), level)
+    elif degradation == "noise":
+        scene = np.clip(scene + rng.normal(0, level, scene.shape), 0, 255).astype(np.uint8)
+    elif degradation == "glare":
+        # Radial highlight centred on the label, washing out the bars towards `level`
+        yy, xx = np.mgrid[0:scene.shape[0], 0:scene.shape[1]]
+        radius = max(width, height) * 0.6
+        falloff = np.exp(-(((xx - x - width / 2) ** 2 + (yy - y - height / 2) ** 2) / (2 * radius ** 2)))
+        glare = (level * falloff).astype(np.float32)
+        scene = (scene * (1 - glare) + 255 * glare).astype(np.uint8)
+
+    quality = int(level) if degradation == "jpeg" else 90
+    buffer = io.BytesIO()
+    Image.fromarray(scene).convert("RGB").save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def generate_corpus(per_level: int = 5, size: Tuple[int, int] = (1600, 1200), seed: int = 0,
+                    degradations: Optional[List[str]] = None) -> Iterator[Sample]:
+    """
+    Yield the corpus sample by sample
+    Args:
+        per_level: Images per (degradation, level) pair; symbologies rotate across the corpus
+        size: Scene size in pixels (width, height)
+        seed: Random seed; the same seed always produces the same corpus
+        degradations: Subset of DEGRADATIONS to generate (all by default)
+    """
+    rng = np.random.default_rng(seed)
+    counter = 0
+    for degradation in degradations or list(DEGRADATIONS):
+        for level in DEGRADATIONS[degradation]:
+            for index in range(per_level):
+                symbology = SYMBOLOGIES[counter % len(SYMBOLOGIES)]
+                counter += 1
+                code = random_code(symbology, rng)
+                yield Sample(
+                    name=f"{degradation}-{level:g}-{index}-{symbology}",
+                    degradation=degradation,
+                    level=level,
+                    symbology=symbology,
+                    expected=code,
+                    image_bytes=render_scene(code, symbology, degradation, level, size, rng),
+                )
+
+
+def save_corpus(directory: str, **kwargs) -> int:
+    """Write the corpus to a directory as <name>__<expected>.jpg files; returns the image count"""
+    os.makedirs(directory, exist_ok=True)
+    count = 0
+    for sample in generate_corpus(**kwargs):
+        with open(os.path.join(directory, f"{sample.name}__{sample.expected}.jpg"), "wb") as f:
+            f.write(sample.image_bytes)
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write the synthetic barcode corpus to disk")
+    parser.add_argument("directory")
+    parser.add_argument("--per-level", type=int, default=5)
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    written = save_corpus(args.directory, per_level=args.per_level,
+                          size=(args.width, args.height), seed=args.seed)
+    print(f"Wrote {written} images to {args.directory}")
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for utils.barcode_scanner.
+
+Runs the decoder over the synthetic corpus from barcode_corpus.py and reports
+throughput, latency percentiles, peak memory and hit rate per degradation
+class. Results are written as JSON so two runs can be compared:
+
+    python benchmarks/bench_barcode.py --output before.json
+    # ... change the scanner ...
+    python benchmarks/bench_barcode.py --output after.json --compare before.json
+"""
+
+import argparse
+import ctypes
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from barcode_corpus import DEGRADATIONS, generate_corpus
+from utils.barcode_scanner import cascade_stats, detect_barcode_traced, detect_barcodes_traced
+from utils.gtin import expand_upce
+
+
+def _gtin14(code: Optional[str], symbology: Optional[str] = None) -> Optional[str]:
+    """Compare codes independent of the UPC-A/EAN-13/UPC-E form the decoder reports"""
+    if not code or not code.isdigit():
+        return code
+    if len(code) == 8 and symbology == "UPCE":
+        code = expand_upce(code) or code
+    return code.zfill(14)
+
+
+def _decoder_versions() -> Dict[str, Optional[str]]:
+    """pyzbar and zbar versions, which decide what the cascade can read at all"""
+    versions: Dict[str, Optional[str]] = {"pyzbar": None, "zbar": None}
+    try:
+        import pyzbar
+        from pyzbar import wrapper
+        versions["pyzbar"] = pyzbar.__version__
+        major, minor = ctypes.c_uint(), ctypes.c_uint()
+        wrapper.zbar_version(ctypes.byref(major), ctypes.byref(minor))
+        versions["zbar"] = f"{major.value}.{minor.value}"
+    except Exception as e:
+        print(f"Could not read decoder versions: {e}")
+    return versions
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def _summarize(records: List[Dict[str, Any]], wall_seconds: Optional[float] = None) -> Dict[str, Any]:
+    latencies = [r["ms"] for r in records]
+    hits = sum(r["hit"] for r in records)
+    summary = {
+        "images": len(records),
+        "hits": hits,
+        "misreads": sum(r["misread"] for r in records),
+        "hit_rate": hits / len(records) if records else 0.0,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "mean_ms": sum(latencies) / len(latencies) if latencies else 0.0,
+        "peak_alloc_mb": max((r["peak_alloc_mb"] for r in records), default=0.0),
+    }
+    if wall_seconds is not None:
+        summary["throughput_ips"] = len(records) / wall_seconds if wall_seconds else 0.0
+    return summary
+
+
+def run_benchmark(per_level: int, size, seed: int, multi: bool = False, pyramid: bool = True,
+                  degradations: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Decode every corpus image once and collect per-image and per-class results"""
+    corpus = list(generate_corpus(per_level=per_level, size=size, seed=seed, degradations=degradations))
+    # Warm up imports, OpenCV and zbar before timing anything
+    detect_barcode_traced(corpus[0].image_bytes)
+
+    records: List[Dict[str, Any]] = []
+    tracemalloc.start()
+    started = time.perf_counter()
+    for sample in corpus:
+        tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        if multi:
+            found, trace = detect_barcodes_traced(sample.image_bytes)
+        else:
+            barcode, trace = detect_barcode_traced(sample.image_bytes, pyramid=pyramid)
+            found = [barcode] if barcode else []
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        _, peak = tracemalloc.get_traced_memory()
+        cascade_stats.record(trace)
+
+        expected = _gtin14(sample.expected, sample.symbology)
+        decoded = [_gtin14(code, sample.symbology) for code in found]
+        records.append({
+            "name": sample.name,
+            "degradation": sample.degradation,
+            "level": sample.level,
+            "symbology": sample.symbology,
+            "expected": sample.expected,
+            "decoded": found,
+            "hit": expected in decoded,
+            "misread": bool(decoded) and expected not in decoded,
+            "ms": elapsed_ms,
+            "peak_alloc_mb": peak / (1024 * 1024),
+            "stages": [stage for stage, _, _ in trace],
+        })
+    wall_seconds = time.perf_counter() - started
+    tracemalloc.stop()
+
+    classes = {}
+    for degradation in degradations or list(DEGRADATIONS):
+        class_records = [r for r in records if r["degradation"] == degradation]
+        classes[degradation] = _summarize(class_records)
+        classes[degradation]["levels"] = {
+            f"{level:g}": _summarize([r for r in class_records if r["level"] == level])
+            for level in DEGRADATIONS[degradation]
+        }
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            **_decoder_versions(),
+            "per_level": per_level,
+            "size": list(size),
+            "seed": seed,
+            "multi": multi,
+            "pyramid": pyramid,
+        },
+        "overall": {
+            **_summarize(records, wall_seconds),
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+        "classes": classes,
+        "cascade": cascade_stats.snapshot(),
+        "images": records,
+    }
+
+
+def print_report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    """Print a per-class table; with a baseline, show the change next to each number"""
+    def delta(current: float, previous: Optional[float], fmt: str) -> str:
+        if previous is None:
+            return format(current, fmt)
+        return f"{format(current, fmt)} ({current - previous:+{fmt}})"
+
+    overall = result["overall"]
+    base_overall = baseline["overall"] if baseline else {}
+    print(f"images: {overall['images']}  throughput: "
+          f"{delta(overall['throughput_ips'], base_overall.get('throughput_ips'), '.2f')} img/s  "
+          f"max RSS: {overall['max_rss_mb']:.0f} MB")
+    print(f"{'class':<10} {'hit rate':>18} {'misreads':>9} {'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>16} {'peak MB':>9}")
+    rows = list(result["classes"].items()) + [("overall", overall)]
+    for name, stats in rows:
+        base = (baseline["classes"].get(name) if name != "overall" else base_overall) if baseline else None
+        base = base or {}
+        print(f"{name:<10} {delta(stats['hit_rate'], base.get('hit_rate'), '.3f'):>18} {stats['misreads']:>9} "
+              f"{delta(stats['p50_ms'], base.get('p50_ms'), '.1f'):>16} "
+              f"{delta(stats['p95_ms'], base.get('p95_ms'), '.1f'):>16} "
+              f"{delta(stats['p99_ms'], base.get('p99_ms'), '.1f'):>16} "
+              f"{stats['peak_alloc_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark barcode detection on a synthetic corpus")
+    parser.add_argument("--per-level", type=int, default=5, help="images per degradation level")
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--degradation", action="append", choices=list(DEGRADATIONS),
+                        help="only run these classes (repeatable)")
+    parser.add_argument("--multi", action="store_true", help="benchmark multi-barcode detection")
+    parser.add_argument("--no-pyramid", action="store_true", help="disable the reduced-resolution JPEG pass")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="previous JSON result to compare against")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.per_level, (args.width, args.height), args.seed,
+                           multi=args.multi, pyramid=not args.no_pyramid,
+                           degradations=args.degradation)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
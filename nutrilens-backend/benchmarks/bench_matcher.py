@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Cost of flagging ingredients as the term list grows.
+
+Times the term-by-term scan the sweetener check used to do (substring test on
+the lower-cased ingredients text plus list membership in the additive tags,
+for every term) against a TermMatcher built from the same terms, for lists of
+increasing size. The scan grows linearly with the list; the matcher should not:
+
+    python benchmarks/bench_matcher.py
+    python benchmarks/bench_matcher.py --sizes 16,256,4096,16384 --output matcher.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.health_rating import NON_NUTRITIVE_SWEETENER_TERMS
+from utils.term_matcher import TermMatcher
+
+INGREDIENTS = ("Carbonated water, sugar, colour (caramel E150d), acid (phosphoric acid), natural flavourings "
+               "including caffeine, sweeteners (sodium cyclamate), preservative (potassium sorbate), "
+               "wheat flour, palm oil, skimmed milk powder, emulsifier (soy lecithin), salt")
+ADDITIVES = ["en:e150d", "en:e338", "en:e202", "en:e322", "en:e322i"]
+
+
+def term_list(size: int, seed: int) -> List[str]:
+    """The sweetener terms plus made-up additive codes and ingredient words, none of them in INGREDIENTS"""
+    rng = random.Random(seed)
+    terms = list(NON_NUTRITIVE_SWEETENER_TERMS)
+    while len(terms) < size:
+        if rng.random() < 0.5:
+            terms.append(f"en:e{rng.randint(1000, 99999)}")
+        else:
+            terms.append("".join(rng.choice("bdfghjkqvxz") for _ in range(rng.randint(5, 12))))
+    return terms[:size]
+
+
+def linear_scan(terms: List[str]) -> Callable[[str, List[str]], bool]:
+    def check(text: str, tags: List[str]) -> bool:
+        lowered = text.lower()
+        return any(term in tags or term in lowered for term in terms)
+    return check
+
+
+def compiled(terms: List[str]) -> Callable[[str, List[str]], bool]:
+    return TermMatcher(terms, terms).matches
+
+
+def _per_call_us(check: Callable[[str, List[str]], bool], calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        check(INGREDIENTS, ADDITIVES)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def run_benchmark(sizes: List[int], calls: int, seed: int) -> Dict[str, Any]:
+    rows = []
+    for size in sizes:
+        terms = term_list(size, seed)
+        started = time.perf_counter()
+        matcher = compiled(terms)
+        build_ms = (time.perf_counter() - started) * 1000
+        scan = linear_scan(terms)
+        assert matcher(INGREDIENTS, ADDITIVES) == scan(INGREDIENTS, ADDITIVES)
+        assert matcher("water, sucralose", []) and matcher("", ["en:e951"])
+        # Fewer calls for the big linear scans, so the run stays short
+        scan_calls = max(10, calls * 16 // size)
+        rows.append({
+            "terms": size,
+            "linear_scan_us": _per_call_us(scan, scan_calls),
+            "matcher_us": _per_call_us(matcher, calls),
+            "matcher_build_ms": build_ms,
+        })
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "text_chars": len(INGREDIENTS),
+            "tags": len(ADDITIVES),
+            "calls": calls,
+            "seed": seed,
+        },
+        "sizes": rows,
+    }
+
+
+def print_report(result: Dict[str, Any]):
+    print(f"ingredients text: {result['meta']['text_chars']} chars, {result['meta']['tags']} additive tags")
+    print(f"{'terms':>8} {'linear scan':>14} {'TermMatcher':>14} {'build':>10}")
+    for row in result["sizes"]:
+        print(f"{row['terms']:>8} {row['linear_scan_us']:>11.1f} us {row['matcher_us']:>11.1f} us "
+              f"{row['matcher_build_ms']:>7.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark term matching against growing additive/allergen lists")
+    parser.add_argument("--sizes", default="16,128,1024,8192", help="comma-separated term list sizes")
+    parser.add_argument("--calls", type=int, default=20_000, help="checks timed per size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    result = run_benchmark([int(size) for size in args.sizes.split(",")], args.calls, args.seed)
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the Nutri-Score engines in utils.health_rating.
+
+Scores a synthetic catalog with the vectorized calculate_nutriscore_batch and
+a sample of it with the scalar calculate_nutriscore, checks that both
+agree on the sample and reports products per second for each:
+
+    python benchmarks/bench_nutriscore.py --products 1000000
+    python benchmarks/bench_nutriscore.py --version 2017
+    python benchmarks/bench_nutriscore.py --index data/nutrient_index   # the real catalog
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.health_rating import BATCH_COLUMNS, calculate_nutriscore, calculate_nutriscore_batch, nutriscore_columns
+from utils.nutrient_index import NutrientIndex
+from utils.nutriscore_rules import DEFAULT_VERSION, get_ruleset, versions
+
+# Upper bound of the uniform values generated per column (per 100 g/ml; sodium in mg)
+SYNTHETIC_RANGES = {
+    "energy_kj": 3800, "sugars": 60, "saturated_fat": 15, "salt": 3, "sodium": 1200,
+    "proteins": 15, "fiber": 8, "fruits_veg": 100,
+}
+
+
+def synthetic_columns(products: int, seed: int) -> Dict[str, np.ndarray]:
+    """Random columns with about 20% beverages and 20% zeros (missing values)"""
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name, top in SYNTHETIC_RANGES.items():
+        values = rng.random(products) * top
+        values[rng.random(products) < 0.2] = 0.0
+        columns[name] = values
+    columns["is_beverage"] = rng.random(products) < 0.2
+    columns["non_nutritive_sweeteners"] = columns["is_beverage"] & (rng.random(products) < 0.3)
+    return columns
+
+
+def index_columns(directory: str, version: str) -> Dict[str, np.ndarray]:
+    """Columns of a nutrient index, with the categories it stores for ``version``"""
+    columns = NutrientIndex(directory).scoring_columns(version)
+    return {name: np.asarray(values) for name, values in columns.items()
+            if name in BATCH_COLUMNS or name in ("category", "non_nutritive_sweeteners")}
+
+
+def _category_fields(version: str, category: str) -> Dict[str, Any]:
+    """Product fields the scalar function detects ``category`` from"""
+    rules = get_ruleset(version).categories[category]
+    if rules.tags:
+        return {"categories_tags": [rules.tags[0]]}
+    return {"categories": rules.terms[0]} if rules.terms else {}
+
+
+def as_products(columns: Dict[str, np.ndarray], rows: np.ndarray, version: str) -> List[Dict[str, Any]]:
+    """Product dicts the scalar function reads the same values from"""
+    products = []
+    for i in rows:
+        product = {
+            "energy-kj": float(columns["energy_kj"][i]),
+            "sugars": float(columns["sugars"][i]),
+            "saturated-fat": float(columns["saturated_fat"][i]),
+            "salt": float(columns["salt"][i]),
+            "sodium": float(columns["sodium"][i]),
+            "proteins": float(columns["proteins"][i]),
+            "fiber": float(columns["fiber"][i]),
+            "fruits-vegetables-nuts-estimate-from-ingredients_100g": float(columns["fruits_veg"][i]),
+        }
+        if "fat" in columns:
+            product["fat"] = float(columns["fat"][i])
+        # NaN reads as 0 in the batch engine only (see calculate_nutriscore_batch)
+        product = {field: (0.0 if value != value else value) for field, value in product.items()}
+        if "category" in columns:
+            product.update(_category_fields(version, columns["category"][i]))
+        elif "is_beverage" in columns and columns["is_beverage"][i]:
+            product["categories"] = "Beverages"
+        if columns["non_nutritive_sweeteners"][i]:
+            product["additives_tags"] = ["en:e951"]
+        products.append(product)
+    return products
+
+
+def _timed(fn, repeat: int) -> float:
+    """Best wall time of ``repeat`` runs, in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run_benchmark(columns: Dict[str, np.ndarray], scalar_sample: int, seed: int, repeat: int,
+                  version: str) -> Dict[str, Any]:
+    size = len(columns["energy_kj"])
+    rows = np.random.default_rng(seed).choice(size, size=min(scalar_sample, size), replace=False)
+    products = as_products(columns, rows, version)
+
+    scalar_seconds = _timed(lambda: [calculate_nutriscore(p, version) for p in products], 1)
+    batch_seconds = _timed(lambda: calculate_nutriscore_batch(columns, version), repeat)
+    extract_seconds = _timed(lambda: calculate_nutriscore_batch(nutriscore_columns(products, version), version), 1)
+
+    # Parity on the sample: both engines must agree product for product
+    batch = calculate_nutriscore_batch({name: values[rows] for name, values in columns.items()}, version)
+    mismatches = sum(
+        int(batch["score"][i]) != expected["score"] or batch["grade"][i] != expected["grade"]
+        for i, expected in enumerate(calculate_nutriscore(p, version) for p in products)
+    )
+
+    scalar_rate = len(products) / scalar_seconds if scalar_seconds else 0.0
+    batch_rate = size / batch_seconds if batch_seconds else 0.0
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "products": size,
+            "scalar_sample": len(products),
+            "seed": seed,
+            "version": version,
+        },
+        "scalar_products_per_s": scalar_rate,
+        "batch_products_per_s": batch_rate,
+        "batch_from_dicts_products_per_s": len(products) / extract_seconds if extract_seconds else 0.0,
+        "speedup": batch_rate / scalar_rate if scalar_rate else 0.0,
+        "batch_seconds": batch_seconds,
+        "sample_mismatches": mismatches,
+    }
+
+
+def print_report(result: Dict[str, Any]):
+    meta = result["meta"]
+    print(f"products: {meta['products']}  scalar sample: {meta['scalar_sample']}  version: {meta['version']}")
+    print(f"scalar calculate_nutriscore        {result['scalar_products_per_s']:>14,.0f} products/s")
+    print(f"batch from product dicts           {result['batch_from_dicts_products_per_s']:>14,.0f} products/s")
+    print(f"batch on columns                   {result['batch_products_per_s']:>14,.0f} products/s "
+          f"({result['batch_seconds'] * 1000:.1f} ms, {result['speedup']:.0f}x scalar)")
+    print(f"sample mismatches: {result['sample_mismatches']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark scalar vs vectorized Nutri-Score scoring")
+    parser.add_argument("--products", type=int, default=1_000_000, help="synthetic catalog size")
+    parser.add_argument("--index", help="score a nutrient index directory instead of a synthetic catalog")
+    parser.add_argument("--scalar-sample", type=int, default=50_000, help="products scored by the scalar function")
+    parser.add_argument("--repeat", type=int, default=3, help="batch runs, best is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--version", default=DEFAULT_VERSION, choices=versions(), help="Nutri-Score rule set")
+    parser.add_argument("--output", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    try:
+        columns = index_columns(args.index, args.version) if args.index else synthetic_columns(args.products, args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+    result = run_benchmark(columns, args.scalar_sample, args.seed, args.repeat, args.version)
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    sys.exit(1 if result["sample_mismatches"] else 0)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Per-request scoring cost of the scan endpoints.
+
+A scanned product used to be read twice: calculate_nutriscore on the raw
+product, then calculate_health_score, which scored it all over again. It is
+now read once into a NutrientRecord that both scores use (see score_product
+in main.py). This benchmark times both call patterns on real OpenFoodFacts
+records and reports microseconds per request:
+
+    python benchmarks/bench_scoring.py
+    python benchmarks/bench_scoring.py --products openfoodfacts-products.jsonl --limit 100000
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.health_rating import calculate_health_score, calculate_nutriscore, extract_nutrients, health_score_from_grade
+from utils.nutriscore_rules import DEFAULT_VERSION, versions
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "fixtures", "off_sample.jsonl")
+
+
+def load_products(path: str, limit: int) -> List[Dict[str, Any]]:
+    """OpenFoodFacts JSONL records the scorer can read (malformed lines are skipped)"""
+    products = []
+    with open(path) as f:
+        for line in f:
+            try:
+                product = json.loads(line)
+                extract_nutrients(product)
+            except (ValueError, TypeError, AttributeError):
+                continue
+            products.append(product)
+            if len(products) >= limit:
+                break
+    return products
+
+
+def two_pass(product: Dict[str, Any], version: str):
+    """The previous score_product: the Nutri-Score, then the health score scoring again"""
+    return calculate_nutriscore(product, version), calculate_health_score(product, version)
+
+
+def single_pass(product: Dict[str, Any], version: str):
+    """score_product now: one extraction shared by both scores"""
+    nutriscore = calculate_nutriscore(extract_nutrients(product), version)
+    return nutriscore, health_score_from_grade(nutriscore["grade"])
+
+
+def _per_call_us(fn: Callable, products: List[Dict[str, Any]], version: str, rounds: int, repeat: int) -> float:
+    """Best time per call over ``repeat`` runs of ``rounds`` passes over the products, in microseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for product in products:
+                fn(product, version)
+        best = min(best, time.perf_counter() - started)
+    return best / (rounds * len(products)) * 1e6
+
+
+def run_benchmark(products: List[Dict[str, Any]], version: str, rounds: int, repeat: int) -> Dict[str, Any]:
+    for product in products:
+        assert two_pass(product, version) == single_pass(product, version), product.get("code")
+    records = [extract_nutrients(product) for product in products]
+
+    before = _per_call_us(two_pass, products, version, rounds, repeat)
+    after = _per_call_us(single_pass, products, version, rounds, repeat)
+    extract = _per_call_us(lambda product, _: extract_nutrients(product), products, version, rounds, repeat)
+    score = _per_call_us(calculate_nutriscore, records, version, rounds, repeat)
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "products": len(products),
+            "rounds": rounds,
+            "version": version,
+        },
+        "two_pass_us": before,
+        "single_pass_us": after,
+        "extract_us": extract,
+        "score_from_record_us": score,
+        "saved_us": before - after,
+        "saved_percent": (before - after) / before * 100 if before else 0.0,
+    }
+
+
+def print_report(result: Dict[str, Any]):
+    meta = result["meta"]
+    print(f"products: {meta['products']} x {meta['rounds']} rounds  version: {meta['version']}")
+    print(f"two passes (Nutri-Score + health score)   {result['two_pass_us']:8.2f} us/request")
+    print(f"single pass (shared NutrientRecord)       {result['single_pass_us']:8.2f} us/request")
+    print(f"  of which extraction                     {result['extract_us']:8.2f} us")
+    print(f"  of which scoring                        {result['score_from_record_us']:8.2f} us")
+    print(f"saved: {result['saved_us']:.2f} us/request ({result['saved_percent']:.0f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-request Nutri-Score and health score cost")
+    parser.add_argument("--products", default=FIXTURE, help="OpenFoodFacts JSONL file (default: the test fixture)")
+    parser.add_argument("--limit", type=int, default=10_000, help="products read from the file")
+    parser.add_argument("--rounds", type=int, default=0, help="passes over the products (default: ~200k requests)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs, best is reported")
+    parser.add_argument("--version", default=DEFAULT_VERSION, choices=versions(), help="Nutri-Score rule set")
+    parser.add_argument("--output", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    products = load_products(args.products, args.limit)
+    if not products:
+        sys.exit(f"No scorable products in {args.products}")
+    rounds = args.rounds or max(1, 200_000 // len(products))
+    result = run_benchmark(products, args.version, rounds, args.repeat)
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
@@ -1,13 +1,115 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional
-import requests
-from utils.barcode_scanner import detect_barcode
-from utils.database import FakeDB
-from utils.health_rating import calculate_nutriscore_2023, calculate_health_score
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+import asyncio
+import os
+import secrets
+from utils.barcode_scanner import cascade_stats, detect_barcode_traced, detect_barcodes_traced
+from utils.gtin import canonical_gtin, gtin_form
+from utils.delta_sync import OFF_DELTA_URL, DeltaSync, make_feed
+from utils.decode_executor import DecodeExecutor, DecodeQueueFull, DecodeTimeout
+from utils.http_client import UpstreamClient
+from utils.image_cache import DecodedImageCache, content_key, perceptual_hash
+from utils.materialized_scores import ScoreMaterializer, compute_scores, stored_scores
+from utils.nutriscore_rules import DEFAULT_VERSION, UnknownVersion, get_ruleset
+from utils.product_cache import ProductCache
+from utils.product_store import ProductStore
+from utils.provider_health import ProviderRegistry, ProviderUnavailable
+from utils.single_flight import SingleFlight
+from utils.upload import EmptyUpload, UnsupportedUpload, UploadTooLarge, read_image_upload
 
-app = FastAPI()
+# === Constants ===
+MAX_IMAGE_SIZE = 8 * 1024 * 1024  # 8 MB
+OPENFOODFACTS_API = "https://world.openfoodfacts.org/api/v0/product"
+OPENFOODFACTS_CACHE = "openfoodfacts"  # product cache namespace
+OPENFOODFACTS_QUOTAS = [(100, 60)]  # (requests, seconds): the API's limit on product reads
+
+# Barcode decoding runs in a process pool so it never blocks the event loop
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", os.cpu_count() or 1))  # 0 = run on a thread
+DECODE_QUEUE_SIZE = int(os.getenv("DECODE_QUEUE_SIZE", 2 * DECODE_WORKERS))
+DECODE_TIMEOUT = float(os.getenv("DECODE_TIMEOUT", 10))  # seconds per image
+
+# Repeated uploads (client retries, rescans) skip decoding entirely
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", 4096))
+IMAGE_CACHE_NEGATIVE_TTL = float(os.getenv("IMAGE_CACHE_NEGATIVE_TTL", 60))  # seconds for "no barcode"
+IMAGE_CACHE_PERCEPTUAL = os.getenv("IMAGE_CACHE_PERCEPTUAL", "0") == "1"  # also match re-encodes
+
+# Product lookups share one pooled async HTTP client
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 100))
+UPSTREAM_MAX_PER_HOST = int(os.getenv("UPSTREAM_MAX_PER_HOST", 20))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 3))  # seconds
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 5))  # seconds per request
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "1") == "1"  # used when the h2 package is installed
+
+# POST /scan/batch: products not held locally are fetched with bounded concurrency
+BATCH_MAX_BARCODES = int(os.getenv("BATCH_MAX_BARCODES", 500))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 16))  # upstream lookups in flight per batch
+
+# Failing providers are skipped (circuit open) instead of costing every lookup a timeout
+PROVIDER_FAILURE_THRESHOLD = float(os.getenv("PROVIDER_FAILURE_THRESHOLD", 0.5))  # failed share of recent calls
+PROVIDER_OPEN_SECONDS = float(os.getenv("PROVIDER_OPEN_SECONDS", 30))  # before a probe call is let through
+
+# /admin/* needs "Authorization: Bearer <ADMIN_TOKEN>"; unset, the admin routes do not exist
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Nutri-Score rule set used unless a request asks for another (see utils/nutriscore_rules.py)
+NUTRISCORE_VERSION = os.getenv("NUTRISCORE_VERSION", DEFAULT_VERSION)
+# Versions precomputed for stored and cached products (see utils/materialized_scores.py)
+NUTRISCORE_MATERIALIZE = [v for v in os.getenv("NUTRISCORE_MATERIALIZE", NUTRISCORE_VERSION).split(",") if v]
+for _version in [NUTRISCORE_VERSION, *NUTRISCORE_MATERIALIZE]:
+    get_ruleset(_version)  # an unknown version raises UnknownVersion and stops startup
+
+# Local copy of the OpenFoodFacts catalog, checked before any upstream call
+PRODUCT_STORE_PATH = os.getenv("PRODUCT_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "products.sqlite3"))
+PRODUCT_SYNC_SOURCE = os.getenv("PRODUCT_SYNC_SOURCE", OFF_DELTA_URL)  # delta directory URL or local directory
+PRODUCT_SYNC_INTERVAL = float(os.getenv("PRODUCT_SYNC_INTERVAL", 0))  # seconds between delta syncs, 0 = off
+
+# Product lookups are cached in memory and in SQLite, so restarts keep warm data
+PRODUCT_CACHE_PATH = os.getenv("PRODUCT_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "product_cache.sqlite3"))  # "" = memory only
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", 10000))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", 24 * 3600))  # seconds for found products
+PRODUCT_CACHE_NEGATIVE_TTL = float(os.getenv("PRODUCT_CACHE_NEGATIVE_TTL", 15 * 60))  # seconds for "not found"
+PRODUCT_CACHE_DISK_SIZE = int(os.getenv("PRODUCT_CACHE_DISK_SIZE", 1000000))  # rows kept in the SQLite file
+
+decoder = DecodeExecutor(DECODE_WORKERS, DECODE_QUEUE_SIZE, DECODE_TIMEOUT)
+image_cache = DecodedImageCache(IMAGE_CACHE_SIZE, IMAGE_CACHE_NEGATIVE_TTL, IMAGE_CACHE_PERCEPTUAL)
+product_cache = ProductCache(PRODUCT_CACHE_PATH or None, PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL, PRODUCT_CACHE_NEGATIVE_TTL,
+                             max_disk_entries=PRODUCT_CACHE_DISK_SIZE)
+product_lookups = SingleFlight()  # in-flight lookups by (GTIN-14 key, Nutri-Score version)
+upstream = UpstreamClient(
+    max_connections=UPSTREAM_MAX_CONNECTIONS,
+    max_per_host=UPSTREAM_MAX_PER_HOST,
+    connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+    timeout=UPSTREAM_TIMEOUT,
+    http2=UPSTREAM_HTTP2,
+)
+providers = ProviderRegistry(failure_threshold=PROVIDER_FAILURE_THRESHOLD, open_for=PROVIDER_OPEN_SECONDS)
+openfoodfacts = providers.get("OpenFoodFacts", OPENFOODFACTS_QUOTAS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await decoder.start()
+    await upstream.start()
+    await product_cache.open()
+    # Deltas are applied in the background; lookups keep reading the store meanwhile
+    sync_task = asyncio.create_task(product_sync.run_forever(PRODUCT_SYNC_INTERVAL)) if PRODUCT_SYNC_INTERVAL > 0 else None
+    # Stored scores are recomputed only if a rule set changed since they were computed
+    score_task = asyncio.create_task(score_materializer.run_once())
+    yield
+    for task in (sync_task, score_task):
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    await product_cache.close()
+    await upstream.shutdown()
+    await decoder.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -24,12 +126,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# === Constants ===
-MAX_IMAGE_SIZE = 8 * 1024 * 1024  # 8 MB
-OPENFOODFACTS_API = "https://world.openfoodfacts.org/api/v0/product"
-
-# === Database mock (replace with your DB connection) ===
-db = FakeDB()
+# === Local product database (built by utils/off_dump.py from the OpenFoodFacts export) ===
+db = ProductStore(PRODUCT_STORE_PATH)
+product_sync = DeltaSync(db, make_feed(PRODUCT_SYNC_SOURCE, upstream), product_cache, NUTRISCORE_MATERIALIZE)
+score_materializer = ScoreMaterializer(db, NUTRISCORE_MATERIALIZE)
 
 
 # === Health Check Endpoint ===
@@ -38,6 +138,36 @@ async def health_check():
     return {"status": "healthy", "message": "Nutrilens Backend is running"}
 
 
+# === Admin Endpoints ===
+def require_admin(authorization: Optional[str] = Header(None)):
+    """Answer 404 while ADMIN_TOKEN is unset, 401 unless the request carries it as a bearer token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest((authorization or "").encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Admin token required", headers={"WWW-Authenticate": "Bearer"})
+
+
+@app.get("/admin/stats", dependencies=[Depends(require_admin)], include_in_schema=False)
+async def admin_stats():
+    return {
+        "decode_pool": decoder.stats(),
+        "decode_cascade": cascade_stats.snapshot(),
+        "image_cache": image_cache.stats(),
+        "upstream": upstream.stats(),
+        "product_cache": product_cache.stats(),
+        "product_lookups": product_lookups.stats(),
+        "product_store": db.stats(),
+        "product_sync": product_sync.stats(),
+        "materialized_scores": score_materializer.stats(),
+    }
+
+
+@app.get("/admin/providers", dependencies=[Depends(require_admin)], include_in_schema=False)
+async def admin_providers():
+    """Circuit state, quotas and rolling latency/hit rate of every upstream provider"""
+    return providers.stats()
+
+
 # === Helper Functions ===
 
 # === Response Model ===
@@ -55,110 +185,305 @@ class ProductResponse(BaseModel):
     nutriscore: Optional[dict] = None  # Add Nutri-Score data
     raw_product_data: Optional[dict] = None  # Include raw data for Nutri-Score calculation
 
-def fetch_from_openfoodfacts(barcode: str) -> Optional[dict]:
-    """Fetch product data from OpenFoodFacts API"""
+class ScanItem(BaseModel):
+    """One barcode of a multi-barcode scan; failures are reported per item"""
+    barcode: str
+    status: int
+    product: Optional[ProductResponse] = None
+    error: Optional[str] = None
+
+class BatchScanRequest(BaseModel):
+    barcodes: List[str] = Field(min_length=1, max_length=BATCH_MAX_BARCODES)
+    nutriscore_version: Optional[str] = None
+
+async def request_openfoodfacts(barcode: str) -> Optional[dict]:
+    """Query the OpenFoodFacts API; None if the product does not exist, raises if the API could not answer"""
+    resp = await upstream.get(f"{OPENFOODFACTS_API}/{barcode}.json")
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    data = resp.json()
+    if data.get("status") != 1:
+        return None
+    prod = data["product"]
+    nutriments = prod.get("nutriments", {})
+
+    # Extract and normalize nutrient data
+    nutrients = {
+        "fat": float(nutriments.get("fat_100g", 0)),
+        "sugar": float(nutriments.get("sugars_100g", 0)),
+        "protein": float(nutriments.get("proteins_100g", 0))
+    }
+
+    return {
+        "barcode": barcode,
+        "name": prod.get("product_name", "Unknown Product"),
+        "brand": prod.get("brands", "Unknown Brand"),
+        "nutrients": nutrients,
+        "raw_product_data": prod,  # Include raw data for Nutri-Score
+        "scores": compute_scores(prod, NUTRISCORE_MATERIALIZE),  # cached with the product
+    }
+
+async def fetch_from_openfoodfacts(key: str) -> Optional[dict]:
+    """Fetch product data from OpenFoodFacts API by GTIN-14 key, through the product cache"""
+    # OpenFoodFacts files products under their EAN-13 form (UPC-A codes with a leading 0)
+    barcode = gtin_form(key, 13) or key
     try:
-        resp = requests.get(f"{OPENFOODFACTS_API}/{barcode}.json", timeout=5)
-        if resp.status_code == 200:
-            data = resp.json()
-            if data.get("status") == 1:
-                prod = data["product"]
-                nutriments = prod.get("nutriments", {})
-                
-                # Extract and normalize nutrient data
-                nutrients = {
-                    "fat": float(nutriments.get("fat_100g", 0)),
-                    "sugar": float(nutriments.get("sugars_100g", 0)),
-                    "protein": float(nutriments.get("proteins_100g", 0))
-                }
-                
-                return {
-                    "barcode": barcode,
-                    "name": prod.get("product_name", "Unknown Product"),
-                    "brand": prod.get("brands", "Unknown Brand"),
-                    "nutrients": nutrients,
-                    "raw_product_data": prod  # Include raw data for Nutri-Score
-                }
+        return await product_cache.get_or_load(
+            OPENFOODFACTS_CACHE, key, lambda: openfoodfacts.call(lambda: request_openfoodfacts(barcode)))
+    except ProviderUnavailable as e:
+        print(f"Skipping OpenFoodFacts: {e}")
+        raise HTTPException(status_code=503, detail="Product lookup is temporarily unavailable, please retry shortly.")
     except Exception as e:
         print(f"Error fetching OpenFoodFacts: {e}")
     return None
 
-# === API Endpoints ===
-@app.post("/scan-image", response_model=ProductResponse)
-async def scan_image(file: UploadFile = File(...)):
-    # Validate file type
-    if not file.content_type or not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=415, detail="Unsupported file type. Please upload an image.")
-
-    # Read and validate file
-    image_bytes = await file.read()
-    if not image_bytes:
-        raise HTTPException(status_code=400, detail="Empty file uploaded.")
-    if len(image_bytes) > MAX_IMAGE_SIZE:
-        raise HTTPException(status_code=413, detail="Image too large (max 8MB).")
-
-    # Detect barcode
-    barcode = detect_barcode(image_bytes)
-    if not barcode:
-        raise HTTPException(status_code=400, detail="Barcode not detected in image.")
+async def decode_image(image_bytes: bytearray) -> Optional[str]:
+    """Return the barcode in an uploaded image, consulting the image cache before decoding"""
+    # Hashing releases the GIL, so large uploads are hashed off the event loop
+    key = await asyncio.to_thread(content_key, image_bytes)
+    found, barcode = image_cache.get(key)
+    if found:
+        return barcode
 
-    # Lookup product in database first, then OpenFoodFacts
-    product = db.get_product_by_barcode(barcode)
-    if not product:
-        product = fetch_from_openfoodfacts(barcode)
+    try:
+        phash = None
+        if image_cache.perceptual:
+            phash = await decoder.run(perceptual_hash, image_bytes)
+            found, barcode = image_cache.get_similar(phash)
+            if found:
+                image_cache.put(key, barcode, phash)
+                return barcode
+        image_cache.miss()
 
-    if not product:
-        raise HTTPException(status_code=404, detail=f"Product not found for barcode {barcode}.")
-
-    # Calculate Nutri-Score using the proper 2023 algorithm
-    raw_data = product.get("raw_product_data", {})
-    if raw_data:
-        nutriscore_data = calculate_nutriscore_2023(raw_data)
-        # Use the proper Nutri-Score as health score (converted to 0-100 scale)
-        health_score = int(calculate_health_score(raw_data))
-    else:
-        # Fallback if no raw data available
-        nutriscore_data = calculate_nutriscore_2023(product["nutrients"])
-        health_score = int(calculate_health_score(product["nutrients"]))
-    
-    return ProductResponse(
-        barcode=str(product["barcode"]),
-        name=str(product["name"]),
-        brand=str(product["brand"]),
-        nutrients=ProductNutrients(**product["nutrients"]),
-        health_score=health_score,
-        nutriscore=nutriscore_data,
-        raw_product_data=product.get("raw_product_data")
-    )
+        barcode, trace = await decoder.run(detect_barcode_traced, image_bytes, cascade_stats.order())
+    except DecodeQueueFull:
+        raise HTTPException(status_code=503, detail="Scanner is busy, please retry shortly.")
+    except DecodeTimeout:
+        raise HTTPException(status_code=504, detail="Barcode detection timed out.")
+    # Workers only report timings; the learned stage order lives in this process
+    cascade_stats.record(trace)
+    image_cache.put(key, barcode, phash)
+    return barcode
 
+async def decode_image_multi(image_bytes: bytearray) -> List[str]:
+    """Return every distinct barcode in an uploaded image, consulting the image cache before decoding"""
+    # Separate key space: a single-mode result says nothing about the other symbols
+    key = await asyncio.to_thread(content_key, image_bytes) + ":multi"
+    found, barcodes = image_cache.get(key)
+    if found:
+        return list(barcodes or ())
 
-@app.get("/scan/{barcode}", response_model=ProductResponse)
-async def scan_barcode(barcode: str):
+    image_cache.miss()
+    try:
+        barcodes, trace = await decoder.run(detect_barcodes_traced, image_bytes, cascade_stats.order())
+    except DecodeQueueFull:
+        raise HTTPException(status_code=503, detail="Scanner is busy, please retry shortly.")
+    except DecodeTimeout:
+        raise HTTPException(status_code=504, detail="Barcode detection timed out.")
+    cascade_stats.record(trace)
+    image_cache.put(key, tuple(barcodes) or None)
+    return barcodes
+
+def select_nutriscore_version(requested: Optional[str]) -> str:
+    """The Nutri-Score version to score with; raises a 400 HTTPException for unknown versions"""
+    version = requested or NUTRISCORE_VERSION
+    try:
+        get_ruleset(version)
+    except UnknownVersion as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return version
+
+async def lookup_product(barcode: str, version: str) -> ProductResponse:
+    """
+    Look a barcode up and score it with a Nutri-Score version; raises a 400/404 HTTPException for invalid/unknown codes.
+    Every form of a code (UPC-A, EAN-13, GTIN-14, UPC-E) resolves to one GTIN-14 key, so
+    concurrent requests for the same product share one lookup and its result. The
+    response carries the barcode as it was scanned.
+    """
+    # Misreads and typos never cost a database or upstream call
+    key = canonical_gtin(barcode)
+    if key is None:
+        raise HTTPException(status_code=400, detail=f"Invalid barcode {barcode}: check digit does not match.")
+    product = await product_lookups.do((key, version), lambda: resolve_product(key, version))
+    if product.barcode != barcode:
+        product = product.model_copy(update={"barcode": barcode})
+    return product
+
+async def resolve_product(key: str, version: str) -> ProductResponse:
+    """The uncoalesced lookup behind lookup_product, by GTIN-14 key"""
     # Lookup product in database first, then OpenFoodFacts
-    product = db.get_product_by_barcode(barcode)
+    product = db.get_product_by_barcode(key, version)
     if not product:
-        product = fetch_from_openfoodfacts(barcode)
+        product = await fetch_from_openfoodfacts(key)
+    return score_product(key, product, version)
+
+async def lookup_local(key: str, version: str) -> Tuple[bool, Optional[dict]]:
+    """(found, product) from the local store or the product cache, without any upstream call"""
+    product = db.get_product_by_barcode(key, version)
+    if product:
+        return True, product
+    return await product_cache.get(OPENFOODFACTS_CACHE, key)
 
+def score_product(key: str, product: Optional[dict], version: str) -> ProductResponse:
+    """Score a looked-up product with a Nutri-Score version; raises a 404 HTTPException if there is none"""
     if not product:
-        raise HTTPException(status_code=404, detail=f"Product not found for barcode {barcode}.")
-
-    # Calculate Nutri-Score using the proper 2023 algorithm
-    raw_data = product.get("raw_product_data", {})
-    if raw_data:
-        nutriscore_data = calculate_nutriscore_2023(raw_data)
-        # Use the proper Nutri-Score as health score (converted to 0-100 scale)
-        health_score = int(calculate_health_score(raw_data))
-    else:
-        # Fallback if no raw data available
-        nutriscore_data = calculate_nutriscore_2023(product["nutrients"])
-        health_score = int(calculate_health_score(product["nutrients"]))
+        raise HTTPException(status_code=404, detail=f"Product not found for barcode {gtin_form(key, 13) or key}.")
+
+    # Scores precomputed at ingestion or cache fill, unless the product or the rule set changed since
+    scores = stored_scores(product, version)
+    if scores is None:
+        # Score now (falling back to the normalized nutrients if no raw data is available)
+        scores = compute_scores(product.get("raw_product_data") or product["nutrients"], [version])[version]
     
     return ProductResponse(
         barcode=str(product["barcode"]),
         name=str(product["name"]),
         brand=str(product["brand"]),
         nutrients=ProductNutrients(**product["nutrients"]),
-        health_score=health_score,
-        nutriscore=nutriscore_data,
+        health_score=scores["health_score"],
+        nutriscore=scores["nutriscore"],
         raw_product_data=product.get("raw_product_data")
     )
+
+async def lookup_scan_item(barcode: str, version: str) -> ScanItem:
+    """lookup_product for one item of a multi-barcode scan, turning failures into an item status"""
+    return (await scan_items([barcode], lambda: lookup_product(barcode, version)))[0]
+
+async def scan_items(barcodes: List[str], lookup: Callable[[], Awaitable[ProductResponse]]) -> List[ScanItem]:
+    """One ScanItem per barcode for a lookup they share (forms of one code), failures included"""
+    try:
+        product = await lookup()
+    except HTTPException as e:
+        return [ScanItem(barcode=barcode, status=e.status_code, error=str(e.detail)) for barcode in barcodes]
+    except Exception as e:
+        print(f"Error looking up {barcodes[0]}: {e}")
+        return [ScanItem(barcode=barcode, status=500, error="Product lookup failed.") for barcode in barcodes]
+    return [
+        ScanItem(barcode=barcode, status=200,
+                 product=product if product.barcode == barcode else product.model_copy(update={"barcode": barcode}))
+        for barcode in barcodes
+    ]
+
+async def scan_batch_items(barcodes: List[str], version: str) -> AsyncIterator[List[ScanItem]]:
+    """
+    Look up a batch, yielding ScanItems as they are ready: invalid codes and products
+    held locally first, then upstream lookups as each completes (at most
+    BATCH_CONCURRENCY at a time). Every form of a code is looked up once.
+    """
+    by_key: Dict[str, List[str]] = {}
+    invalid: List[str] = []
+    for barcode in dict.fromkeys(barcodes):
+        key = canonical_gtin(barcode)
+        if key is None:
+            invalid.append(barcode)
+        else:
+            by_key.setdefault(key, []).append(barcode)
+    if invalid:
+        yield [ScanItem(barcode=barcode, status=400, error=f"Invalid barcode {barcode}: check digit does not match.")
+               for barcode in invalid]
+
+    remote: Dict[str, List[str]] = {}
+    for key, forms in by_key.items():
+        try:
+            found, product = await lookup_local(key, version)
+        except Exception as e:
+            print(f"Error reading product cache: {e}")
+            found, product = False, None
+        if found:
+            yield await scan_items(forms, lambda: _scored(key, product, version))
+        else:
+            remote[key] = forms
+
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def fetch(key: str, forms: List[str]) -> List[ScanItem]:
+        async with slots:
+            return await scan_items(forms, lambda: product_lookups.do((key, version), lambda: resolve_product(key, version)))
+
+    pending = {asyncio.create_task(fetch(key, forms)) for key, forms in remote.items()}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # Client went away: drop its queued fetches. A lookup already started in
+        # product_lookups is shielded, so it still runs to completion and fills the
+        # cache, whether or not another caller is waiting on it.
+        for task in pending:
+            task.cancel()
+
+async def _scored(key: str, product: Optional[dict], version: str) -> ProductResponse:
+    return score_product(key, product, version)
+
+# === API Endpoints ===
+# The body is parsed by hand (see read_image_upload), so describe the form for the docs
+SCAN_IMAGE_FORM = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"file": {"type": "string", "format": "binary"}},
+            "required": ["file"],
+        }}},
+    }
+}
+
+
+@app.post("/scan-image", response_model=Union[ProductResponse, List[ScanItem]], openapi_extra=SCAN_IMAGE_FORM)
+async def scan_image(request: Request, multi: bool = False, nutriscore_version: Optional[str] = None):
+    """Scan an uploaded image; with ?multi=true every barcode in it is returned as a list"""
+    version = select_nutriscore_version(nutriscore_version)
+    # Stream the upload: size and format are checked as bytes arrive
+    try:
+        image_bytes = await read_image_upload(
+            request.headers.get("content-type"),
+            request.headers.get("content-length"),
+            request.stream(),
+            MAX_IMAGE_SIZE,
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedUpload as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except EmptyUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if multi:
+        # Every symbol in the photo, looked up and scored concurrently
+        barcodes = await decode_image_multi(image_bytes)
+        if not barcodes:
+            raise HTTPException(status_code=400, detail="Barcode not detected in image.")
+        # The same product printed twice (e.g. UPC-A and EAN-13 symbols) is listed once
+        distinct = {}
+        for barcode in barcodes:
+            distinct.setdefault(canonical_gtin(barcode) or barcode, barcode)
+        return await asyncio.gather(*(lookup_scan_item(barcode, version) for barcode in distinct.values()))
+
+    # Detect barcode (cached or in the decode pool)
+    barcode = await decode_image(image_bytes)
+    if not barcode:
+        raise HTTPException(status_code=400, detail="Barcode not detected in image.")
+
+    return await lookup_product(barcode, version)
+
+
+@app.post("/scan/batch")
+async def scan_batch(body: BatchScanRequest):
+    """
+    Look up to BATCH_MAX_BARCODES barcodes at once. Results stream back as
+    newline-delimited JSON, one ScanItem per distinct barcode, in completion order.
+    """
+    version = select_nutriscore_version(body.nutriscore_version)
+
+    async def lines():
+        async for items in scan_batch_items(body.barcodes, version):
+            yield "".join(item.model_dump_json() + "\n" for item in items)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/scan/{barcode}", response_model=ProductResponse)
+async def scan_barcode(barcode: str, nutriscore_version: Optional[str] = None):
+    return await lookup_product(barcode, select_nutriscore_version(nutriscore_version))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+
+import numpy as np
+
+from barcode_corpus import render_scene
+from utils.barcode_scanner import CascadeStats, detect_barcode_traced, detect_barcodes_traced
+from utils.gtin import canonical_gtin
+
+
+def test_cascade_order():
+    """Stages are ranked by hits per ms once they hit; stages without a hit keep the default order"""
+    stats = CascadeStats(["localized", "gray@0", "gray@90", "otsu@0"])
+
+    # Misses that are merely faster or slower do not move anything
+    stats.record([("localized", 80.0, False), ("gray@0", 5.0, False), ("gray@90", 1.0, False)])
+    assert stats.order() == ["localized", "gray@0", "gray@90", "otsu@0"]
+
+    # A stage that finds barcodes goes ahead of the ones that never did
+    stats.record([("localized", 80.0, False), ("gray@0", 5.0, False), ("gray@90", 6.0, True)])
+    assert stats.order() == ["gray@90", "localized", "gray@0", "otsu@0"]
+
+    # Among stages with hits, the cheaper hit wins
+    for _ in range(5):
+        stats.record([("localized", 10.0, True)])
+    assert stats.order()[:2] == ["localized", "gray@90"]
+
+    snapshot = stats.snapshot()
+    print(f"Cascade order: {[stage['stage'] for stage in snapshot['stages']]}")
+    assert (snapshot["calls"], snapshot["misses"]) == (7, 1)
+
+
+def test_upce_is_expanded():
+    """UPC-E symbols come back as UPC-A, so 8 digits that also pass as EAN-8 are never keyed as one"""
+    photo = render_scene("06604875", "UPCE", "clean", 0, (800, 600), np.random.default_rng(0))
+    barcode, _ = detect_barcode_traced(photo)
+    assert barcode == "066048000075"
+    assert canonical_gtin(barcode) == "00066048000075"
+    assert detect_barcodes_traced(photo)[0] == ["066048000075"]
+
+    ean8 = render_scene("96385074", "EAN8", "clean", 0, (800, 600), np.random.default_rng(0))
+    assert detect_barcode_traced(ean8)[0] == "96385074"
+
+
+if __name__ == "__main__":
+    test_cascade_order()
+    test_upce_is_expanded()
+    print("All barcode scanner tests passed")
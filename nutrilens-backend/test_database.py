@@ -1,16 +1,24 @@
 #!/usr/bin/env python3
 
+import asyncio
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from utils.http_client import UpstreamClient
 from utils.multi_api_database import MultiApiProductDatabase
 
 def test_database():
     """Test the database directly"""
     print("Testing MultiApiProductDatabase...")
-    
-    db = MultiApiProductDatabase()
+    asyncio.run(_search_barcodes())
+
+async def _search_barcodes():
+    async with UpstreamClient() as client:
+        db = MultiApiProductDatabase(client)
+        await _search(db)
+
+async def _search(db: MultiApiProductDatabase):
     
     # Test multiple barcodes
     test_barcodes = [
@@ -25,7 +33,7 @@ def test_database():
         print(f"Searching for barcode: {barcode}")
         print('='*50)
         
-        result = db.get_product_by_barcode(barcode)
+        result = await db.get_product_by_barcode(barcode)
         
         print(f"Result: {result}")
         
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.decode_executor import DecodeExecutor, DecodeQueueFull, DecodeTimeout
+
+
+def _pid_after(seconds: float) -> int:
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def test_queue_full_is_rejected():
+    """Jobs beyond workers + queue are refused at once instead of waiting"""
+    async def run():
+        decoder = DecodeExecutor(0, 1, timeout=5)
+        await decoder.start()
+        jobs = [asyncio.ensure_future(decoder.run(time.sleep, 0.2)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        try:
+            await decoder.run(time.sleep, 0)
+            assert False, "third job should be rejected"
+        except DecodeQueueFull:
+            pass
+        await asyncio.gather(*jobs)
+        assert await decoder.run(os.getpid) == os.getpid()
+        stats = decoder.stats()
+        print(f"Rejection: {stats}")
+        assert (stats["rejected"], stats["completed"], stats["in_flight"]) == (1, 3, 0)
+        await decoder.shutdown()
+
+    asyncio.run(run())
+
+
+def test_queued_job_timeout_is_cancelled():
+    """A job that times out before it starts never runs and frees its slot"""
+    async def run():
+        decoder = DecodeExecutor(0, 1, timeout=5)
+        await decoder.start()
+        running = asyncio.ensure_future(decoder.run(time.sleep, 0.3))
+        await asyncio.sleep(0.05)
+        try:
+            await decoder.run(os.getpid, timeout=0.05)
+            assert False, "queued job should time out"
+        except DecodeTimeout:
+            pass
+        assert decoder.stats()["in_flight"] == 1
+        await running
+        stats = decoder.stats()
+        assert (stats["timed_out"], stats["stuck"], stats["recycled"], stats["in_flight"]) == (1, 0, 0, 0)
+        await decoder.shutdown()
+
+    asyncio.run(run())
+
+
+def test_stuck_worker_is_recycled():
+    """A job still running at its deadline frees its slot and its worker process is replaced"""
+    async def run():
+        # No warm-up imports: the jobs here only sleep
+        decoder = DecodeExecutor(1, 0, timeout=0.5, initializer=None)
+        await decoder.start()
+        first_pid = await decoder.run(os.getpid)
+        try:
+            await decoder.run(_pid_after, 30)
+            assert False, "stuck job should time out"
+        except DecodeTimeout:
+            pass
+        stats = decoder.stats()
+        assert (stats["recycled"], stats["stuck"], stats["in_flight"]) == (1, 1, 0)
+
+        # Capacity is one job: without recycling this would be a DecodeQueueFull
+        second_pid = await decoder.run(os.getpid)
+        assert second_pid != first_pid
+
+        # The old worker is terminated once its callers have given up
+        for _ in range(50):
+            if decoder.stats()["stuck"] == 0:
+                break
+            await asyncio.sleep(0.1)
+        stats = decoder.stats()
+        print(f"Recycling: {stats}")
+        assert stats["stuck"] == 0
+        await decoder.shutdown()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_queue_full_is_rejected()
+    test_queued_job_timeout_is_cancelled()
+    test_stuck_worker_is_recycled()
+    print("All decode executor tests passed")
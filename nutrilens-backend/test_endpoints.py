@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Keep the app off the real data files and out of worker processes
+_data = tempfile.mkdtemp(prefix="nutrilens-test-")
+os.environ.setdefault("PRODUCT_STORE_PATH", os.path.join(_data, "products.sqlite3"))
+os.environ.setdefault("PRODUCT_CACHE_PATH", "")
+os.environ.setdefault("DECODE_WORKERS", "0")
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+from utils.gtin import canonical_gtin, gtin_check_digit
+
+client = TestClient(main.app)
+
+
+def _code(body: str) -> str:
+    return body + str(gtin_check_digit(body))
+
+
+def _product(barcode: str, name: str) -> dict:
+    return {"barcode": barcode, "name": name, "brand": "Test",
+            "nutrients": {"fat": 1.0, "sugar": 2.0, "protein": 3.0}}
+
+
+@contextmanager
+def _patched(target, **attrs):
+    saved = {name: getattr(target, name) for name in attrs}
+    try:
+        for name, value in attrs.items():
+            setattr(target, name, value)
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(target, name, value)
+
+
+def _batch(barcodes):
+    response = client.post("/scan/batch", json={"barcodes": barcodes})
+    assert response.status_code == 200 and response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_admin_routes_are_guarded():
+    """Admin routes do not exist without ADMIN_TOKEN, and need it as a bearer token once set"""
+    saved = main.ADMIN_TOKEN
+    try:
+        main.ADMIN_TOKEN = ""
+        for path in ("/admin/stats", "/admin/providers"):
+            assert client.get(path).status_code == 404, path
+            assert client.get(path, headers={"Authorization": "Bearer "}).status_code == 404, path
+
+        main.ADMIN_TOKEN = "s3cret"
+        for path in ("/admin/stats", "/admin/providers"):
+            assert client.get(path).status_code == 401, path
+            assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 401, path
+            assert client.get(path, headers={"Authorization": "s3cret"}).status_code == 401, path
+            response = client.get(path, headers={"Authorization": "Bearer s3cret"})
+            assert response.status_code == 200, path
+        assert "product_cache" in client.get("/admin/stats", headers={"Authorization": "Bearer s3cret"}).json()
+        assert not any(path.startswith("/admin") for path in client.get("/openapi.json").json()["paths"])
+        assert client.get("/health").status_code == 200
+    finally:
+        main.ADMIN_TOKEN = saved
+
+
+
+def test_batch_order_and_item_errors():
+    """Invalid codes, then local products, then upstream results as they complete; failures stay per item"""
+    local = _code("400638133393")
+    slow, fast = _code("500000000001"), _code("500000000002")
+    missing, unavailable, broken = _code("500000000003"), _code("500000000004"), _code("500000000005")
+    upca = _code("01200016115")
+    delays = {slow: 0.3, fast: 0.0, missing: 0.1, unavailable: 0.1, broken: 0.1, upca: 0.2}
+    delays = {canonical_gtin(barcode): (barcode, delay) for barcode, delay in delays.items()}
+    fetched = []
+
+    async def fetch(key):
+        fetched.append(key)
+        barcode, delay = delays[key]
+        await asyncio.sleep(delay)
+        if barcode == missing:
+            return None
+        if barcode == unavailable:
+            raise HTTPException(status_code=503, detail="Product lookup is temporarily unavailable, please retry shortly.")
+        if barcode == broken:
+            raise RuntimeError("connection reset")
+        return _product(barcode, f"Product {barcode}")
+
+    def get_local(key, version):
+        return _product(local, "Local") if key == canonical_gtin(local) else None
+
+    with _patched(main, fetch_from_openfoodfacts=fetch), _patched(main.db, get_product_by_barcode=get_local):
+        items = _batch([slow, "4006381333932", fast, local, missing, slow, unavailable, broken, upca, "0" + upca])
+
+    assert [item["barcode"] for item in items[:2]] == ["4006381333932", local]
+    assert items[0]["status"] == 400 and "check digit" in items[0]["error"]
+    assert items[1]["status"] == 200 and items[1]["product"]["name"] == "Local"
+    by_barcode = {item["barcode"]: item for item in items}
+    assert len(items) == len(by_barcode) == 9  # the repeated code is answered once
+
+    # Upstream answers arrive as they complete, not in request order
+    remote = [item["barcode"] for item in items[2:]]
+    assert remote[0] == fast and remote[-1] == slow
+    assert remote.index(upca) > remote.index(broken)
+    assert (by_barcode[missing]["status"], by_barcode[unavailable]["status"], by_barcode[broken]["status"]) == (404, 503, 500)
+    assert by_barcode[broken]["error"] == "Product lookup failed."
+
+    # Two forms of one code: one lookup, one item per form carrying the form that was sent
+    assert len(fetched) == len(set(fetched)) == 6 and canonical_gtin(local) not in fetched
+    assert by_barcode[upca]["product"]["barcode"] == upca
+    assert by_barcode["0" + upca]["product"]["barcode"] == "0" + upca
+    assert by_barcode[slow]["product"]["name"] == f"Product {slow}"
+
+
+def test_batch_concurrency():
+    """At most BATCH_CONCURRENCY upstream lookups run at once for a batch"""
+    barcodes = [_code(f"6000000000{n:02d}") for n in range(8)]
+    running, peak = 0, 0
+
+    async def fetch(key):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        return _product(key, "Remote")
+
+    with _patched(main, fetch_from_openfoodfacts=fetch, BATCH_CONCURRENCY=3), \
+            _patched(main.db, get_product_by_barcode=lambda key, version: None):
+        items = _batch(barcodes)
+    print(f"Batch of {len(barcodes)}: at most {peak} lookups in flight")
+    assert peak == 3
+    assert sorted(item["barcode"] for item in items) == sorted(barcodes)
+    assert all(item["status"] == 200 for item in items)
+
+    assert client.post("/scan/batch", json={"barcodes": []}).status_code == 422
+    assert client.post("/scan/batch", json={"barcodes": barcodes, "nutriscore_version": "1999"}).status_code == 400
+
+
+
+def test_multi_scan():
+    """?multi=true: one item per product with its own status, cached apart from the single scan of the same photo"""
+    upca, ean13 = "012000161155", "0012000161155"   # two symbols of one product
+    missing, unavailable = _code("700000000001"), _code("700000000002")
+    photo = b"\xff\xd8\xff\xe0 shelf photo for the multi scan test"
+    decodes = []
+
+    async def run(fn, image_bytes, order):
+        decodes.append(fn.__name__)
+        if fn is main.detect_barcodes_traced:
+            return [upca, ean13, missing, unavailable], []
+        return upca, []
+
+    async def fetch(key):
+        if key == canonical_gtin(missing):
+            return None
+        if key == canonical_gtin(unavailable):
+            raise HTTPException(status_code=503, detail="Product lookup is temporarily unavailable, please retry shortly.")
+        return _product(key, "Aquafina Water")
+
+    def scan(multi):
+        files = {"file": ("shelf.jpg", photo, "image/jpeg")}
+        return client.post("/scan-image", params={"multi": "true"} if multi else None, files=files)
+
+    with _patched(main.decoder, run=run), _patched(main, fetch_from_openfoodfacts=fetch), \
+            _patched(main.db, get_product_by_barcode=lambda key, version: None):
+        response = scan(multi=True)
+        assert response.status_code == 200
+        items = response.json()
+        # UPC-A and EAN-13 reads of one product share a canonical key and are listed once
+        assert [item["barcode"] for item in items] == [upca, missing, unavailable]
+        assert [item["status"] for item in items] == [200, 404, 503]
+        assert items[0]["product"]["barcode"] == upca and items[1]["error"].startswith("Product not found")
+
+        # The single scan of the same photo has its own cache entry, and both are served from cache after
+        single = scan(multi=False)
+        assert single.status_code == 200 and single.json()["barcode"] == upca
+        assert [item["barcode"] for item in scan(multi=True).json()] == [upca, missing, unavailable]
+        assert scan(multi=False).json()["barcode"] == upca
+    assert decodes == ["detect_barcodes_traced", "detect_barcode_traced"]
+
+
+def test_unknown_versions_stop_startup():
+    """A typo in NUTRISCORE_VERSION or NUTRISCORE_MATERIALIZE fails at import, not on every scan"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name, value in [("NUTRISCORE_MATERIALIZE", "2023,2099"), ("NUTRISCORE_VERSION", "2099")]:
+        env = {**os.environ, name: value}
+        result = subprocess.run([sys.executable, "-c", "import main"], cwd=here, env=env,
+                                capture_output=True, text=True)
+        assert result.returncode != 0, name
+        assert "UnknownVersion: Unknown Nutri-Score version '2099'" in result.stderr, result.stderr
+
+
+if __name__ == "__main__":
+    test_admin_routes_are_guarded()
+    test_batch_order_and_item_errors()
+    test_batch_concurrency()
+    test_multi_scan()
+    test_unknown_versions_stop_startup()
+    print("All endpoint tests passed")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.gtin import canonical_gtin, expand_upce, gtin14, gtin_check_digit, gtin_form, is_valid_barcode, is_valid_gtin, is_valid_upce
+
+# Published codes with correct check digits, by length
+VALID = {
+    8: ["96385074", "73513537"],                  # EAN-8
+    12: ["036000291452", "012000161155"],         # UPC-A
+    13: ["4006381333931", "5449000000996", "3017620422003"],  # EAN-13
+    14: ["00012345600012", "10012345678902"],     # GTIN-14
+}
+
+
+def _wrong_check_digit(code):
+    return code[:-1] + str((int(code[-1]) + 1) % 10)
+
+
+def test_check_digits():
+    """Mod-10 check digits of every GTIN length, and what is not a GTIN at all"""
+    for length, codes in VALID.items():
+        for code in codes:
+            assert len(code) == length
+            assert gtin_check_digit(code[:-1]) == int(code[-1]), code
+            assert is_valid_gtin(code), code
+            assert not is_valid_gtin(_wrong_check_digit(code)), code
+    # Lengths outside the GTIN family, non-digits, nothing at all
+    for code in ["", "9638507", "036000291", "03600029145", "123456789012345", "40063813339 1", "4006381333931\n"]:
+        assert not is_valid_gtin(code), repr(code)
+
+
+def test_expand_upce():
+    """UPC-E zero suppression undone for each final digit, number systems 0 and 1"""
+    cases = {
+        "04252614": "042100005264",   # final digit 0-2: X1 X2 d 0000 X3 X4 X5
+        "01234565": "012345000065",   # final digit 5-9: X1..X5 0000 d
+        "01234531": "012300000451",   # final digit 3: X1 X2 X3 00000 X4 X5
+        "01234543": "012340000053",   # final digit 4: X1 X2 X3 X4 00000 X5
+        "11234502": "112000003452",   # number system 1
+    }
+    for upce, upca in cases.items():
+        assert expand_upce(upce) == upca, upce
+    # Only number systems 0 and 1 exist, and UPC-E is always 8 characters
+    for code in ["24252614", "96385074", "0425261", "042526145", "0425261a"]:
+        assert expand_upce(code) is None, code
+
+
+def test_is_valid_barcode():
+    """The checksum gate, per pyzbar symbology and for typed codes"""
+    assert is_valid_barcode("4006381333931", "EAN13")
+    assert not is_valid_barcode("4006381333932", "EAN13")
+    assert is_valid_barcode("036000291452", "UPCA")
+    assert is_valid_barcode("96385074", "EAN8")
+    assert not is_valid_barcode("96385075", "EAN8")
+
+    # UPC-E checks the UPC-A expansion, not the 8 digits as an EAN-8
+    assert not is_valid_gtin("04252614")
+    assert is_valid_barcode("04252614", "UPCE")
+    assert not is_valid_barcode("04252614", "EAN8")
+    assert not is_valid_barcode("04252615", "UPCE")
+    assert is_valid_barcode("11234502", "UPCE")      # number system 1
+    assert not is_valid_barcode("11234503", "UPCE")
+    assert not is_valid_barcode("96385074", "UPCE")  # not a number system
+
+    # Typed codes (no symbology) pass as any retail symbology
+    for code in ["04252614", "96385074", "036000291452", "4006381333931", "00012345600012"]:
+        assert is_valid_barcode(code), code
+    for code in ["04252615", "96385075", "036000291453", "4006381333932", "00012345600013", "abc"]:
+        assert not is_valid_barcode(code), code
+
+
+def test_keys_and_forms():
+    """Every form of a code shares a GTIN-14 key; shorter forms come back only when no digit is lost"""
+    for code in ["012000161155", "0012000161155", "00012000161155", " 012000161155 "]:
+        assert canonical_gtin(code) == "00012000161155", code
+    assert canonical_gtin("04252614", "UPCE") == "00042100005264"
+    assert canonical_gtin("4006381333932") is None
+    assert canonical_gtin("96385074") == "00000096385074"
+
+    assert gtin14("0120-0016-1155") == "00012000161155"  # no check digit test
+    assert gtin14("") is None and gtin14("123456789012345") is None
+
+    assert gtin_form("00012000161155", 12) == "012000161155"
+    assert gtin_form("00012000161155", 13) == "0012000161155"
+    assert gtin_form("00000096385074", 8) == "96385074"
+    assert gtin_form("04006381333931", 13) == "4006381333931"
+    assert gtin_form("04006381333931", 12) is None   # the 4 would be dropped
+    assert gtin_form("10012345678902", 13) is None
+    assert gtin_form("00012000161155", 14) == "00012000161155"
+
+
+def test_ambiguous_eight_digit_codes():
+    """Typed 8-digit codes valid as both EAN-8 and UPC-E: UPC-E when they start with 0, else EAN-8"""
+    for code, expanded in [("06604875", "066048000075"), ("01234565", "012345000065")]:
+        assert is_valid_gtin(code) and expand_upce(code) == expanded, code
+        assert canonical_gtin(code) == "00" + expanded, code
+        # The symbology, when known, decides
+        assert canonical_gtin(code, "EAN8") == "000000" + code, code
+        assert canonical_gtin(code, "UPCE") == "00" + expanded, code
+        assert canonical_gtin(expanded) == canonical_gtin(code)
+
+    # Number system 1 collides with real EAN-8 prefixes, which win
+    assert is_valid_upce("10000076") and is_valid_gtin("10000076")
+    assert canonical_gtin("10000076") == "00000010000076"
+    assert canonical_gtin("10000076", "UPCE") == "00" + expand_upce("10000076")
+
+    # Valid one way only: no ambiguity to resolve
+    assert canonical_gtin("04252614") == "00042100005264"   # UPC-E only
+    assert canonical_gtin("11234502") == "00112000003452"   # UPC-E only, number system 1
+    assert canonical_gtin("96385074") == "00000096385074"   # EAN-8 only
+    assert canonical_gtin("06604876") is None
+
+
+if __name__ == "__main__":
+    test_check_digits()
+    test_expand_upce()
+    test_is_valid_barcode()
+    test_keys_and_forms()
+    test_ambiguous_eight_digit_codes()
+    print("All GTIN tests passed")
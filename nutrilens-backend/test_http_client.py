@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+
+from utils.http_client import USER_AGENT, UpstreamClient
+
+
+def test_per_host_limit():
+    """No more than max_per_host requests reach one host at a time; other hosts are not held up"""
+    async def run():
+        running, peak = {}, {}
+
+        async def handler(request):
+            host = request.url.host
+            running[host] = running.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), running[host])
+            await asyncio.sleep(0.02)
+            running[host] -= 1
+            return httpx.Response(200, json={"status": 1})
+
+        async with UpstreamClient(max_per_host=2, transport=httpx.MockTransport(handler)) as client:
+            calls = [asyncio.ensure_future(client.get(f"https://{host}/product/{n}.json"))
+                     for n in range(6) for host in ("world.openfoodfacts.org", "api.upcitemdb.com")]
+            await asyncio.sleep(0.01)
+            assert client.stats()["in_flight"] == {"world.openfoodfacts.org": 2, "api.upcitemdb.com": 2}
+            responses = await asyncio.gather(*calls)
+            assert all(response.status_code == 200 for response in responses)
+            stats = client.stats()
+            print(f"Upstream client: {stats}")
+            assert (stats["requests"], stats["errors"], stats["in_flight"]) == (12, 0, {})
+        assert peak == {"world.openfoodfacts.org": 2, "api.upcitemdb.com": 2}
+
+    asyncio.run(run())
+
+
+def test_timeouts_and_errors():
+    """Per-call timeouts reach the request; timeouts and transport errors are counted apart, HTTP statuses are not errors"""
+    async def run():
+        seen = []
+
+        async def handler(request):
+            seen.append((request.headers["User-Agent"], request.extensions["timeout"]))
+            if request.url.path == "/slow":
+                raise httpx.ReadTimeout("read timed out", request=request)
+            if request.url.path == "/down":
+                raise httpx.ConnectError("connection refused", request=request)
+            return httpx.Response(404 if request.url.path == "/missing" else 200)
+
+        client = UpstreamClient(connect_timeout=3, timeout=5, transport=httpx.MockTransport(handler))
+        assert client.stats()["open"] is False
+        await client.start()
+        assert client.stats()["open"] is True
+
+        assert (await client.get("https://example.org/ok")).status_code == 200
+        await client.get("https://example.org/ok", timeout=1.5)
+        assert (await client.get("https://example.org/missing")).status_code == 404
+        for path, error in (("/slow", httpx.TimeoutException), ("/down", httpx.ConnectError)):
+            try:
+                await client.get("https://example.org" + path)
+                assert False, f"{path} should raise"
+            except error:
+                pass
+
+        assert seen[0] == (USER_AGENT, {"connect": 3, "read": 5, "write": 5, "pool": 5})
+        assert seen[1][1] == {"connect": 1.5, "read": 1.5, "write": 1.5, "pool": 1.5}
+        stats = client.stats()
+        assert (stats["requests"], stats["timeouts"], stats["errors"]) == (5, 1, 1)
+        await client.shutdown()
+        assert client.stats()["open"] is False
+
+    asyncio.run(run())
+
+
+def test_download():
+    """Downloads stream to disk whole, and failures are counted"""
+    body = os.urandom(3 * 1024 * 1024 + 17)
+
+    def handler(request):
+        if request.url.path == "/gone.json.gz":
+            return httpx.Response(404)
+        return httpx.Response(200, content=body)
+
+    async def run(workdir):
+        async with UpstreamClient(transport=httpx.MockTransport(handler)) as client:
+            path = os.path.join(workdir, "delta.json.gz")
+            assert await client.download("https://static.openfoodfacts.org/delta.json.gz", path) == len(body)
+            with open(path, "rb") as f:
+                assert f.read() == body
+            try:
+                await client.download("https://static.openfoodfacts.org/gone.json.gz", path + ".2")
+                assert False, "404 should raise"
+            except httpx.HTTPStatusError:
+                pass
+            stats = client.stats()
+            assert (stats["requests"], stats["errors"]) == (2, 1)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(run(workdir))
+
+
+if __name__ == "__main__":
+    test_per_host_limit()
+    test_timeouts_and_errors()
+    test_download()
+    print("All HTTP client tests passed")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+
+import cv2
+import numpy as np
+
+from barcode_corpus import render_scene
+from utils.image_cache import DecodedImageCache, content_key, perceptual_hash
+
+
+def test_exact_hits():
+    """Same bytes hit, found barcodes stay until evicted, "no barcode" only for negative_ttl"""
+    cache = DecodedImageCache(max_entries=2, negative_ttl=0.05)
+    photo = b"\xff\xd8\xff photo"
+    key = content_key(photo)
+    assert content_key(bytearray(photo)) == key
+    assert cache.get(key) == (False, None)
+
+    cache.put(key, "5449000000996")
+    assert cache.get(key) == (True, "5449000000996")
+
+    cache.put("blank", None)
+    assert cache.get("blank") == (True, None)
+    time.sleep(0.06)
+    assert cache.get("blank") == (False, None)
+    assert cache.get(key) == (True, "5449000000996")  # found barcodes do not expire
+
+    # Least recently used goes first
+    cache.put("b", "4006381333931")
+    cache.get(key)
+    cache.put("c", "3017620422003")
+    assert cache.get("b") == (False, None) and cache.get(key)[0]
+
+    stats = cache.stats()
+    print(f"Image cache: {stats}")
+    assert (stats["hits"], stats["negative_hits"], stats["expired"], stats["evictions"]) == (5, 1, 1, 1)
+
+
+def test_perceptual_hits():
+    """A re-encoded copy of a photo hits by perceptual hash; a different photo does not"""
+    photo = render_scene("5449000000996", "EAN13", "clean", 0, (1600, 1200), np.random.default_rng(0))
+    other = render_scene("4006381333931", "EAN13", "rotation", 45, (1600, 1200), np.random.default_rng(1))
+    image = cv2.imdecode(np.frombuffer(photo, np.uint8), cv2.IMREAD_COLOR)
+    resent = cv2.imencode(".jpg", cv2.resize(image, (1200, 900)), [cv2.IMWRITE_JPEG_QUALITY, 60])[1].tobytes()
+
+    cache = DecodedImageCache(perceptual=True)
+    cache.put(content_key(photo), "5449000000996", perceptual_hash(photo))
+    assert cache.get(content_key(resent)) == (False, None)
+    assert cache.get_similar(perceptual_hash(resent)) == (True, "5449000000996")
+    assert cache.get_similar(perceptual_hash(other)) == (False, None)
+    assert cache.get_similar(None) == (False, None)
+    assert DecodedImageCache().get_similar(perceptual_hash(photo)) == (False, None)  # tier off
+
+
+def test_perceptual_collisions():
+    """Hashes sharing a band but further apart than max_distance do not match, and evicted hashes are forgotten"""
+    cache = DecodedImageCache(max_entries=2, perceptual=True, max_distance=4)
+    phash = 0x0123456789ABCDEF
+    cache.put("original", "5449000000996", phash)
+
+    assert cache.get_similar(phash ^ 0b111) == (True, "5449000000996")  # 3 bits apart
+    # 8 flipped bits, all in the top band: every other band still collides exactly
+    far = phash ^ (0xFF << 56)
+    assert cache.get_similar(far) == (False, None)
+
+    # Two stored photos within range of the probe: one of them is returned, never a blend
+    cache.put("neighbour", "4006381333931", phash ^ 0b11)
+    found, barcode = cache.get_similar(phash ^ 0b1)
+    assert found and barcode in ("5449000000996", "4006381333931")
+
+    cache.put("third", "3017620422003", 0)
+    cache.put("fourth", "7622210951267", 1 << 63)
+    assert cache.get_similar(phash) == (False, None)
+    assert not any(keys & {"original", "neighbour"} for keys in cache._bands.values())
+    print(f"Perceptual tier: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    test_exact_hits()
+    test_perceptual_hits()
+    test_perceptual_collisions()
+    print("All image cache tests passed")
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+
+from utils.gtin import canonical_gtin
+from utils.http_client import UpstreamClient
+from utils.multi_api_database import CACHE_NAMESPACE, IncompleteLookup, MultiApiProductDatabase
+from utils.product_cache import ProductCache
+
+OFF_HOST, UPC_HOST = "world.openfoodfacts.org", "api.upcitemdb.com"
+OFF_PRODUCT = {"status": 1, "product": {"product_name": "Coca-Cola", "brands": "Coca-Cola",
+                                        "nutriments": {"sugars_100g": 10.6, "energy-kcal_100g": 42}}}
+UPC_PRODUCT = {"code": "OK", "items": [{"title": "Coca-Cola Classic 330ml", "brand": "Coca-Cola"}]}
+
+
+class FakeProviders:
+    """MockTransport handler: per-host delays (one per attempt), answers, and a log of what was asked and cancelled"""
+
+    def __init__(self, delays, answers=None):
+        self.delays = delays
+        self.answers = {OFF_HOST: OFF_PRODUCT, UPC_HOST: UPC_PRODUCT, **(answers or {})}
+        self.requests = []
+        self.cancelled = []
+
+    async def __call__(self, request):
+        host = request.url.host
+        attempt = sum(1 for h, _ in self.requests if h == host)
+        self.requests.append((host, time.perf_counter()))
+        delays = self.delays[host]
+        try:
+            await asyncio.sleep(delays[min(attempt, len(delays) - 1)])
+        except asyncio.CancelledError:
+            self.cancelled.append((host, attempt))
+            raise
+        answer = self.answers[host]
+        if answer is None:
+            return httpx.Response(404)
+        return httpx.Response(200, json=answer)
+
+
+def _lookup(fake, barcode="5449000000996", **options):
+    """Run one lookup against the fake providers; returns (product or exception, seconds taken)"""
+    async def run():
+        async with UpstreamClient(transport=httpx.MockTransport(fake)) as client:
+            db = MultiApiProductDatabase(client, **options)
+            started = time.perf_counter()
+            try:
+                result = await db._resolve(canonical_gtin(barcode))
+            except IncompleteLookup as e:
+                result = e
+            elapsed = time.perf_counter() - started
+            for _ in range(3):
+                await asyncio.sleep(0)  # let cancelled requests unwind
+            return result, elapsed
+
+    return asyncio.run(run())
+
+
+def test_nutrition_wins_within_grace():
+    """A name-only hit that arrives first is held for the grace window; OpenFoodFacts nutrition data beats it"""
+    fake = FakeProviders({OFF_HOST: [0.1], UPC_HOST: [0.01]})
+    product, elapsed = _lookup(fake, grace=0.3)
+    assert product["source"] == "OpenFoodFacts" and product["sugar"] == 10.6
+    assert elapsed < 0.25
+
+    # Nutrition data ends the lookup at once; the slower provider is cancelled
+    fake = FakeProviders({OFF_HOST: [0.01], UPC_HOST: [2.0]})
+    product, elapsed = _lookup(fake, grace=0.3)
+    assert product["source"] == "OpenFoodFacts" and elapsed < 0.25
+    assert fake.cancelled == [(UPC_HOST, 0)]
+
+
+def test_name_only_after_grace():
+    """Once the grace window runs out the name-only hit is returned and the slow request cancelled"""
+    fake = FakeProviders({OFF_HOST: [2.0], UPC_HOST: [0.01]})
+    product, elapsed = _lookup(fake, grace=0.1, deadline=5)
+    assert product["source"] == "UPCItemDB" and product["product_name"] == "Coca-Cola Classic 330ml"
+    assert 0.1 <= elapsed < 0.5, elapsed
+    assert fake.cancelled == [(OFF_HOST, 0)]
+
+
+def test_deadline_is_not_cached_as_not_found():
+    """Providers still silent at the deadline raise IncompleteLookup, and nothing is cached"""
+    fake = FakeProviders({OFF_HOST: [2.0], UPC_HOST: [2.0]})
+    error, elapsed = _lookup(fake, deadline=0.1)
+    assert isinstance(error, IncompleteLookup) and "deadline" in str(error)
+    assert elapsed < 0.5
+    assert sorted(fake.cancelled) == [(UPC_HOST, 0), (OFF_HOST, 0)]
+
+    async def run():
+        cache = ProductCache()
+        slow = FakeProviders({OFF_HOST: [2.0], UPC_HOST: [2.0]})
+        async with UpstreamClient(transport=httpx.MockTransport(slow)) as client:
+            db = MultiApiProductDatabase(client, deadline=0.1, cache=cache)
+            assert await db.get_product_by_barcode("5449000000996") is None
+            assert await cache.get(CACHE_NAMESPACE, "05449000000996") == (False, None)
+
+            # A definite "not found" from every provider is cached
+            missing = FakeProviders({OFF_HOST: [0.0], UPC_HOST: [0.0]}, {OFF_HOST: None, UPC_HOST: None})
+            db.client = UpstreamClient(transport=httpx.MockTransport(missing))
+            assert await db.get_product_by_barcode("5449000000996") is None
+            assert await cache.get(CACHE_NAMESPACE, "05449000000996") == (True, None)
+            await db.client.shutdown()
+
+    asyncio.run(run())
+
+
+def test_hedged_request():
+    """A request slower than hedge_after is re-issued; the first answer wins and the other copy is cancelled"""
+    fake = FakeProviders({OFF_HOST: [2.0, 0.01], UPC_HOST: [0.0]}, {UPC_HOST: None})
+    product, elapsed = _lookup(fake, hedge_after=0.05)
+    assert product["source"] == "OpenFoodFacts"
+    assert elapsed < 0.5, elapsed
+    off_requests = [at for host, at in fake.requests if host == OFF_HOST]
+    # The event loop's timer may fire a few ms early by perf_counter
+    assert len(off_requests) == 2 and off_requests[1] - off_requests[0] >= 0.04
+    assert fake.cancelled == [(OFF_HOST, 0)]
+
+    # Fast answers are never hedged
+    fake = FakeProviders({OFF_HOST: [0.01], UPC_HOST: [0.0]}, {UPC_HOST: None})
+    product, _ = _lookup(fake, hedge_after=0.05)
+    assert product["source"] == "OpenFoodFacts" and len(fake.requests) == 2 and not fake.cancelled
+
+
+if __name__ == "__main__":
+    test_nutrition_wins_within_grace()
+    test_name_only_after_grace()
+    test_deadline_is_not_cached_as_not_found()
+    test_hedged_request()
+    print("All multi-API database tests passed")
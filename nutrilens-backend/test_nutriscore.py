@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import random
+import sys
+from collections import Counter
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+from utils.health_rating import (
+    calculate_health_score, calculate_nutriscore, calculate_nutriscore_2023, calculate_nutriscore_batch,
+    extract_nutrients, health_score_from_grade, nutriscore_columns,
+)
+from utils.nutriscore_rules import DEFAULT_VERSION, UnknownVersion, get_ruleset, register_ruleset, unregister_ruleset, versions
+from utils.term_matcher import TermMatcher
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "fixtures", "off_sample.jsonl")
+
+
+
+def _thresholds(field):
+    """Every threshold table any rule set compares ``field`` against"""
+    return [np.array(thresholds) for version in versions() for category in get_ruleset(version).categories.values()
+            for _, name, thresholds, _ in category.negative + category.positive if name == field]
+
+
+# Scalar field each batch column is written to in the generated products
+FIELDS = {
+    "energy_kj": ("energy-kj", _thresholds("energy_kj"), 4000),
+    "sugars": ("sugars", _thresholds("sugars"), 60),
+    "saturated_fat": ("saturated-fat", _thresholds("saturated_fat"), 15),
+    "fat": ("fat", [np.array([1.0, 10.0, 30.0])], 60),
+    "salt": ("salt", _thresholds("salt"), 3),
+    # converted when salt is 0; lands on the sodium_mg tables of 2017
+    "sodium": ("sodium", _thresholds("sodium_mg") + [np.array([80.0, 400.0, 800.0])], 1200),
+    "proteins": ("proteins", _thresholds("proteins"), 15),
+    "fiber": ("fiber", _thresholds("fiber"), 8),
+    "fruits_veg": ("fruits-vegetables-nuts-estimate-from-ingredients_100g", _thresholds("fruits_veg"), 100),
+}
+CATEGORIES = ["Beverages, Sodas", "Waters", "Fruit juice", "drinks", "Mineral water",
+              "Cheeses", "Fromages de chèvre", "Vegetable oils", "Olive oils", "Butter"]
+
+
+def _value(rng, tables, top):
+    """Mostly threshold edges (on, just below, just above), plus zeros, negatives and random values"""
+    pick = rng.random()
+    if pick < 0.15:
+        return 0.0
+    if pick < 0.6:
+        threshold = float(rng.choice(rng.choice(tables)))
+        return threshold + rng.choice([0.0, -1e-9, 1e-9, -0.05, 0.05])
+    if pick < 0.65:
+        return -rng.random()
+    return rng.random() * top
+
+
+def _random_products(count, seed=0):
+    rng = random.Random(seed)
+    products = []
+    for _ in range(count):
+        product = {field: _value(rng, tables, top) for field, tables, top in FIELDS.values()}
+        if rng.random() < 0.5:
+            product["categories"] = rng.choice(CATEGORIES)
+            if rng.random() < 0.5:
+                product["additives_tags"] = ["en:e951"] if rng.random() < 0.5 else []
+                product["ingredients_text"] = rng.choice(["water, sucralose", "water, sugar"])
+        products.append(product)
+    return products
+
+
+def _assert_parity(products, result, version=None):
+    for i, product in enumerate(products):
+        expected = calculate_nutriscore(product, version)
+        assert int(result["score"][i]) == expected["score"], (product, expected)
+        assert result["grade"][i] == expected["grade"], (product, expected)
+        assert int(result["negative_points"][i]) == expected["negative_points"]
+        assert int(result["positive_points"][i]) == expected["positive_points"]
+        assert bool(result["is_beverage"][i]) == expected["is_beverage"]
+        assert result["category"][i] == expected["category"]
+        for name, points in expected["breakdown"].items():
+            assert int(result["breakdown"][name][i]) == points, (name, product, expected)
+
+
+def test_batch_matches_scalar():
+    """Random products concentrated on the threshold edges score the same in both engines, in every version"""
+    products = _random_products(20000)
+    for version in versions():
+        result = calculate_nutriscore_batch(nutriscore_columns(products, version), version)
+        _assert_parity(products, result, version)
+        grades = dict(sorted(Counter(result["grade"].tolist()).items()))
+        print(f"Batch parity ({version}): {len(products)} products, grades {grades}")
+
+
+def test_batch_matches_scalar_on_fixture():
+    """Real OpenFoodFacts records (nested nutriments) score the same in both engines"""
+    products = []
+    with open(FIXTURE) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                calculate_nutriscore_2023(record)
+            except ValueError:
+                continue  # malformed line, or nutriments the scalar function cannot parse
+            products.append(record)
+    for version in versions():
+        _assert_parity(products, calculate_nutriscore_batch(nutriscore_columns(products, version), version), version)
+
+
+def test_batch_columns():
+    """Absent columns and NaN read as 0; a DataFrame-like mapping of columns is accepted"""
+    result = calculate_nutriscore_batch({"sugars": [50.0, float("nan")], "is_beverage": [False, True]})
+    assert list(result["breakdown"]["sugar_points"]) == [10, 0]
+    assert list(result["grade"]) == ["C", "A"]
+    assert len(calculate_nutriscore_batch({})["score"]) == 0
+    try:
+        import pandas as pd
+    except ImportError:
+        return
+    frame = pd.DataFrame({"energy_kj": [3400.0, 100.0], "salt": [2.5, 0.0], "proteins": [20.0, 0.0]})
+    assert list(calculate_nutriscore_batch(frame)["score"]) == [23, 0]
+
+
+def test_versions():
+    """Versions are picked per call; 2023 stays the default and unknown versions are refused"""
+    soda = {"categories": "Sodas", "energy-kj": 180, "sugars": 10.6, "additives_tags": ["en:e951"]}
+    assert calculate_nutriscore(soda) == calculate_nutriscore_2023(soda)
+    assert calculate_nutriscore_2023(soda)["breakdown"]["non_nutritive_sweeteners_points"] == 4
+    older = calculate_nutriscore(soda, "2017")
+    assert (older["version"], older["category"], older["grade"]) == ("2017", "beverage", "E")
+    assert "non_nutritive_sweeteners_points" not in older["breakdown"]
+    assert calculate_nutriscore({"categories": "Mineral waters", "sugars": 30}, "2017")["grade"] == "A"
+
+    # Cheese keeps its protein points however many negative points it has; other food loses them
+    cheese = {"categories": "Cheeses", "energy-kj": 1600, "saturated-fat": 18, "salt": 1.8, "proteins": 25}
+    assert calculate_nutriscore(cheese, "2017")["breakdown"]["protein_points"] == 5
+    assert calculate_nutriscore({**cheese, "categories": "Meals"}, "2017")["breakdown"]["protein_points"] == 0
+    # Added fats score saturated fat as a share of total fat
+    oil = {"categories": "Olive oils", "energy-kj": 3700, "fat": 100, "saturated-fat": 14}
+    assert calculate_nutriscore(oil, "2017")["breakdown"]["saturated_fat_points"] == 1
+    assert calculate_nutriscore({**oil, "categories": "Snacks"}, "2017")["breakdown"]["saturated_fat_points"] == 10
+
+    try:
+        calculate_nutriscore(soda, "1999")
+    except UnknownVersion:
+        pass
+    else:
+        raise AssertionError("unknown version accepted")
+
+    custom = register_ruleset("test", {"categories": {"food": {
+        "negative": {"sugar_points": {"input": "sugars", "thresholds": [10], "points": [0, 5]}},
+        "positive": {},
+        "grades": {"thresholds": [0], "letters": "AB"},
+    }}})
+    try:
+        assert get_ruleset("test") is custom
+        assert calculate_nutriscore({"sugars": 11}, "test")["grade"] == "B"
+        assert list(calculate_nutriscore_batch({"sugars": [11.0, 9.0]}, "test")["grade"]) == ["B", "A"]
+    finally:
+        unregister_ruleset("test")
+    # Gone from the compiled scorers too, not only from the tables
+    assert "test" not in versions()
+    try:
+        get_ruleset("test")
+        raise AssertionError("unregistered version still compiled")
+    except UnknownVersion:
+        pass
+    for version in ("test", DEFAULT_VERSION):
+        try:
+            unregister_ruleset(version)
+            raise AssertionError(f"{version} removed")
+        except ValueError:  # UnknownVersion for the first
+            pass
+
+
+def test_nutrient_record():
+    """One extraction serves every version and the health score; flat and nested fields read alike"""
+    nested = {"categories": "Sodas", "ingredients_text": "Water, SUCRALOSE",
+              "nutriments": {"energy-kj_100g": 0, "energy": 180, "sugars_100g": 10.6, "sodium_100g": 400}}
+    flat = {"categories": "Sodas", "ingredients_text": "water, sucralose", "energy": 180, "sugars": 10.6, "sodium": 400}
+    record = extract_nutrients(nested)
+    assert (record.energy_kj, record.sugars, record.salt, record.sodium_mg) == (180.0, 10.6, 1.0, 400.0)
+    assert record.non_nutritive_sweeteners == 1.0 and record.categories == "Sodas"
+    for version in versions():
+        expected = calculate_nutriscore(nested, version)
+        assert calculate_nutriscore(record, version) == expected == calculate_nutriscore(flat, version)
+        assert health_score_from_grade(expected["grade"]) == calculate_health_score(nested, version)
+    # Missing ingredients are not an error, whatever the category
+    assert extract_nutrients({"ingredients_text": None}).non_nutritive_sweeteners == 0.0
+
+
+def test_term_matcher():
+    """The compiled matcher finds exactly what a term-by-term scan finds, and reports labels"""
+    rng = random.Random(1)
+    for _ in range(300):
+        terms = ["".join(rng.choice("abcé") for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 12))]
+        matcher = TermMatcher(terms, terms)
+        for _ in range(30):
+            text = "".join(rng.choice("abcdÉé ") for _ in range(rng.randint(0, 12)))
+            tags = [rng.choice(terms + ["x"])]
+            expected = any(term.lower() in text.lower() or term in tags for term in terms)
+            assert matcher.matches(text, tags) == expected, (terms, text, tags)
+
+    flags = TermMatcher({"sweetener": ["aspartam", "E951", "steviol"], "milk": ["milk", "lactose"]},
+                        {"sweetener": ["en:e951"]})
+    assert flags.labels("Water, ASPARTAME, skimmed Milk", ["en:e330"]) == {"sweetener", "milk"}
+    assert flags.labels(None, ["en:e951"]) == {"sweetener"} and flags.labels("water") == set()
+    assert not TermMatcher().matches("anything", ["en:e951"])
+
+    # Categories are also recognized from categories_tags where a rule set lists tags
+    assert calculate_nutriscore({"categories_tags": ["en:cheeses"], "proteins": 25}, "2017")["category"] == "cheese"
+    assert calculate_nutriscore({"categories": "MINERAL WATER"}, "2017")["category"] == "water"
+    assert calculate_nutriscore({"categories_tags": ["en:beverages"]}, "2023")["category"] == "food"
+
+
+if __name__ == "__main__":
+    test_batch_matches_scalar()
+    test_batch_matches_scalar_on_fixture()
+    test_batch_columns()
+    test_versions()
+    test_nutrient_record()
+    test_term_matcher()
+    print("All Nutri-Score tests passed")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.product_cache import ProductCache
+
+COLA = {"code": "5449000000996", "product_name": "Coca-Cola"}
+
+
+def _rows(path):
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT namespace, key FROM product_cache ORDER BY key").fetchall()
+
+
+def test_negative_ttl():
+    """"Not found" is served for negative_ttl only, from memory and from SQLite, while products stay"""
+    async def run(path):
+        cache = ProductCache(path, ttl=60, negative_ttl=0.05)
+        await cache.open()
+        await cache.put("off", "00000000000017", None)
+        await cache.put("off", "05449000000996", COLA)
+        assert await cache.get("off", "00000000000017") == (True, None)
+
+        time.sleep(0.06)
+        assert await cache.get("off", "00000000000017") == (False, None)
+        assert await cache.get("off", "05449000000996") == (True, COLA)
+        assert _rows(path) == [("off", "05449000000996")]  # the expired row is gone from disk too
+
+        # Loader errors are not answers and are never cached
+        async def failing():
+            raise TimeoutError("upstream")
+        try:
+            await cache.get_or_load("off", "00000000000024", failing)
+            assert False, "loader error should propagate"
+        except TimeoutError:
+            pass
+        assert await cache.get("off", "00000000000024") == (False, None)
+
+        stats = cache.stats()
+        assert (stats["negative_hits"], stats["expired"], stats["load_errors"]) == (1, 2, 1)
+        await cache.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "cache.sqlite3")))
+
+
+def test_disk_promotion():
+    """After a restart entries come from SQLite once and from memory after that"""
+    async def run(path):
+        cache = ProductCache(path)
+        await cache.open()
+        await cache.put("off", "05449000000996", COLA)
+        await cache.put("off", "00000000000017", None)
+        await cache.close()
+
+        restarted = ProductCache(path)
+        await restarted.open()
+        assert restarted.stats()["memory_size"] == 0
+        assert await restarted.get("off", "05449000000996") == (True, COLA)
+        assert await restarted.get("off", "05449000000996") == (True, COLA)
+        assert await restarted.get("off", "00000000000017") == (True, None)
+        assert await restarted.get("usda", "05449000000996") == (False, None)  # namespaces are separate
+        stats = restarted.stats()
+        print(f"After restart: {stats}")
+        assert (stats["disk_hits"], stats["memory_hits"], stats["misses"], stats["memory_size"]) == (2, 1, 1, 2)
+        await restarted.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "cache.sqlite3")))
+
+
+def test_purge_and_size_cap():
+    """Expired rows are purged and the file is trimmed to max_disk_entries, soonest expiry first"""
+    async def run(path):
+        cache = ProductCache(path, ttl=60, negative_ttl=0.05, max_disk_entries=3, purge_every=100)
+        await cache.open()
+        for n in range(2):
+            await cache.put("off", f"0000000000000{n}", None)
+        time.sleep(0.06)
+        for n in range(2, 7):
+            await cache.put("off", f"0000000000000{n}", COLA)
+        assert len(_rows(path)) == 7
+
+        assert await cache.purge() == 4
+        assert [key for _, key in _rows(path)] == ["00000000000004", "00000000000005", "00000000000006"]
+        stats = cache.stats()
+        assert (stats["purged"], stats["disk_evictions"]) == (2, 2)
+
+        # Writes purge on their own every purge_every rows
+        cache.purge_every = 2
+        await cache.put("off", "00000000000007", COLA)
+        assert len(_rows(path)) == 4
+        await cache.put("off", "00000000000008", COLA)
+        assert [key for _, key in _rows(path)] == ["00000000000006", "00000000000007", "00000000000008"]
+        await cache.close()
+
+        # Opening trims a file that was written with a larger cap
+        smaller = ProductCache(path, max_disk_entries=1)
+        await smaller.open()
+        assert _rows(path) == [("off", "00000000000008")]
+        await smaller.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "cache.sqlite3")))
+
+
+if __name__ == "__main__":
+    test_negative_ttl()
+    test_disk_promotion()
+    test_purge_and_size_cap()
+    print("All product cache tests passed")
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.delta_sync import DeltaSync, DirectoryDeltaFeed
+from utils.health_rating import calculate_nutriscore, calculate_nutriscore_2023, calculate_nutriscore_batch
+from utils.materialized_scores import ScoreMaterializer, compute_scores, stored_scores
+from utils.nutrient_index import NutrientIndex, build_index, store_rows
+from utils.nutriscore_rules import NUTRISCORE_2023, register_ruleset
+from utils.off_dump import ingest_dump
+from utils.product_cache import ProductCache
+from utils.product_store import ProductStore
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "fixtures")
+JSONL_FIXTURE = os.path.join(FIXTURES, "off_sample.jsonl")
+CSV_FIXTURE = os.path.join(FIXTURES, "off_sample.csv")
+DELTA_FIXTURES = os.path.join(FIXTURES, "off_delta")
+
+
+def _fixture_records():
+    records = []
+    with open(JSONL_FIXTURE) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+
+def _ingest(fixture, workdir, compress=False):
+    dump = fixture
+    if compress:
+        dump = os.path.join(workdir, os.path.basename(fixture) + ".gz")
+        with open(fixture, "rb") as src, gzip.open(dump, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+    db_path = os.path.join(workdir, "products.sqlite3")
+    return ingest_dump(dump, db_path, batch_size=2, progress_every=0), ProductStore(db_path)
+
+
+def test_jsonl_ingestion():
+    """Gzipped JSONL dump: malformed lines and records without a barcode are skipped"""
+    with tempfile.TemporaryDirectory() as workdir:
+        stats, store = _ingest(JSONL_FIXTURE, workdir, compress=True)
+        print(f"JSONL ingestion: {stats}")
+        assert stats["products"] == 6
+        assert stats["malformed"] == 1
+        assert stats["skipped"] == 1
+
+        product = store.get_product_by_barcode("8901764112270")
+        assert product["name"] == "Parle-G Biscuits"
+        assert product["brand"] == "Parle"
+        assert product["nutrients"] == {"fat": 10, "sugar": 20, "protein": 4}
+        assert store.get_product_by_barcode("0000000000000") is None
+
+        # Unparseable nutriment values are dropped rather than stored as garbage
+        water = store.get_product_by_barcode("012000161155")
+        assert water["raw_product_data"]["nutriments"] == {"energy_100g": 0.0}
+        store.close()
+
+
+def test_barcode_forms_share_a_row():
+    """UPC-A, EAN-13 and GTIN-14 forms of a code find the same product, shown as OpenFoodFacts spells it"""
+    with tempfile.TemporaryDirectory() as workdir:
+        _, store = _ingest(JSONL_FIXTURE, workdir)
+        forms = ["012000161155", "0012000161155", "00012000161155"]
+        products = [store.get_product_by_barcode(code) for code in forms]
+        assert all(product == products[0] for product in products)
+        assert products[0]["barcode"] == "012000161155"
+        assert store.get_product_by_barcode("03017620422003")["name"] == store.get_product_by_barcode("3017620422003")["name"]
+        store.close()
+
+
+def test_scores_match_live_products():
+    """A stored product scores exactly like the full OpenFoodFacts record it came from"""
+    with tempfile.TemporaryDirectory() as workdir:
+        _, store = _ingest(JSONL_FIXTURE, workdir)
+        for record in [r for r in _fixture_records() if r.get("code")]:
+            stored = calculate_nutriscore_2023(store.get_product_by_barcode(record["code"])["raw_product_data"])
+            try:
+                live = calculate_nutriscore_2023(record)
+            except ValueError:
+                continue  # empty/non-numeric nutriments the live scorer cannot parse at all
+            assert stored == live, record["code"]
+            print(f"{record['code']}: {stored['grade']}")
+        store.close()
+
+
+def test_csv_ingestion():
+    """The tab-separated CSV export produces the same products as the JSONL export"""
+    with tempfile.TemporaryDirectory() as workdir:
+        _, jsonl_store = _ingest(JSONL_FIXTURE, os.path.join(workdir))
+        csv_dir = os.path.join(workdir, "csv")
+        os.makedirs(csv_dir)
+        stats, csv_store = _ingest(CSV_FIXTURE, csv_dir, compress=True)
+        print(f"CSV ingestion: {stats}")
+        assert stats["products"] == 6
+        for barcode in ["8901764112270", "3017620422003", "5449000131805"]:
+            assert csv_store.get_product_by_barcode(barcode) == jsonl_store.get_product_by_barcode(barcode)
+        jsonl_store.close()
+        csv_store.close()
+
+
+def test_reingest_replaces_store():
+    """A running store picks up a freshly ingested file without being reopened"""
+    with tempfile.TemporaryDirectory() as workdir:
+        _, store = _ingest(JSONL_FIXTURE, workdir)
+        assert store.get_product_by_barcode("3017620422003") is not None
+
+        partial = os.path.join(workdir, "partial.jsonl")
+        with open(partial, "w") as f:
+            f.write(json.dumps({"code": "8901764112270", "product_name": "Parle-G Gold", "nutriments": {}}) + "\n")
+        ingest_dump(partial, store.path, progress_every=0)
+
+        assert store.get_product_by_barcode("8901764112270")["name"] == "Parle-G Gold"
+        assert store.get_product_by_barcode("3017620422003") is None
+        store.close()
+
+
+def test_delta_sync():
+    """Deltas are applied once, in order, and only the touched barcodes leave the cache"""
+    async def run(store):
+        cache = ProductCache(max_entries=100)
+        for key in ["03017620422003", "03274080005003", "05449000000996"]:
+            await cache.put("openfoodfacts", key, store.get_product_by_barcode(key))
+        sync = DeltaSync(store, DirectoryDeltaFeed(DELTA_FIXTURES), cache)
+
+        first = await sync.run_once()
+        print(f"First sync: {first}")
+        assert first == {"deltas": 2, "upserted": 3, "deleted": 1, "invalidated": 2}
+        assert sync.watermark == 1760172800
+        assert (await cache.get("openfoodfacts", "03017620422003"))[0] is False
+        assert (await cache.get("openfoodfacts", "03274080005003"))[0] is False
+        assert (await cache.get("openfoodfacts", "05449000000996"))[0] is True
+
+        second = await sync.run_once()
+        assert second["deltas"] == 0
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _, store = _ingest(JSONL_FIXTURE, workdir)
+        asyncio.run(run(store))
+
+        assert store.get_product_by_barcode("3274080005003") is None
+        assert store.get_product_by_barcode("7622210951267")["name"] == "Oreo Original"
+        assert store.get_product_by_barcode("8901764112270")["nutrients"]["sugar"] == 25
+        assert store.get_product_by_barcode("3017620422003")["raw_product_data"]["nutriments"]["energy-kj_100g"] == 2255
+        assert store.stats()["products"] == 6
+        store.close()
+
+
+def test_materialized_scores():
+    """Scores stored at ingestion are served until the product or its rule set changes"""
+    def score_of(store, barcode, version="2023"):
+        product = store.get_product_by_barcode(barcode, version)
+        return product, stored_scores(product, version)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _, store = _ingest(JSONL_FIXTURE, workdir)
+        for barcode in ["8901764112270", "3017620422003", "012000161155"]:
+            product, scores = score_of(store, barcode)
+            assert scores == compute_scores(product["raw_product_data"], ["2023"])["2023"], barcode
+            assert score_of(store, barcode, "2017")[1] is None  # not materialized at ingestion
+        assert ScoreMaterializer(store, ["2023"]).stale_versions() == []
+
+        # Changed tables: stored scores stop being served until the background pass redoes them
+        changed = json.loads(json.dumps(NUTRISCORE_2023))
+        changed["categories"]["food"]["grades"]["thresholds"] = [-5, 0, 5, 10]
+        register_ruleset("2023", changed)
+        try:
+            assert score_of(store, "8901764112270")[1] is None
+            materializer = ScoreMaterializer(store, ["2023", "2017"])
+            assert materializer.stale_versions() == ["2023", "2017"]
+            result = asyncio.run(materializer.run_once())
+            assert (result["versions"], result["computed"]) == (["2023", "2017"], 12)
+            product, scores = score_of(store, "8901764112270")
+            assert scores == compute_scores(product["raw_product_data"], ["2023"])["2023"]
+            assert asyncio.run(materializer.run_once()) == {"versions": []}
+        finally:
+            register_ruleset("2023", NUTRISCORE_2023)
+
+        # Product changes: deltas rescore what they upsert and drop what they delete
+        sync = DeltaSync(store, DirectoryDeltaFeed(DELTA_FIXTURES), score_versions=["2023"])
+        asyncio.run(sync.run_once())
+        product, scores = score_of(store, "3017620422003")
+        assert product["raw_product_data"]["nutriments"]["energy-kj_100g"] == 2255
+        assert scores == compute_scores(product["raw_product_data"], ["2023"])["2023"]
+        assert score_of(store, "7622210951267")[1] is not None
+        db = sqlite3.connect(store.path)
+        assert db.execute("SELECT COUNT(*) FROM scores WHERE gtin = '03274080005003'").fetchone()[0] == 0
+
+        # A row rewritten without its score (e.g. by hand) no longer matches the stored content hash
+        with db:
+            db.execute("UPDATE products SET data = replace(data, '2255', '2256') WHERE gtin = '03017620422003'")
+        db.close()
+        assert score_of(store, "3017620422003")[1] is None
+        store.close()
+
+
+def test_scores_added_to_old_store():
+    """A store built before scores existed serves them once the materializer adds the table in place"""
+    with tempfile.TemporaryDirectory() as workdir:
+        _, store = _ingest(JSONL_FIXTURE, workdir)
+        db = sqlite3.connect(store.path)
+        with db:
+            db.execute("DROP TABLE scores")
+            db.execute("DELETE FROM meta WHERE key LIKE 'scores_rules:%'")
+        db.close()
+        product = store.get_product_by_barcode("8901764112270", "2023")
+        assert product is not None and stored_scores(product, "2023") is None
+
+        asyncio.run(ScoreMaterializer(store, ["2023"]).run_once())
+        product = store.get_product_by_barcode("8901764112270", "2023")
+        assert stored_scores(product, "2023") == compute_scores(product["raw_product_data"], ["2023"])["2023"]
+        store.close()
+
+
+def test_nutrient_index():
+    """The memory-mapped index returns the store's nutrients, whatever the barcode's leading zeros"""
+    with tempfile.TemporaryDirectory() as workdir:
+        _, store = _ingest(JSONL_FIXTURE, workdir)
+        index_dir = os.path.join(workdir, "nutrient_index")
+        build_index(store_rows(store.path), index_dir)
+        index = NutrientIndex(index_dir)
+        print(f"Nutrient index: {index.memory_report()['bytes_per_product']:.1f} bytes/product")
+        assert len(index) == 6
+
+        nutella = index.nutrients("3017620422003")
+        stored = store.get_product_by_barcode("3017620422003")["raw_product_data"]["nutriments"]
+        assert abs(nutella["sugars"] - stored["sugars_100g"]) < 1e-4
+        assert nutella["fiber"] is None  # empty in the dump
+
+        row = index.find("0012000161155")  # EAN-13 form of a UPC-A code
+        assert row >= 0 and index.name(row) == "Aquafina Water" and index.brand(row) == "Aquafina"
+        assert index.nutrients("4006381333931") is None
+        assert list(index.find_many([3017620422003, 1, 5449000131805]) >= 0) == [True, False, True]
+
+        # Categories and sweeteners are stored, so batch scores over the index match the live function
+        columns = index.scoring_columns()
+        batch = calculate_nutriscore_batch(columns)
+        for barcode in ("3017620422003", "5449000000996", "5449000131805", "012000161155"):
+            row = index.find(barcode)
+            expected = calculate_nutriscore(store.get_product_by_barcode(barcode)["raw_product_data"])
+            assert (batch["category"][row], int(batch["score"][row]), batch["grade"][row]) == \
+                (expected["category"], expected["score"], expected["grade"]), barcode
+        assert batch["category"][index.find("5449000131805")] == "beverage"
+        assert columns["non_nutritive_sweeteners"][index.find("5449000131805")]
+        assert not columns["non_nutritive_sweeteners"][index.find("5449000000996")]
+
+        # Categories belong to the rule set the index was built for
+        build_index(store_rows(store.path), index_dir, "2017")
+        index_2017 = NutrientIndex(index_dir)
+        assert index_2017.scoring_columns("2017")["category"][index_2017.find("012000161155")] == "water"
+        try:
+            index_2017.scoring_columns("2023")
+            assert False, "categories of another rule set should be refused"
+        except ValueError:
+            pass
+        store.close()
+
+
+if __name__ == "__main__":
+    test_jsonl_ingestion()
+    test_barcode_forms_share_a_row()
+    test_scores_match_live_products()
+    test_csv_ingestion()
+    test_reingest_replaces_store()
+    test_delta_sync()
+    test_materialized_scores()
+    test_scores_added_to_old_store()
+    test_nutrient_index()
+    print("All product store tests passed")
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import sys
+import time
+from email.utils import formatdate
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+
+from utils.provider_health import CLOSED, HALF_OPEN, OPEN, ProviderHealth, ProviderRegistry, ProviderUnavailable, _retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _rejected(health: ProviderHealth, reason: str) -> bool:
+    try:
+        health.acquire()
+    except ProviderUnavailable as e:
+        return e.reason == reason
+    return False
+
+
+def _throttled(retry_after=None):
+    headers = {"Retry-After": retry_after} if retry_after is not None else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("GET", "https://example.org/product"))
+
+    async def fn():
+        response.raise_for_status()
+    return fn
+
+
+def test_circuit_transitions():
+    """closed -> open on the failure share, half-open after open_for, closed on a healthy probe"""
+    clock = FakeClock()
+    health = ProviderHealth("off", min_calls=4, failure_threshold=0.5, open_for=10, max_open_for=35, clock=clock)
+    for outcome in ("hit", "miss", "error"):
+        health.record(outcome, 0.1)
+    assert health.state == CLOSED  # 3 calls, below min_calls
+    health.record("timeout", 0.1)
+    assert health.state == OPEN and _rejected(health, "circuit open")
+
+    clock.now += 9.9
+    assert health.state == OPEN
+    clock.now += 0.1
+    assert health.state == HALF_OPEN
+
+    # A failed probe reopens for twice as long, capped at max_open_for
+    assert health.acquire() is True
+    health.record("error", 0.1, probe=True)
+    assert health.state == OPEN and health.stats()["open_seconds_left"] == 20
+    clock.now += 20
+    assert health.acquire() is True
+    health.record("timeout", 0.1, probe=True)
+    assert health.stats()["open_seconds_left"] == 35
+
+    # A healthy probe closes the circuit and starts a fresh window
+    clock.now += 35
+    assert health.acquire() is True
+    health.record("miss", 0.1, probe=True)
+    assert health.state == CLOSED and health.stats()["window"] == 0
+    for _ in range(3):
+        health.record("error", 0.1)
+    assert health.state == CLOSED
+
+    # Back-off starts again from open_for
+    health.record("error", 0.1)
+    assert health.stats()["open_seconds_left"] == 10
+    stats = health.stats()
+    print(f"Breaker: {stats}")
+    assert (stats["opened"], stats["rejected_open"]) == (4, 1)
+
+
+def test_probe_is_exclusive():
+    """Half-open lets exactly one call through; a cancelled probe frees the slot for the next"""
+    clock = FakeClock()
+    health = ProviderHealth("off", min_calls=1, open_for=10, clock=clock)
+    health.record("error", 0.1)
+    clock.now += 10
+
+    assert health.acquire() is True
+    assert _rejected(health, "circuit open")
+    health.release(probe=True)
+    assert health.acquire() is True
+    health.record("hit", 0.1, probe=True)
+    assert health.acquire() is False  # closed: ordinary calls again
+    assert health.stats()["rejected_open"] == 1
+
+
+def test_retry_after():
+    """Retry-After as seconds or as an HTTP date; a 429 opens the circuit for that long"""
+    def response(value):
+        return httpx.Response(429, headers={"Retry-After": value} if value is not None else {})
+
+    assert _retry_after(response("120")) == 120
+    assert _retry_after(response("-5")) == 0
+    assert 58 <= _retry_after(response(formatdate(time.time() + 60, usegmt=True))) <= 60
+    assert _retry_after(response(formatdate(time.time() - 60, usegmt=True))) == 0
+    assert _retry_after(response("soon")) is None
+    assert _retry_after(response(None)) is None
+
+    async def run():
+        clock = FakeClock()
+        health = ProviderHealth("upcitemdb", open_for=30, clock=clock)
+        try:
+            await health.call(_throttled("90"))
+            assert False, "429 should propagate"
+        except httpx.HTTPStatusError:
+            pass
+        stats = health.stats()
+        assert (stats["state"], stats["open_seconds_left"], stats["throttled"]) == (OPEN, 90, 1)
+
+        # Without Retry-After the current back-off is used
+        clock.now += 90
+        try:
+            await health.call(_throttled())
+        except httpx.HTTPStatusError:
+            pass
+        assert health.stats()["open_seconds_left"] == 90
+
+    asyncio.run(run())
+
+
+def test_quota_rejection():
+    """A spent quota rejects calls without making them or counting a failure, and refills over time"""
+    async def run():
+        clock = FakeClock()
+        health = ProviderHealth("ean-search", quotas=[(2, 60)], min_calls=1, clock=clock)
+        calls = []
+
+        async def lookup():
+            calls.append(clock.now)
+            return {"code": "5449000000996"}
+
+        assert await health.call(lookup) and await health.call(lookup)
+        try:
+            await health.call(lookup)
+            assert False, "third call should exceed the quota"
+        except ProviderUnavailable as e:
+            assert e.reason == "quota exhausted"
+        assert len(calls) == 2 and health.state == CLOSED
+
+        clock.now += 30  # half the period refills one call
+        assert await health.call(lookup)
+        assert _rejected(health, "quota exhausted")
+
+        # A call cancelled before it answered gives its token back
+        clock.now += 30
+        health.acquire()
+        health.release()
+        assert health.acquire() is False
+
+        stats = health.stats()
+        assert (stats["calls"], stats["rejected_quota"], stats["errors"]) == (3, 2, 0)
+
+    asyncio.run(run())
+
+
+def test_registry_order():
+    """Cheapest provider first, open circuits last"""
+    clock = FakeClock()
+    registry = ProviderRegistry(min_calls=2, clock=clock)
+    for _ in range(4):
+        registry.get("slow").record("hit", 0.8)
+        registry.get("fast").record("hit", 0.1)
+        registry.get("broken").record("error", 0.01)
+    assert registry.order(["broken", "slow", "fast"]) == ["fast", "slow", "broken"]
+
+
+if __name__ == "__main__":
+    test_circuit_transitions()
+    test_probe_is_exclusive()
+    test_retry_after()
+    test_quota_rejection()
+    test_registry_order()
+    print("All provider health tests passed")
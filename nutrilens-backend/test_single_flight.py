@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.single_flight import SingleFlight
+
+
+class _Lookup:
+    """Counts executions and holds each one until released"""
+
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.executions = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.executions += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_coalescing():
+    """Concurrent calls for one key share one execution; other keys and later calls run their own"""
+    async def run():
+        flight = SingleFlight()
+        cola, water = _Lookup({"code": "5449000000996"}), _Lookup({"code": "3274080005003"})
+        calls = [asyncio.ensure_future(flight.do(("05449000000996", "2023"), cola)) for _ in range(10)]
+        calls.append(asyncio.ensure_future(flight.do(("03274080005003", "2023"), water)))
+        await asyncio.sleep(0)
+        assert flight.stats()["in_flight"] == 2
+
+        cola.release.set()
+        water.release.set()
+        results = await asyncio.gather(*calls)
+        assert all(result is results[0] for result in results[:10]) and results[10]["code"] == "3274080005003"
+        assert (cola.executions, water.executions) == (1, 1)
+
+        # Nothing is kept once the call finished
+        assert await flight.do(("05449000000996", "2023"), cola) is results[0]
+        assert cola.executions == 2
+
+        stats = flight.stats()
+        print(f"Coalescing: {stats}")
+        assert (stats["calls"], stats["executions"], stats["coalesced"], stats["max_waiters"]) == (12, 3, 9, 10)
+        assert stats["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_error_fan_out():
+    """Every waiter gets the exception of the shared call, and the next call tries again"""
+    async def run():
+        flight = SingleFlight()
+        failing = _Lookup(error=TimeoutError("upstream timed out"))
+        calls = [asyncio.ensure_future(flight.do("05449000000996", failing)) for _ in range(5)]
+        await asyncio.sleep(0)
+        failing.release.set()
+        errors = await asyncio.gather(*calls, return_exceptions=True)
+        assert all(error is failing.error for error in errors)
+        assert failing.executions == 1
+
+        recovered = _Lookup({"code": "5449000000996"})
+        recovered.release.set()
+        assert await flight.do("05449000000996", recovered) == {"code": "5449000000996"}
+        stats = flight.stats()
+        assert (stats["failed"], stats["executions"], stats["in_flight"]) == (1, 2, 0)
+
+    asyncio.run(run())
+
+
+def test_cancelled_caller():
+    """A caller that goes away does not cancel the lookup for the callers still waiting"""
+    async def run():
+        flight = SingleFlight()
+        lookup = _Lookup({"code": "5449000000996"})
+        leaving = asyncio.ensure_future(flight.do("05449000000996", lookup))
+        staying = asyncio.ensure_future(flight.do("05449000000996", lookup))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        await asyncio.sleep(0)
+        assert leaving.cancelled() and flight.stats()["in_flight"] == 1
+
+        lookup.release.set()
+        assert await staying == {"code": "5449000000996"}
+        assert lookup.executions == 1
+
+        # Even with every caller gone the lookup finishes, so its result can still be cached
+        alone = _Lookup({"code": "3274080005003"})
+        caller = asyncio.ensure_future(flight.do("03274080005003", alone))
+        await asyncio.sleep(0)
+        caller.cancel()
+        alone.release.set()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        assert flight.stats()["in_flight"] == 0 and alone.executions == 1
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_coalescing()
+    test_error_fan_out()
+    test_cancelled_caller()
+    print("All single flight tests passed")
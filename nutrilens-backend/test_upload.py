@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.upload import MULTIPART_OVERHEAD, EmptyUpload, UnsupportedUpload, UploadTooLarge, read_image_upload
+
+BOUNDARY = "nutrilens-test-boundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+JPEG = b"\xff\xd8\xff\xe0" + bytes(range(256)) * 40
+MAX_SIZE = 1024 * 1024
+
+
+def _body(*parts):
+    """multipart/form-data body of (field name, filename, data) parts"""
+    body = b""
+    for name, filename, data in parts:
+        body += (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"{name}\"; filename=\"{filename}\"\r\n"
+                 f"Content-Type: application/octet-stream\r\n\r\n").encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def _upload(body, chunk_size=7, content_type=CONTENT_TYPE, content_length=None, max_size=MAX_SIZE):
+    """Feed the body in small chunks; returns (result or exception, bytes the reader pulled)"""
+    pulled = 0
+
+    async def stream():
+        nonlocal pulled
+        for start in range(0, len(body), chunk_size):
+            chunk = body[start:start + chunk_size]
+            pulled += len(chunk)
+            yield chunk
+
+    async def run():
+        try:
+            return await read_image_upload(content_type, content_length, stream(), max_size)
+        except Exception as e:
+            return e
+
+    return asyncio.run(run()), pulled
+
+
+def test_image_is_returned():
+    """The file field comes back intact whatever the chunking, other fields are skipped"""
+    body = _body(("note", "n.txt", b"hello"), ("file", "scan.jpg", JPEG))
+    for chunk_size in (1, 7, 4096):
+        data, _ = _upload(body, chunk_size, content_length=str(len(body)))
+        assert isinstance(data, bytearray) and data == JPEG, chunk_size
+
+
+def test_size_limit():
+    """Too-large bodies are refused from Content-Length, or as soon as the file passes the limit"""
+    body = _body(("file", "big.jpg", JPEG + b"\0" * (MAX_SIZE + MULTIPART_OVERHEAD)))
+    error, pulled = _upload(body, content_length=str(len(body)))
+    assert isinstance(error, UploadTooLarge) and pulled == 0
+
+    body = _body(("file", "big.jpg", JPEG + b"\0" * MAX_SIZE))
+    error, pulled = _upload(body, chunk_size=4096, content_length=str(len(body)))  # declared length within the slack
+    assert isinstance(error, UploadTooLarge)
+    assert pulled < len(body), "the rest of the body should not be read"
+    print(f"Oversized upload rejected after {pulled} of {len(body)} bytes")
+
+    # The limit applies to the file, not to what the multipart framing adds
+    exact = JPEG + b"\0" * (MAX_SIZE - len(JPEG))
+    data, _ = _upload(_body(("file", "max.jpg", exact)), chunk_size=65536)
+    assert len(data) == MAX_SIZE
+
+
+def test_format_sniffing():
+    """Files are recognised from their first bytes, not from their name or declared type"""
+    for header in (b"\x89PNG\r\n\x1a\n", b"GIF89a", b"RIFF\0\0\0\0WEBP", b"II*\x00", b"BM"):
+        data, _ = _upload(_body(("file", "scan.bin", header + b"\0" * 64)))
+        assert isinstance(data, bytearray), header
+
+    pdf = b"%PDF-1.7\n" + b"\0" * (MAX_SIZE // 2)
+    error, pulled = _upload(_body(("file", "scan.jpg", pdf)), chunk_size=4096)
+    assert isinstance(error, UnsupportedUpload) and pulled < len(pdf)
+
+    # Shorter than the sniffing window: checked when the part ends
+    error, _ = _upload(_body(("file", "tiny.jpg", b"abc")))
+    assert isinstance(error, UnsupportedUpload)
+
+    error, _ = _upload(JPEG, content_type="image/jpeg")
+    assert isinstance(error, UnsupportedUpload)
+    error, _ = _upload(JPEG, content_type="multipart/form-data")  # no boundary
+    assert isinstance(error, UnsupportedUpload)
+
+
+def test_missing_field():
+    """No file field, or an empty one, is an EmptyUpload"""
+    error, _ = _upload(_body(("image", "scan.jpg", JPEG)))
+    assert isinstance(error, EmptyUpload) and "'file'" in str(error)
+    error, _ = _upload(_body(("file", "empty.jpg", b"")))
+    assert isinstance(error, EmptyUpload)
+
+
+if __name__ == "__main__":
+    test_image_is_returned()
+    test_size_limit()
+    test_format_sniffing()
+    test_missing_field()
+    print("All upload tests passed")
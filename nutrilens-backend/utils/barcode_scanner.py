@@ -1,93 +1,449 @@
-from pyzbar.pyzbar import decode
-from PIL import Image, ImageEnhance, ImageFilter
+from pyzbar.pyzbar import ZBarSymbol, decode
+from PIL import Image
 import io
+import threading
+import time
 import  cv2
 import numpy as np
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
+from utils.gtin import expand_upce, is_valid_barcode
 
+# Food retail only uses the EAN/UPC family; skipping QR, Code 128 etc. makes every zbar pass cheaper
+RETAIL_SYMBOLS = [ZBarSymbol.EAN13, ZBarSymbol.EAN8, ZBarSymbol.UPCA, ZBarSymbol.UPCE]
+DECODE_SYMBOLS: Optional[List[ZBarSymbol]] = RETAIL_SYMBOLS  # None = every symbology zbar knows
 
-def detect_barcode(image_data) -> Optional[str]:
+# Localization runs on a downscaled copy; crops are then cut from the full-resolution image
+LOCALIZE_MAX_SIDE = 1024
+LOCALIZE_MAX_CANDIDATES = 3
+MULTI_MAX_CANDIDATES = 20  # shelf and receipt photos carry many symbols
+LOCALIZE_MIN_AREA_RATIO = 0.002  # ignore blobs smaller than 0.2% of the frame
+LOCALIZE_MAX_AREA_RATIO = 0.5  # a barcode filling the frame is left to the full-frame cascade
+
+
+class CascadeStats:
     """
-    Detect and decode barcode from image data with enhanced preprocessing
+    Per-stage counters for the decode cascade.
+
+    Tracks how often each stage is attempted, how often it produces the barcode
+    and how long it takes, and derives the stage order from measured
+    hits-per-millisecond. Only stages that have produced a barcode are ranked
+    by their rate; stages without a hit keep their DEFAULT_STAGE_ORDER place
+    behind them, so timing noise alone never reorders the cascade.
+    """
+
+    # Added to a stage's time so its first few hits do not make it look cheaper than it is
+    PRIOR_MS = 50.0
+
+    def __init__(self, stages: List[str]):
+        self._lock = threading.Lock()
+        self._default_rank = {stage: rank for rank, stage in enumerate(stages)}
+        self._stages = {stage: {'attempts': 0, 'hits': 0, 'total_ms': 0.0} for stage in stages}
+        self._calls = 0
+        self._misses = 0
+
+    def order(self) -> List[str]:
+        """Stages sorted by measured hits per millisecond, best first"""
+        with self._lock:
+            return sorted(self._stages, key=lambda stage: (-self._rate(stage), self._default_rank[stage]))
+
+    def record(self, trace: List[Tuple[str, float, bool]]):
+        """Fold in the (stage, elapsed_ms, hit) entries of one detect call"""
+        with self._lock:
+            self._calls += 1
+            hit = False
+            for stage, elapsed_ms, stage_hit in trace:
+                entry = self._stages.get(stage)
+                if entry is None:
+                    continue
+                entry['attempts'] += 1
+                entry['total_ms'] += elapsed_ms
+                if stage_hit:
+                    entry['hits'] += 1
+                    hit = True
+            if not hit:
+                self._misses += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        order = self.order()
+        with self._lock:
+            stages = []
+            for stage in order:
+                entry = self._stages[stage]
+                attempts = entry['attempts']
+                stages.append({
+                    'stage': stage,
+                    'attempts': attempts,
+                    'hits': entry['hits'],
+                    'hit_rate': entry['hits'] / attempts if attempts else 0.0,
+                    'avg_ms': entry['total_ms'] / attempts if attempts else 0.0,
+                    'hits_per_ms': entry['hits'] / entry['total_ms'] if entry['total_ms'] else 0.0,
+                })
+            return {'calls': self._calls, 'misses': self._misses, 'stages': stages}
+
+    def _rate(self, stage: str) -> float:
+        entry = self._stages[stage]
+        if not entry['hits']:
+            return 0.0
+        return entry['hits'] / (entry['total_ms'] + self.PRIOR_MS)
+
+
+# Localized crops first, then every grayscale variant at 0/90/180/270 degrees
+BASE_VARIANTS = ['gray', 'contrast', 'sharpened', 'otsu']
+ROTATIONS = [0, 90, 180, 270]
+FULL_RES_STAGES = ['localized'] + [f"{variant}@{angle}" for variant in BASE_VARIANTS for angle in ROTATIONS]
+
+# JPEGs are first decoded at reduced scale (libjpeg DCT scaling) with only the cheap stages;
+# the full-resolution cascade runs only when those fail. Reduced stages are named "<stage>/<scale>".
+PYRAMID_SCALES = [8, 4, 2]
+PYRAMID_MIN_SIDE = 640  # skip scales whose long side would drop below this
+PYRAMID_STAGES = ['localized', 'gray@0']
+DEFAULT_STAGE_ORDER = FULL_RES_STAGES + [f"{stage}/{scale}" for scale in PYRAMID_SCALES for stage in PYRAMID_STAGES]
+
+_IMREAD_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+# Stats for in-process callers; the API keeps its own copy and passes the order to the decode pool
+cascade_stats = CascadeStats(DEFAULT_STAGE_ORDER)
+
+
+def load_grayscale(image_data, scale: int = 1) -> Optional[np.ndarray]:
+    """
+    Decode image data straight into a single uint8 grayscale array
     Args:
-        image_data: Image data (can be bytes or PIL Image)
+        image_data: Image data (bytes, PIL Image or numpy array)
+        scale: 1, 2, 4 or 8 to decode at reduced resolution (bytes only)
     Returns:
-        Barcode string if found, None otherwise
+        2D uint8 array, or None if the data could not be decoded
+    """
+    if isinstance(image_data, (bytes, bytearray, memoryview)):
+        # frombuffer wraps the upload without copying it
+        buffer = np.frombuffer(image_data, dtype=np.uint8)
+        gray = cv2.imdecode(buffer, _IMREAD_FLAGS[scale])
+        if gray is None:
+            # Formats OpenCV cannot read (e.g. GIF) still go through PIL
+            gray = np.asarray(Image.open(io.BytesIO(image_data)).convert('L'))
+        return gray
+    if isinstance(image_data, np.ndarray):
+        if image_data.ndim == 3:
+            return cv2.cvtColor(image_data, cv2.COLOR_RGB2GRAY)
+        return image_data
+    return np.asarray(image_data.convert('L'))
+
+
+def contrast_stretch(gray: np.ndarray, factor: float = 2.0) -> np.ndarray:
+    """Scale pixel distances from the mean, like PIL's ImageEnhance.Contrast, through a single LUT pass"""
+    mean = float(gray.mean())
+    lut = np.clip(mean + factor * (np.arange(256, dtype=np.float32) - mean), 0, 255).astype(np.uint8)
+    return cv2.LUT(gray, lut)
+
+
+def sharpen(gray: np.ndarray) -> np.ndarray:
+    """Unsharp mask; the blur buffer is reused for the output"""
+    blurred = cv2.GaussianBlur(gray, (0, 0), 1.0)
+    return cv2.addWeighted(gray, 2.5, blurred, -1.5, 0, dst=blurred)
+
+
+def otsu_threshold(gray: np.ndarray) -> np.ndarray:
+    """Binarize with Otsu's threshold"""
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return thresh
+
+
+class _LazyVariants:
+    """
+    Derives each grayscale variant from the decoded array on first use and keeps
+    it for the rest of the call. Rotations are transposed views, not copies.
+    """
+
+    def __init__(self, gray: np.ndarray):
+        self._variants: Dict[str, np.ndarray] = {'gray': gray}
+
+    def get(self, name: str) -> np.ndarray:
+        if name not in self._variants:
+            if name == 'contrast':
+                self._variants[name] = contrast_stretch(self.get('gray'))
+            elif name == 'sharpened':
+                self._variants[name] = sharpen(self.get('contrast'))
+            elif name == 'otsu':
+                self._variants[name] = otsu_threshold(self.get('gray'))
+            else:
+                raise KeyError(name)
+        return self._variants[name]
+
+
+def _run_stage(stage: str, variants: _LazyVariants, multi: bool = False) -> list:
+    """Run one cascade stage and return whatever pyzbar found"""
+    if stage == 'localized':
+        return decode_localized(variants.get('gray'), multi)
+    variant, angle = stage.split('@')
+    return decode_retail(np.rot90(variants.get(variant), int(angle) // 90))
+
+
+def decode_retail(image) -> list:
+    """
+    pyzbar decode restricted to DECODE_SYMBOLS, dropping results whose GTIN check digit
+    does not match so the cascade keeps looking instead of returning a misread
+    """
+    barcodes = decode(image, symbols=DECODE_SYMBOLS)
+    if DECODE_SYMBOLS is None:
+        return barcodes
+    return [barcode for barcode in barcodes
+            if is_valid_barcode(barcode.data.decode('utf-8', 'replace'), barcode.type)]
+
+
+def sniff_image_format(header: bytes) -> Optional[str]:
+    """Identify an image format from its leading bytes; None if it is not an image we decode"""
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'GIF'
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'TIFF'
+    if header.startswith(b'BM'):
+        return 'BMP'
+    return None
+
+
+def jpeg_dimensions(data) -> Optional[Tuple[int, int]]:
+    """Read (width, height) from the JPEG frame header without decoding or copying the image"""
+    view = memoryview(data)
+    offset = 2
+    while offset + 9 < len(view):
+        if view[offset] != 0xFF:
+            return None
+        marker = view[offset + 1]
+        if marker == 0xFF:  # fill byte
+            offset += 1
+            continue
+        length = (view[offset + 2] << 8) | view[offset + 3]
+        # SOF0..SOF15, excluding DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (view[offset + 5] << 8) | view[offset + 6]
+            width = (view[offset + 7] << 8) | view[offset + 8]
+            return width, height
+        offset += 2 + length
+    return None
+
+
+def _pyramid_scales(image_data) -> List[int]:
+    """Reduced scales worth trying for this upload, coarsest first (JPEG only)"""
+    if not isinstance(image_data, (bytes, bytearray, memoryview)):
+        return []
+    if sniff_image_format(bytes(image_data[:3])) != 'JPEG':
+        return []
+    size = jpeg_dimensions(image_data)
+    if size is None:
+        return []
+    return [scale for scale in PYRAMID_SCALES if max(size) // scale >= PYRAMID_MIN_SIDE]
+
+
+def _run_cascade(gray: np.ndarray, stages: List[str], trace: List[Tuple[str, float, bool]],
+                 suffix: str = '', multi: bool = False) -> List[str]:
+    """
+    Try the given stages on one image, appending to trace, until one decodes.
+    UPC-E symbols are returned in their 12-digit UPC-A form.
+    In multi mode the localized crops never end the cascade on their own: their
+    results are merged with the first full-frame stage that decodes anything.
     """
+    variants = _LazyVariants(gray)
+    found: List[str] = []
+    for stage in stages:
+        started = time.perf_counter()
+        barcodes = _run_stage(stage, variants, multi)
+        trace.append((stage + suffix, (time.perf_counter() - started) * 1000, bool(barcodes)))
+        for barcode in barcodes:
+            data = barcode.data.decode('utf-8')
+            # zbar reports UPC-E as its 8 printed digits, which can also pass as an EAN-8
+            if barcode.type == 'UPCE':
+                data = expand_upce(data) or data
+            if data not in found:
+                found.append(data)
+        if barcodes and not (multi and stage == 'localized'):
+            break
+    return found if multi else found[:1]
+
+
+def _detect(image_data, order: Optional[List[str]], pyramid: bool,
+            multi: bool) -> Tuple[List[str], List[Tuple[str, float, bool]]]:
+    trace: List[Tuple[str, float, bool]] = []
+    order = order or cascade_stats.order()
     try:
-        # Convert to PIL Image if needed
-        if isinstance(image_data, bytes):
-            image = Image.open(io.BytesIO(image_data))
-        else:
-            image = image_data
-
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-
-        # Try multiple preprocessing approaches
-        preprocessed_images = [
-            image,  # Original image
-            enhance_image_for_barcode(image),  # Enhanced image
-            image.convert('L'),  # Grayscale
-            enhance_image_for_barcode(image.convert('L'))  # Enhanced grayscale
-        ]
+        # Reduced resolution loses the small symbols that multi mode is after
+        if pyramid and not multi:
+            for scale in _pyramid_scales(image_data):
+                # The easy case never allocates the full frame
+                suffix = f"/{scale}"
+                stages = [stage[:-len(suffix)] for stage in order if stage.endswith(suffix)]
+                found = _run_cascade(load_grayscale(image_data, scale), stages, trace, suffix)
+                if found:
+                    return found, trace
 
-        # Try different rotations for the enhanced images
-        for img in preprocessed_images:
-            # Try original orientation
-            barcodes = decode(img)
-            if barcodes:
-                return barcodes[0].data.decode('utf-8')
-            
-            # Try 90-degree rotations
-            for angle in [90, 180, 270]:
-                rotated = img.rotate(angle, expand=True)
-                barcodes = decode(rotated)
-                if barcodes:
-                    return barcodes[0].data.decode('utf-8')
-        
-        return None
+        gray = load_grayscale(image_data)
+        stages = [stage for stage in order if '/' not in stage]
+        return _run_cascade(gray, stages, trace, multi=multi), trace
     except Exception as e:
         print(f"Error detecting barcode: {str(e)}")
-        return None
+        return [], trace
+
+
+def detect_barcode_traced(image_data, order: Optional[List[str]] = None,
+                          pyramid: bool = True) -> Tuple[Optional[str], List[Tuple[str, float, bool]]]:
+    """
+    Run the decode cascade and report what each stage cost
+    Args:
+        image_data: Image data (bytes, PIL Image or numpy array)
+        order: Stage order to try; defaults to the order learned by cascade_stats
+        pyramid: Try reduced-resolution JPEG decodes before the full-resolution cascade
+    Returns:
+        (barcode or None, [(stage, elapsed_ms, hit), ...] for every stage attempted)
+    """
+    found, trace = _detect(image_data, order, pyramid, multi=False)
+    return (found[0] if found else None), trace
+
+
+def detect_barcodes_traced(image_data, order: Optional[List[str]] = None) -> Tuple[List[str], List[Tuple[str, float, bool]]]:
+    """
+    Like detect_barcode_traced, but return every distinct barcode in the image
+    Args:
+        image_data: Image data (bytes, PIL Image or numpy array)
+        order: Stage order to try; defaults to the order learned by cascade_stats
+    Returns:
+        ([barcode, ...] in detection order, trace)
+    """
+    return _detect(image_data, order, pyramid=False, multi=True)
+
+def detect_barcode(image_data) -> Optional[str]:
+    """
+    Detect and decode barcode from image data with enhanced preprocessing
+    Args:
+        image_data: Image data (bytes, PIL Image or numpy array)
+    Returns:
+        Barcode string if found, None otherwise
+    """
+    barcode, trace = detect_barcode_traced(image_data)
+    cascade_stats.record(trace)
+    return barcode
+
+def decode_localized(gray: np.ndarray, multi: bool = False) -> list:
+    """
+    Decode the candidate regions found by localize_barcodes
+    Args:
+        gray: Full-resolution grayscale image as a uint8 array
+        multi: Decode every candidate region instead of stopping at the first hit
+    Returns:
+        pyzbar results for the first crop that decodes (all crops in multi mode),
+        empty list otherwise
+    """
+    results = []
+    max_candidates = MULTI_MAX_CANDIDATES if multi else LOCALIZE_MAX_CANDIDATES
+    for crop in localize_barcodes(gray, max_candidates):
+        barcodes = decode_retail(crop)
+        if not barcodes:
+            # Binarized crops rescue low-contrast and unevenly lit labels
+            barcodes = decode_retail(otsu_threshold(crop))
+        if barcodes and not multi:
+            return barcodes
+        results.extend(barcodes)
+    return results
 
-def enhance_image_for_barcode(image):
+def localize_barcodes(gray: np.ndarray, max_candidates: int = LOCALIZE_MAX_CANDIDATES) -> List[np.ndarray]:
     """
-    Apply image enhancements to improve barcode detection
+    Find regions that look like 1D barcodes and return them as upright crops
+    Args:
+        gray: Full-resolution grayscale image as a uint8 array
+        max_candidates: Maximum number of crops to return, largest first
+    Returns:
+        List of deskewed grayscale crops (may be empty)
     """
     try:
-        # Increase contrast
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(2.0)
-        
-        # Increase sharpness
-        enhancer = ImageEnhance.Sharpness(image)
-        image = enhancer.enhance(2.0)
-        
-        # Apply unsharp mask filter
-        image = image.filter(ImageFilter.UnsharpMask(radius=1, percent=150, threshold=3))
-        
-        return image
+        height, width = gray.shape[:2]
+        scale = min(1.0, LOCALIZE_MAX_SIDE / max(height, width))
+        small = gray if scale == 1.0 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        # Bars give strong gradients across them and almost none along them
+        grad_x = np.abs(cv2.Sobel(small, cv2.CV_32F, 1, 0, ksize=-1))
+        grad_y = np.abs(cv2.Sobel(small, cv2.CV_32F, 0, 1, ksize=-1))
+        frame_area = small.shape[0] * small.shape[1]
+        min_area = LOCALIZE_MIN_AREA_RATIO * frame_area
+        max_area = LOCALIZE_MAX_AREA_RATIO * frame_area
+
+        gradients = [
+            # Vertical bars (upright barcode) and horizontal bars (barcode turned 90 degrees)
+            (np.maximum(grad_x - grad_y, 0), (21, 7)),
+            (np.maximum(grad_y - grad_x, 0), (7, 21)),
+            # Plain magnitude catches barcodes sitting near 45 degrees
+            (cv2.magnitude(grad_x, grad_y) / 2, (15, 15)),
+        ]
+
+        rects = []
+        for response, kernel_size in gradients:
+            gradient = cv2.convertScaleAbs(response)
+            blurred = cv2.blur(gradient, (9, 9))
+            _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, kernel_size)
+            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+            mask = cv2.dilate(cv2.erode(mask, None, iterations=4), None, iterations=4)
+
+            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            for contour in contours:
+                area = cv2.contourArea(contour)
+                if area < min_area or area > max_area:
+                    continue
+                rect = cv2.minAreaRect(contour)
+                (rect_w, rect_h) = rect[1]
+                # Barcode blobs fill most of their bounding rectangle
+                if rect_w * rect_h == 0 or area / (rect_w * rect_h) < 0.5:
+                    continue
+                rects.append((area, rect))
+
+        rects.sort(key=lambda item: item[0], reverse=True)
+        # The passes overlap; keep one rectangle per region
+        kept = []
+        for area, rect in rects:
+            if all(np.hypot(rect[0][0] - other[0][0], rect[0][1] - other[0][1]) > min(other[1]) / 2
+                   for other in kept):
+                kept.append(rect)
+            if len(kept) == max_candidates:
+                break
+        return [_crop_rotated_rect(gray, rect, scale) for rect in kept]
     except Exception as e:
-        print(f"Error enhancing image: {str(e)}")
-        return image
+        print(f"Error localizing barcode: {str(e)}")
+        return []
+
+def _crop_rotated_rect(gray: np.ndarray, rect, scale: float, padding: float = 0.15) -> np.ndarray:
+    """Cut a rotated rectangle (found on the downscaled image) out of the full image and deskew it"""
+    (cx, cy), (w, h), angle = rect
+    cx, cy = cx / scale, cy / scale
+    # Pad so the quiet zone around the bars survives the crop
+    w = w / scale * (1 + padding) + 16
+    h = h / scale * (1 + padding) + 16
+
+    # Rotate only the axis-aligned neighbourhood of the rectangle, not the whole frame
+    half = int(np.ceil(np.hypot(w, h) / 2))
+    x0, y0 = max(int(cx) - half, 0), max(int(cy) - half, 0)
+    x1, y1 = min(int(cx) + half, gray.shape[1]), min(int(cy) + half, gray.shape[0])
+    region = gray[y0:y1, x0:x1]
+
+    center = (cx - x0, cy - y0)
+    matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+    upright = cv2.warpAffine(region, matrix, (region.shape[1], region.shape[0]),
+                             flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return cv2.getRectSubPix(upright, (int(w), int(h)), center)
 
 def opencv_preprocess(image_data):
     """
     Extra preprocessing with OpenCV for tougher barcodes
     """
     try:
-        if isinstance(image_data, bytes):
-            file_bytes = np.asarray(bytearray(image_data), dtype=np.uint8)
-            img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-        else:
-            img = cv2.cvtColor(np.array(image_data), cv2.COLOR_RGB2BGR)
-
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-
-        return Image.fromarray(thresh)
+        return Image.fromarray(otsu_threshold(load_grayscale(image_data)))
     except Exception as e:
         print(f"Error in OpenCV preprocessing: {str(e)}")
         return None
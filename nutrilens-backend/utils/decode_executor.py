@@ -0,0 +1,195 @@
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+
+class DecodeQueueFull(Exception):
+    """Raised when the decode service already holds its maximum number of jobs"""
+
+
+class DecodeTimeout(Exception):
+    """Raised when a decode job does not finish within its time budget"""
+
+
+def _warm_worker():
+    """
+    Process initializer: import the heavy imaging stack once per worker so the
+    first real job does not pay for loading PIL, OpenCV and zbar
+    """
+    import PIL.Image  # noqa: F401
+    import cv2  # noqa: F401
+    import pyzbar.pyzbar  # noqa: F401
+    import utils.barcode_scanner  # noqa: F401
+
+
+def _noop() -> int:
+    return os.getpid()
+
+
+def _worker_processes(pool: concurrent.futures.Executor) -> list:
+    """The processes of a process pool (none for a thread pool); read before shutdown, which forgets them"""
+    # ProcessPoolExecutor has no public way to stop a busy worker before Python 3.14
+    return list((getattr(pool, "_processes", None) or {}).values())
+
+
+class DecodeExecutor:
+    """
+    Runs CPU-bound barcode decoding away from the event loop.
+
+    Jobs go to a process pool so image scans scale across cores while the
+    async handlers stay responsive. At most ``max_workers + queue_size`` jobs
+    are held at once; anything beyond that is rejected with DecodeQueueFull
+    instead of piling up in memory. With ``max_workers=0`` jobs run on a
+    thread instead, which is handy for development and single-core hosts.
+
+    A job that is still running when it times out cannot be interrupted
+    (zbar does not return until it is done), so the pool is recycled: new
+    jobs go to a fresh pool at once, and the old pool's processes are
+    terminated once every job it was given has outlived its own budget. The
+    stuck job's slot is freed at recycle time, so a few pathological images
+    cannot fill the pool and turn every request into a 503. A thread cannot
+    be terminated: with ``max_workers=0`` a stuck job keeps its slot until
+    it returns. Either way, jobs still running past their budget are counted
+    under ``stuck`` in the stats.
+    """
+
+    def __init__(self, max_workers: int, queue_size: int, timeout: float,
+                 start_method: str = "spawn", initializer: Optional[Callable[[], None]] = _warm_worker):
+        self.max_workers = max(0, max_workers)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self.start_method = start_method
+        self.initializer = initializer
+        self._pool: Optional[concurrent.futures.Executor] = None
+        # job -> (pool it was submitted to, loop time its caller gives up), for jobs holding a slot
+        self._slots: Dict[concurrent.futures.Future, Tuple[concurrent.futures.Executor, float]] = {}
+        self._stuck: Set[concurrent.futures.Future] = set()  # timed out while running, not finished yet
+        self._retiring: Set["asyncio.Task[None]"] = set()
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0,
+                       "timed_out": 0, "cancelled": 0, "rejected": 0, "recycled": 0}
+
+    @property
+    def capacity(self) -> int:
+        return max(1, self.max_workers) + self.queue_size
+
+    async def start(self):
+        """Create the pool and wait until every worker has warmed up"""
+        if self._pool is not None:
+            return
+        self._pool = self._new_pool()
+        if self.max_workers == 0:
+            return
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(self._pool, _noop) for _ in range(self.max_workers)
+        ))
+
+    async def shutdown(self):
+        """Stop accepting work and tear the pool down"""
+        pool, self._pool = self._pool, None
+        # Retired pools are terminated right away instead of at the end of their grace period
+        for task in list(self._retiring):
+            task.cancel()
+        await asyncio.gather(*self._retiring, return_exceptions=True)
+        if pool is not None:
+            # A stuck thread cannot be stopped, so it is not waited for either
+            await asyncio.to_thread(pool.shutdown, wait=not self._stuck, cancel_futures=True)
+
+    async def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        """
+        Run ``fn(*args)`` in the pool and await its result.
+        Raises DecodeQueueFull when the service is saturated and DecodeTimeout
+        when the job exceeds its budget. A job that times out or whose caller
+        goes away is cancelled if it has not started yet. A job that times out
+        while running gets its process pool recycled (see the class docstring);
+        a cancelled caller's running job keeps its slot until it finishes, so
+        the bound on in-flight work stays honest.
+        """
+        if self._pool is None:
+            await self.start()
+        if len(self._slots) >= self.capacity:
+            self._stats["rejected"] += 1
+            raise DecodeQueueFull("Decode queue is full")
+
+        loop = asyncio.get_running_loop()
+        budget = timeout if timeout is not None else self.timeout
+        future = self._pool.submit(fn, *args)
+        self._slots[future] = (self._pool, loop.time() + budget)
+        self._stats["submitted"] += 1
+
+        def release(done):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._release, done)
+
+        future.add_done_callback(release)
+
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), budget)
+        except asyncio.TimeoutError:
+            self._stats["timed_out"] += 1
+            if not future.cancel():
+                self._stuck.add(future)
+                self._recycle(future)
+            raise DecodeTimeout("Decode job timed out")
+        except asyncio.CancelledError:
+            future.cancel()
+            self._stats["cancelled"] += 1
+            raise
+        except Exception:
+            self._stats["failed"] += 1
+            raise
+
+        self._stats["completed"] += 1
+        return result
+
+    def _new_pool(self) -> concurrent.futures.Executor:
+        if self.max_workers == 0:
+            return concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context(self.start_method),
+            initializer=self.initializer,
+        )
+
+    def _recycle(self, stuck: concurrent.futures.Future):
+        """Free a stuck job's slot and retire its process pool, sending new jobs to a fresh one"""
+        if self.max_workers == 0 or stuck not in self._slots:
+            return
+        pool, _ = self._slots.pop(stuck)
+        if pool is not self._pool:
+            return  # already retiring
+        self._pool = self._new_pool()
+        self._stats["recycled"] += 1
+        loop = asyncio.get_running_loop()
+        # Jobs already queued on the old pool still run there, until their callers give up
+        deadline = max((until for owner, until in self._slots.values() if owner is pool), default=loop.time())
+        task = loop.create_task(self._retire(pool, deadline - loop.time()))
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    async def _retire(self, pool: concurrent.futures.Executor, grace: float):
+        """Terminate a replaced pool once no caller is waiting on it any more"""
+        processes = _worker_processes(pool)
+        pool.shutdown(wait=False)
+        try:
+            await asyncio.sleep(max(0.0, grace))
+        finally:
+            # Their unfinished jobs fail with BrokenProcessPool, which releases them
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+
+    def _release(self, future: concurrent.futures.Future):
+        self._slots.pop(future, None)
+        self._stuck.discard(future)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "capacity": self.capacity,
+            "in_flight": len(self._slots),
+            "stuck": len(self._stuck),
+            **self._stats,
+        }
@@ -0,0 +1,264 @@
+"""
+Incremental sync of the local product store from OpenFoodFacts delta exports.
+
+OpenFoodFacts publishes the products changed in each interval as
+openfoodfacts_products_<start>_<end>.json.gz files (JSONL, same layout as the
+full export) next to an index.txt. Every delta newer than the store's sync
+watermark is applied as idempotent upserts and deletes in one transaction,
+together with the new watermark, so an interrupted sync simply resumes. Reads
+continue throughout: the store is in WAL mode, so requests see either the old
+or the new rows, never a partial delta.
+
+    python -m utils.delta_sync --source https://static.openfoodfacts.org/data/delta/
+    python -m utils.delta_sync --source data/fixtures/off_delta
+"""
+
+import asyncio
+import os
+import re
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+if __package__ in (None, ""):
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.gtin import gtin14
+from utils.http_client import UpstreamClient
+from utils.materialized_scores import score_rows
+from utils.nutriscore_rules import DEFAULT_VERSION
+from utils.off_dump import iter_dump_records, normalize_record
+from utils.product_cache import ProductCache
+from utils.product_store import ProductStore, open_for_writing, set_meta, upsert_products, upsert_scores
+
+OFF_DELTA_URL = "https://static.openfoodfacts.org/data/delta/"
+DELTA_NAME = re.compile(r"openfoodfacts_products_(\d+)_(\d+)\.jsonl?(?:\.gz)?$")
+WATERMARK_KEY = "sync_watermark"
+
+
+@dataclass
+class Delta:
+    """One changed-since file covering (start, end] in unix seconds"""
+    start: int
+    end: int
+    name: str
+
+
+def parse_delta_names(names: List[str]) -> List[Delta]:
+    """Deltas from a list of file names, oldest first; other names are ignored"""
+    deltas = []
+    for name in names:
+        match = DELTA_NAME.search(name.strip())
+        if match:
+            deltas.append(Delta(int(match.group(1)), int(match.group(2)), os.path.basename(name.strip())))
+    return sorted(deltas, key=lambda d: (d.end, d.start))
+
+
+class DirectoryDeltaFeed:
+    """Delta files in a local directory (fixtures, or deltas mirrored by another job)"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    async def list_deltas(self) -> List[Delta]:
+        return parse_delta_names(os.listdir(self.directory))
+
+    async def fetch(self, delta: Delta) -> str:
+        return os.path.join(self.directory, delta.name)
+
+    def release(self, path: str):
+        pass
+
+
+class HttpDeltaFeed:
+    """The OpenFoodFacts delta directory: index.txt plus one file per interval"""
+
+    def __init__(self, client: UpstreamClient, base_url: str = OFF_DELTA_URL):
+        self.client = client
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+
+    async def list_deltas(self) -> List[Delta]:
+        response = await self.client.get(self.base_url + "index.txt")
+        response.raise_for_status()
+        return parse_delta_names(response.text.splitlines())
+
+    async def fetch(self, delta: Delta) -> str:
+        fd, path = tempfile.mkstemp(suffix="-" + delta.name)
+        os.close(fd)
+        try:
+            await self.client.download(self.base_url + delta.name, path)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path
+
+    def release(self, path: str):
+        os.remove(path)
+
+
+def is_deletion(record: Dict[str, Any]) -> bool:
+    """Deleted products appear in deltas with a deletion flag instead of product data"""
+    return bool(record.get("deleted")) or "en:deleted" in (record.get("states_tags") or [])
+
+
+def apply_delta(db_path: str, dump_path: str, watermark: int, batch_size: int = 5000,
+                score_versions: Sequence[str] = ()) -> Tuple[Dict[str, int], Set[str]]:
+    """
+    Apply one delta file to the store in a single transaction
+    Args:
+        db_path: Product store file
+        dump_path: Delta file (JSONL, gzip or plain)
+        watermark: End of the interval the delta covers; stored with the changes
+        batch_size: Rows per upsert batch
+        score_versions: Nutri-Score versions rescored for the upserted products, in the same transaction
+    Returns:
+        (counts of upserts, deletes and skipped records, GTIN-14 keys that changed)
+    """
+    stats = {"upserted": 0, "deleted": 0, "skipped": 0, "malformed": 0}
+    changed: Set[str] = set()
+    db = open_for_writing(db_path)
+    try:
+        with db:
+            batch = []
+            scores = []
+            for record in iter_dump_records(dump_path, stats):
+                if is_deletion(record):
+                    key = gtin14(str(record.get("code") or ""))
+                    if key:
+                        db.execute("DELETE FROM products WHERE gtin = ?", (key,))
+                        db.execute("DELETE FROM scores WHERE gtin = ?", (key,))
+                        stats["deleted"] += 1
+                        changed.add(key)
+                    continue
+                row = normalize_record(record)
+                if row is None:
+                    stats["skipped"] += 1
+                    continue
+                batch.append(row)
+                scores.extend(score_rows(row[0], row[6], score_versions))
+                changed.add(row[0])
+                if len(batch) >= batch_size:
+                    upsert_products(db, batch)
+                    upsert_scores(db, scores)
+                    stats["upserted"] += len(batch)
+                    batch.clear()
+                    scores.clear()
+            upsert_products(db, batch)
+            upsert_scores(db, scores)
+            stats["upserted"] += len(batch)
+            set_meta(db, "products", str(db.execute("SELECT COUNT(*) FROM products").fetchone()[0]))
+            set_meta(db, WATERMARK_KEY, str(watermark))
+    finally:
+        db.close()
+    return stats, changed
+
+
+class DeltaSync:
+    """
+    Keeps a ProductStore current from a delta feed and drops the cache entries
+    of every barcode a delta touched, leaving the rest of the cache warm. The
+    stored scores of the changed products are recomputed with the delta.
+    """
+
+    def __init__(self, store: ProductStore, feed, cache: Optional[ProductCache] = None,
+                 score_versions: Sequence[str] = ()):
+        self.store = store
+        self.feed = feed
+        self.cache = cache
+        self.score_versions = list(score_versions)
+        self._lock = asyncio.Lock()
+        self._state: Dict[str, Any] = {"runs": 0, "failures": 0, "deltas_applied": 0, "upserted": 0,
+                                       "deleted": 0, "invalidated": 0, "last_run": None, "last_error": None}
+
+    @property
+    def watermark(self) -> int:
+        return int(self.store.get_meta(WATERMARK_KEY) or 0)
+
+    async def run_once(self) -> Dict[str, Any]:
+        """Apply every delta newer than the watermark, oldest first"""
+        async with self._lock:
+            self._state["runs"] += 1
+            summary = {"deltas": 0, "upserted": 0, "deleted": 0, "invalidated": 0}
+            try:
+                if not os.path.exists(self.store.path):
+                    raise RuntimeError(f"Product store {self.store.path} does not exist; run the full ingestion first")
+                for delta in await self.feed.list_deltas():
+                    if delta.end <= self.watermark:
+                        continue
+                    path = await self.feed.fetch(delta)
+                    try:
+                        stats, changed = await asyncio.to_thread(
+                            apply_delta, self.store.path, path, delta.end, score_versions=self.score_versions)
+                    finally:
+                        self.feed.release(path)
+                    invalidated = await self.cache.invalidate_many(sorted(changed)) if self.cache else 0
+                    print(f"Applied delta {delta.name}: {stats['upserted']} upserted, "
+                          f"{stats['deleted']} deleted, {invalidated} cache entries dropped")
+                    summary["deltas"] += 1
+                    summary["upserted"] += stats["upserted"]
+                    summary["deleted"] += stats["deleted"]
+                    summary["invalidated"] += invalidated
+                self._state["last_error"] = None
+            except Exception as e:
+                self._state["failures"] += 1
+                self._state["last_error"] = str(e)
+                print(f"Error syncing product store: {e}")
+                raise
+            finally:
+                self._state["last_run"] = time.time()
+                self._state["deltas_applied"] += summary["deltas"]
+                for key in ("upserted", "deleted", "invalidated"):
+                    self._state[key] += summary[key]
+            return summary
+
+    async def run_forever(self, interval: float):
+        """Sync every ``interval`` seconds until cancelled; failures are retried on the next round"""
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                pass
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"watermark": self.watermark, **self._state}
+
+
+def make_feed(source: str, client: UpstreamClient):
+    """A local directory or an http(s) URL of a delta directory"""
+    if source.startswith(("http://", "https://")):
+        return HttpDeltaFeed(client, source)
+    return DirectoryDeltaFeed(source)
+
+
+async def _sync_once(db_path: str, source: str, cache_path: Optional[str], score_versions: List[str]):
+    cache = ProductCache(cache_path) if cache_path else None
+    async with UpstreamClient() as client:
+        if cache:
+            await cache.open()
+        try:
+            summary = await DeltaSync(ProductStore(db_path), make_feed(source, client), cache, score_versions).run_once()
+        finally:
+            if cache:
+                await cache.close()
+    print(f"Sync complete: {summary}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+    parser = argparse.ArgumentParser(description="Apply OpenFoodFacts delta exports to the local product store")
+    parser.add_argument("--db", default=os.getenv("PRODUCT_STORE_PATH", os.path.join(data_dir, "products.sqlite3")))
+    parser.add_argument("--source", default=os.getenv("PRODUCT_SYNC_SOURCE", OFF_DELTA_URL),
+                        help="delta directory URL or local directory")
+    parser.add_argument("--cache", default=os.getenv("PRODUCT_CACHE_PATH", os.path.join(data_dir, "product_cache.sqlite3")),
+                        help="product cache file whose entries for changed barcodes are dropped")
+    parser.add_argument("--score-versions", default=os.getenv("NUTRISCORE_MATERIALIZE", DEFAULT_VERSION),
+                        help="comma-separated Nutri-Score versions rescored for changed products (empty for none)")
+    args = parser.parse_args()
+
+    versions = [version for version in args.score_versions.split(",") if version]
+    asyncio.run(_sync_once(args.db, args.source, args.cache or None, versions))
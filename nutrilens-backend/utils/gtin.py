@@ -0,0 +1,116 @@
+from typing import Optional
+
+# Lengths of the GTIN family: EAN-8, UPC-A (GTIN-12), EAN-13, GTIN-14
+GTIN_LENGTHS = (8, 12, 13, 14)
+
+
+def gtin_check_digit(body: str) -> int:
+    """Mod-10 check digit for the digits of a GTIN without its final check digit"""
+    total = 0
+    # Weights alternate 3, 1, 3, ... starting from the digit next to the check digit
+    for position, digit in enumerate(reversed(body)):
+        total += int(digit) * (3 if position % 2 == 0 else 1)
+    return (10 - total % 10) % 10
+
+
+def is_valid_gtin(code: str) -> bool:
+    """True for an all-digit EAN-8/UPC-A/EAN-13/GTIN-14 whose check digit matches"""
+    if not code.isdigit() or len(code) not in GTIN_LENGTHS:
+        return False
+    return gtin_check_digit(code[:-1]) == int(code[-1])
+
+
+def expand_upce(code: str) -> Optional[str]:
+    """
+    Expand an 8-digit UPC-E (number system, 6 digits, check digit) to its 12-digit UPC-A form
+    Returns None if the code is not shaped like UPC-E
+    """
+    if len(code) != 8 or not code.isdigit() or code[0] not in "01":
+        return None
+    system, d, check = code[0], code[1:7], code[7]
+    last = d[5]
+    if last in "012":
+        body = d[0:2] + last + "0000" + d[2:5]
+    elif last == "3":
+        body = d[0:3] + "00000" + d[3:5]
+    elif last == "4":
+        body = d[0:4] + "00000" + d[4]
+    else:
+        body = d[0:5] + "0000" + last
+    return system + body + check
+
+
+def is_valid_upce(code: str) -> bool:
+    """True for an 8-digit UPC-E whose expanded UPC-A check digit matches"""
+    expanded = expand_upce(code)
+    return expanded is not None and is_valid_gtin(expanded)
+
+
+def is_valid_barcode(code: str, symbology: Optional[str] = None) -> bool:
+    """
+    Checksum gate for retail barcodes
+    Args:
+        code: Decoded or typed digits
+        symbology: pyzbar symbol type when known ('UPCE' is validated on its UPC-A expansion)
+    Returns:
+        True if the check digit is consistent for the symbology (or any retail symbology when unknown)
+    """
+    if symbology == "UPCE":
+        return is_valid_upce(code)
+    if is_valid_gtin(code):
+        return True
+    # Typed 8-digit codes can be either EAN-8 or UPC-E
+    return symbology is None and is_valid_upce(code)
+
+
+def gtin14(code: str) -> Optional[str]:
+    """
+    Zero-padded 14-digit key of a 1-14 digit code, without checking the check digit.
+    UPC-A 012000161155, EAN-13 0012000161155 and GTIN-14 00012000161155 share one key.
+    """
+    digits = "".join(ch for ch in code if ch.isdigit())
+    if not digits or len(digits) > 14:
+        return None
+    return digits.zfill(14)
+
+
+def canonical_gtin(code: str, symbology: Optional[str] = None) -> Optional[str]:
+    """
+    Canonical GTIN-14 key of a retail barcode, or None if its check digit is wrong
+    Args:
+        code: Decoded or typed digits
+        symbology: pyzbar symbol type when known; UPC-E is keyed by its UPC-A expansion
+    """
+    code = code.strip()
+    if symbology is None and len(code) == 8:
+        upce = _reads_as_upce(code)
+    else:
+        upce = symbology == "UPCE"
+    if upce:
+        code = expand_upce(code) or ""
+    if not is_valid_gtin(code):
+        return None
+    return code.zfill(14)
+
+
+def _reads_as_upce(code: str) -> bool:
+    """
+    Whether 8 digits without a symbology are a UPC-E rather than an EAN-8.
+    Many codes pass both check digits (06604875 is EAN-8 06604875 and UPC-E 066048000075).
+    EAN-8 codes starting with 0 are restricted-circulation numbers that are never on traded
+    products, so those read as UPC-E; otherwise EAN-8 wins and UPC-E is the fallback.
+    """
+    if not is_valid_upce(code):
+        return False
+    return code[0] == "0" or not is_valid_gtin(code)
+
+
+def gtin_form(key: str, length: int) -> Optional[str]:
+    """
+    Shorter form of a GTIN-14 key: 13 for EAN-13, 12 for UPC-A, 8 for EAN-8.
+    None if the key has significant digits in the part that would be dropped.
+    """
+    drop = len(key) - length
+    if drop < 0 or key[:drop].strip("0"):
+        return None
+    return key[drop:]
@@ -1,356 +1,179 @@
-from typing import Any, Dict
+from typing import Any, Dict, Iterable, Mapping, Optional, Union
 
-def calculate_nutriscore_2023(nutrition_data: Dict[str, Any]) -> Dict[str, Any]:
+import numpy as np
+
+from utils.nutriscore_rules import get_ruleset
+from utils.term_matcher import TermMatcher
+
+# Common non-nutritive sweeteners, looked for among the additive tags and in the ingredients text
+NON_NUTRITIVE_SWEETENER_TERMS = [
+    'en:e950', 'en:e951', 'en:e952', 'en:e954', 'en:e955', 'en:e957', 'en:e959',
+    'en:e960', 'en:e961', 'en:e962', 'en:e969', 'aspartam', 'acesulfam',
+    'stevia', 'sucralose', 'steviol'
+]
+NON_NUTRITIVE_SWEETENERS = TermMatcher(NON_NUTRITIVE_SWEETENER_TERMS, NON_NUTRITIVE_SWEETENER_TERMS)
+
+def calculate_nutriscore(nutrition_data: Union[Dict[str, Any], 'NutrientRecord'],
+                         version: Optional[str] = None) -> Dict[str, Any]:
     """
-    Calculate Nutri-Score 2023 algorithm
+    Calculate the Nutri-Score with the rule set of a version (see utils.nutriscore_rules)
+    Args:
+        nutrition_data: OpenFoodFacts product, flat per-100g values, or their NutrientRecord
+        version: Rule set version (default: nutriscore_rules.DEFAULT_VERSION); raises UnknownVersion if unknown
     Returns: {
         'score': int,
         'grade': str,
         'negative_points': int,
         'positive_points': int,
-        'is_beverage': bool
+        'is_beverage': bool,
+        'category': str,
+        'version': str,
+        'breakdown': {<component>_points: int}
     }
     """
-    
-    # Extract nutritional values (per 100g/ml)
-    energy_kj = float(nutrition_data.get('energy-kj', nutrition_data.get('energy', 0)))
+    ruleset = get_ruleset(version)
+    record = nutrition_data if isinstance(nutrition_data, NutrientRecord) else extract_nutrients(nutrition_data)
+    return ruleset.score(record, ruleset.category(record.categories, record.categories_tags))
+
+def calculate_nutriscore_2023(nutrition_data: Union[Dict[str, Any], 'NutrientRecord']) -> Dict[str, Any]:
+    """Calculate Nutri-Score 2023 algorithm (see calculate_nutriscore)"""
+    return calculate_nutriscore(nutrition_data, "2023")
+
+class NutrientRecord:
+    """
+    Every input of the Nutri-Score rule sets for one product, per 100g/ml and named
+    like the batch columns. Built once per product by extract_nutrients and shared
+    by the Nutri-Score and the health score.
+    """
+    __slots__ = ('energy_kj', 'sugars', 'saturated_fat', 'fat', 'salt', 'sodium', 'proteins', 'fiber',
+                 'fruits_veg', 'sodium_mg', 'saturated_fat_ratio', 'non_nutritive_sweeteners', 'categories',
+                 'categories_tags')
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'NutrientRecord({fields})'
+
+def extract_nutrients(nutrition_data: Dict[str, Any]) -> NutrientRecord:
+    """
+    Read every scoring input of a product in one pass
+    Args:
+        nutrition_data: OpenFoodFacts product (nested nutriments), or flat per-100g values
+    Returns: NutrientRecord; a top-level field wins, nutriments are read while a value is still 0
+    """
+    get = nutrition_data.get
+    nutriments = get('nutriments', {})
+    record = NutrientRecord()
+
+    energy_kj = float(get('energy-kj', get('energy', 0)))
     if energy_kj == 0:
-        # Try alternative field names from OpenFoodFacts
-        energy_kj = float(nutrition_data.get('nutriments', {}).get('energy-kj_100g', 0))
-        if energy_kj == 0:
-            energy_kj = float(nutrition_data.get('nutriments', {}).get('energy', 0))
-    
-    sugars = float(nutrition_data.get('sugars', nutrition_data.get('sugar', 0)))
+        energy_kj = float(nutriments.get('energy-kj_100g', 0)) or float(nutriments.get('energy', 0))
+    sugars = float(get('sugars', get('sugar', 0)))
     if sugars == 0:
-        # Try alternative field names from OpenFoodFacts
-        sugars = float(nutrition_data.get('nutriments', {}).get('sugars_100g', 0))
-        if sugars == 0:
-            sugars = float(nutrition_data.get('nutriments', {}).get('sugars', 0))
-    
-    saturated_fat = float(nutrition_data.get('saturated-fat', nutrition_data.get('saturated_fat', 0)))
-    if saturated_fat == 0:
-        # Try alternative field names from OpenFoodFacts
-        saturated_fat = float(nutrition_data.get('nutriments', {}).get('saturated-fat_100g', 0))
-    
-    salt = float(nutrition_data.get('salt', 0))
-    if salt == 0:
-        # Try alternative field names from OpenFoodFacts
-        salt = float(nutrition_data.get('nutriments', {}).get('salt_100g', 0))
-    
-    sodium = float(nutrition_data.get('sodium', 0))
-    if sodium == 0:
-        # Try alternative field names from OpenFoodFacts
-        sodium = float(nutrition_data.get('nutriments', {}).get('sodium_100g', 0))
-        
-    protein = float(nutrition_data.get('proteins', nutrition_data.get('protein', 0)))
-    if protein == 0:
-        # Try alternative field names from OpenFoodFacts
-        protein = float(nutrition_data.get('nutriments', {}).get('proteins_100g', 0))
-    
-    fiber = float(nutrition_data.get('fiber', 0))
-    if fiber == 0:
-        # Try alternative field names from OpenFoodFacts
-        fiber = float(nutrition_data.get('nutriments', {}).get('fiber_100g', 0))
-    
-    fruits_veg = float(nutrition_data.get('fruits-vegetables-nuts-estimate-from-ingredients_100g', 0))
-    if fruits_veg == 0:
-        # Try alternative field names from OpenFoodFacts
-        fruits_veg = float(nutrition_data.get('nutriments', {}).get('fruits-vegetables-nuts-estimate-from-ingredients_100g', 0))
-    
-    # Convert sodium to salt if salt is 0
+        sugars = float(nutriments.get('sugars_100g', 0)) or float(nutriments.get('sugars', 0))
+    saturated_fat = float(get('saturated-fat', get('saturated_fat', 0))) or float(nutriments.get('saturated-fat_100g', 0))
+    fat = float(get('fat', 0)) or float(nutriments.get('fat_100g', 0))
+    salt = float(get('salt', 0)) or float(nutriments.get('salt_100g', 0))
+    sodium = float(get('sodium', 0)) or float(nutriments.get('sodium_100g', 0))
     if salt == 0 and sodium > 0:
         salt = sodium * 2.5 / 1000  # Convert mg sodium to g salt
-    
-    # Determine if it's a beverage (categories contain beverage indicators)
-    categories = nutrition_data.get('categories', '').lower()
-    is_beverage = any(term in categories for term in ['beverage', 'drink', 'water', 'soda', 'juice'])
-    
-    # NEGATIVE POINTS
-    negative_points = 0
-    
-    # Energy points (different for beverages vs food)
-    if is_beverage:
-        if energy_kj <= 0:
-            energy_points = 0
-        elif energy_kj <= 30:
-            energy_points = 1
-        elif energy_kj <= 60:
-            energy_points = 2
-        elif energy_kj <= 90:
-            energy_points = 3
-        elif energy_kj <= 120:
-            energy_points = 4
-        elif energy_kj <= 150:
-            energy_points = 5
-        elif energy_kj <= 180:
-            energy_points = 6
-        elif energy_kj <= 210:
-            energy_points = 7
-        elif energy_kj <= 240:
-            energy_points = 8
-        elif energy_kj <= 270:
-            energy_points = 9
-        else:
-            energy_points = 10
-    else:
-        if energy_kj <= 335:
-            energy_points = 0
-        elif energy_kj <= 670:
-            energy_points = 1
-        elif energy_kj <= 1005:
-            energy_points = 2
-        elif energy_kj <= 1340:
-            energy_points = 3
-        elif energy_kj <= 1675:
-            energy_points = 4
-        elif energy_kj <= 2010:
-            energy_points = 5
-        elif energy_kj <= 2345:
-            energy_points = 6
-        elif energy_kj <= 2680:
-            energy_points = 7
-        elif energy_kj <= 3015:
-            energy_points = 8
-        elif energy_kj <= 3350:
-            energy_points = 9
-        else:
-            energy_points = 10
-    
-    negative_points += energy_points
-    
-    # Sugar points (different for beverages vs food)
-    if is_beverage:
-        if sugars <= 0:
-            sugar_points = 0
-        elif sugars <= 1.5:
-            sugar_points = 1
-        elif sugars <= 3:
-            sugar_points = 2
-        elif sugars <= 4.5:
-            sugar_points = 3
-        elif sugars <= 6:
-            sugar_points = 4
-        elif sugars <= 7.5:
-            sugar_points = 5
-        elif sugars <= 9:
-            sugar_points = 6
-        elif sugars <= 10.5:
-            sugar_points = 7
-        elif sugars <= 12:
-            sugar_points = 8
-        elif sugars <= 13.5:
-            sugar_points = 9
-        else:
-            sugar_points = 10
-    else:
-        if sugars <= 4.5:
-            sugar_points = 0
-        elif sugars <= 9:
-            sugar_points = 1
-        elif sugars <= 13.5:
-            sugar_points = 2
-        elif sugars <= 18:
-            sugar_points = 3
-        elif sugars <= 22.5:
-            sugar_points = 4
-        elif sugars <= 27:
-            sugar_points = 5
-        elif sugars <= 31:
-            sugar_points = 6
-        elif sugars <= 36:
-            sugar_points = 7
-        elif sugars <= 40:
-            sugar_points = 8
-        elif sugars <= 45:
-            sugar_points = 9
-        else:
-            sugar_points = 10
-    
-    negative_points += sugar_points
-    
-    # Saturated fat points
-    if saturated_fat <= 1:
-        sat_fat_points = 0
-    elif saturated_fat <= 2:
-        sat_fat_points = 1
-    elif saturated_fat <= 3:
-        sat_fat_points = 2
-    elif saturated_fat <= 4:
-        sat_fat_points = 3
-    elif saturated_fat <= 5:
-        sat_fat_points = 4
-    elif saturated_fat <= 6:
-        sat_fat_points = 5
-    elif saturated_fat <= 7:
-        sat_fat_points = 6
-    elif saturated_fat <= 8:
-        sat_fat_points = 7
-    elif saturated_fat <= 9:
-        sat_fat_points = 8
-    elif saturated_fat <= 10:
-        sat_fat_points = 9
-    else:
-        sat_fat_points = 10
-    
-    negative_points += sat_fat_points
-    
-    # Salt points (same for beverages and food)
-    if salt <= 0.2:
-        salt_points = 0
-    elif salt <= 0.4:
-        salt_points = 1
-    elif salt <= 0.6:
-        salt_points = 2
-    elif salt <= 0.8:
-        salt_points = 3
-    elif salt <= 1.0:
-        salt_points = 4
-    elif salt <= 1.2:
-        salt_points = 5
-    elif salt <= 1.4:
-        salt_points = 6
-    elif salt <= 1.6:
-        salt_points = 7
-    elif salt <= 1.8:
-        salt_points = 8
-    elif salt <= 2.0:
-        salt_points = 9
-    else:
-        salt_points = 20  # Maximum for salt
-    
-    negative_points += salt_points
-    
-    # Non-nutritive sweeteners (2023 addition for beverages)
-    non_nutritive_sweeteners_points = 0
-    if is_beverage:
-        # Check for non-nutritive sweeteners in ingredients
-        additives = nutrition_data.get('additives_tags', [])
-        ingredients_text = nutrition_data.get('ingredients_text', '').lower()
-        
-        sweetener_count = 0
-        # Common non-nutritive sweeteners
-        non_nutritive_sweeteners = [
-            'en:e950', 'en:e951', 'en:e952', 'en:e954', 'en:e955', 'en:e957', 'en:e959',
-            'en:e960', 'en:e961', 'en:e962', 'en:e969', 'aspartam', 'acesulfam',
-            'stevia', 'sucralose', 'steviol'
-        ]
-        
-        for sweetener in non_nutritive_sweeteners:
-            if sweetener in additives or sweetener in ingredients_text:
-                sweetener_count += 1
-                break  # Count as 1 if any found
-        
-        if sweetener_count > 0:
-            non_nutritive_sweeteners_points = 4
-    
-    negative_points += non_nutritive_sweeteners_points
-    
-    # POSITIVE POINTS
-    positive_points = 0
-    
-    # Protein points
-    if protein <= 1.6:
-        protein_points = 0
-    elif protein <= 3.2:
-        protein_points = 1
-    elif protein <= 4.8:
-        protein_points = 2
-    elif protein <= 6.4:
-        protein_points = 3
-    elif protein <= 8.0:
-        protein_points = 4
-    elif protein <= 9.6:
-        protein_points = 5
-    elif protein <= 11.2:
-        protein_points = 6
-    else:
-        protein_points = 7
-    
-    positive_points += protein_points
-    
-    # Fiber points
-    if fiber <= 0.9:
-        fiber_points = 0
-    elif fiber <= 1.9:
-        fiber_points = 1
-    elif fiber <= 2.8:
-        fiber_points = 2
-    elif fiber <= 3.7:
-        fiber_points = 3
-    elif fiber <= 4.7:
-        fiber_points = 4
-    else:
-        fiber_points = 5
-    
-    positive_points += fiber_points
-    
-    # Fruits/vegetables/legumes points
-    if fruits_veg <= 40:
-        fvl_points = 0
-    elif fruits_veg <= 60:
-        fvl_points = 1
-    elif fruits_veg <= 80:
-        fvl_points = 2
-    else:
-        fvl_points = 6  # Maximum for fruits/veg
-    
-    positive_points += fvl_points
-    
-    # Calculate final score
-    final_score = negative_points - positive_points
-    
-    # Determine grade based on beverage vs food thresholds
-    if is_beverage:
-        if final_score <= 1:
-            grade = 'A'
-        elif final_score <= 5:
-            grade = 'B'
-        elif final_score <= 9:
-            grade = 'C'
-        elif final_score <= 13:
-            grade = 'D'
-        else:
-            grade = 'E'
-    else:
-        if final_score <= -1:
-            grade = 'A'
-        elif final_score <= 2:
-            grade = 'B'
-        elif final_score <= 10:
-            grade = 'C'
-        elif final_score <= 18:
-            grade = 'D'
-        else:
-            grade = 'E'
-    
-    return {
-        'score': final_score,
-        'grade': grade,
-        'negative_points': negative_points,
-        'positive_points': positive_points,
-        'is_beverage': is_beverage,
-        'breakdown': {
-            'energy_points': energy_points,
-            'sugar_points': sugar_points,
-            'saturated_fat_points': sat_fat_points,
-            'salt_points': salt_points,
-            'non_nutritive_sweeteners_points': non_nutritive_sweeteners_points,
-            'protein_points': protein_points,
-            'fiber_points': fiber_points,
-            'fruits_veg_points': fvl_points
-        }
+
+    record.energy_kj = energy_kj
+    record.sugars = sugars
+    record.saturated_fat = saturated_fat
+    record.fat = fat
+    record.salt = salt
+    record.sodium = sodium
+    record.proteins = float(get('proteins', get('protein', 0))) or float(nutriments.get('proteins_100g', 0))
+    record.fiber = float(get('fiber', 0)) or float(nutriments.get('fiber_100g', 0))
+    record.fruits_veg = (float(get('fruits-vegetables-nuts-estimate-from-ingredients_100g', 0))
+                         or float(nutriments.get('fruits-vegetables-nuts-estimate-from-ingredients_100g', 0)))
+    # Derived inputs of the 2017 rules: sodium in mg, saturated fat as a share of fat
+    record.sodium_mg = salt * 400
+    record.saturated_fat_ratio = saturated_fat / fat * 100 if fat > 0 else 0.0
+    record.non_nutritive_sweeteners = 1.0 if _has_non_nutritive_sweeteners(nutrition_data) else 0.0
+    record.categories = get('categories') or ''
+    record.categories_tags = get('categories_tags') or ()
+    return record
+
+def _has_non_nutritive_sweeteners(nutrition_data: Dict[str, Any]) -> bool:
+    """Sweetener additives or ingredients (scored for beverages only)"""
+    return NON_NUTRITIVE_SWEETENERS.matches(nutrition_data.get('ingredients_text'), nutrition_data.get('additives_tags'))
+
+# Columns read by calculate_nutriscore_batch (per 100g/ml, as in NutrientRecord)
+BATCH_COLUMNS = ['energy_kj', 'sugars', 'saturated_fat', 'fat', 'salt', 'sodium', 'proteins', 'fiber', 'fruits_veg']
+
+def calculate_nutriscore_batch(columns: Mapping[str, Any], version: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Nutri-Score for many products at once, identical to calculate_nutriscore per product
+    Args:
+        columns: Equal-length arrays (a dict of arrays, a pandas DataFrame, NutrientIndex.scoring_columns(), ...)
+            named like BATCH_COLUMNS, plus optional 'category' (rule set category names, see
+            nutriscore_columns), or else boolean 'is_beverage', and boolean 'non_nutritive_sweeteners'.
+            Without either, every product scores as food. Absent columns read as 0, like absent
+            fields in calculate_nutriscore. NaN (a missing value in the nutrient index) also reads
+            as 0 here; calculate_nutriscore has no such rule, and a NaN field there fails every
+            threshold and scores the most points, so the two only agree on NaN-free inputs.
+        version: Rule set version (default: nutriscore_rules.DEFAULT_VERSION)
+    Returns: {
+        'score', 'negative_points', 'positive_points': int16 arrays,
+        'grade': array of letters,
+        'is_beverage': bool array,
+        'category': array of category names,
+        'version': str,
+        'breakdown': {<component>_points: int16 array}, keyed like the scalar breakdown
     }
+    """
+    ruleset = get_ruleset(version)
+    present = [name for name in BATCH_COLUMNS + ['category', 'is_beverage', 'non_nutritive_sweeteners'] if name in columns]
+    size = len(np.asarray(columns[present[0]])) if present else 0
+
+    def column(name: str) -> np.ndarray:
+        if name not in columns:
+            return np.zeros(size, dtype=np.float64)
+        return np.nan_to_num(np.asarray(columns[name], dtype=np.float64), nan=0.0)
+
+    def flag(name: str) -> np.ndarray:
+        if name not in columns:
+            return np.zeros(size, dtype=bool)
+        return np.asarray(columns[name], dtype=bool)
+
+    values = {name: column(name) for name in BATCH_COLUMNS}
+    # Same conversions as extract_nutrients
+    values['salt'] = np.where((values['salt'] == 0) & (values['sodium'] > 0), values['sodium'] * 2.5 / 1000, values['salt'])
+    values['sodium_mg'] = values['salt'] * 400
+    fat = values['fat']
+    values['saturated_fat_ratio'] = np.divide(values['saturated_fat'] * 100, fat, out=np.zeros(size), where=fat > 0)
+    values['non_nutritive_sweeteners'] = flag('non_nutritive_sweeteners').astype(np.float64)
 
-def calculate_health_score(nutrition_data: Dict[str, Any]) -> float:
+    if 'category' in columns:
+        category = np.asarray(columns['category'])
+    else:
+        category = np.where(flag('is_beverage'), 'beverage', 'food')
+    return ruleset.score_columns(values, category)
+
+def nutriscore_columns(products: Iterable[Dict[str, Any]], version: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """Columns for calculate_nutriscore_batch from product dicts, read exactly as calculate_nutriscore reads them"""
+    ruleset = get_ruleset(version)
+    records = [extract_nutrients(product) for product in products]
+    columns = {name: np.array([getattr(record, name) for record in records], dtype=np.float64)
+               for name in BATCH_COLUMNS}
+    columns['category'] = np.array([ruleset.category(record.categories, record.categories_tags) for record in records],
+                                   dtype=object)
+    columns['non_nutritive_sweeteners'] = np.array([record.non_nutritive_sweeteners for record in records], dtype=bool)
+    return columns
+
+def calculate_health_score(nutrition_data: Union[Dict[str, Any], NutrientRecord],
+                           version: Optional[str] = None) -> float:
     """
     Legacy function for backward compatibility
     Now uses Nutri-Score but returns a simplified score
     """
-    nutriscore = calculate_nutriscore_2023(nutrition_data)
-    
-    # Convert Nutri-Score to a 0-100 scale for backward compatibility
+    return health_score_from_grade(calculate_nutriscore(nutrition_data, version)['grade'])
+
+def health_score_from_grade(grade: str) -> float:
+    """Convert a Nutri-Score grade to a 0-100 scale for backward compatibility"""
     grade_scores = {'A': 90, 'B': 75, 'C': 60, 'D': 40, 'E': 20}
-    return float(grade_scores.get(nutriscore['grade'], 50))
+    return float(grade_scores.get(grade, 50))
 
 def get_health_rating_color(score: float) -> str:
     """Return color based on health score"""
@@ -0,0 +1,152 @@
+import asyncio
+import importlib.util
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+USER_AGENT = "Nutrilens/1.0 (+https://github.com/Pratik00531/Nutrilens)"
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # bytes handed to the writer thread at a time
+
+
+def _http2_available() -> bool:
+    """httpx only speaks HTTP/2 when the optional h2 package is installed"""
+    return importlib.util.find_spec("h2") is not None
+
+
+class UpstreamClient:
+    """
+    Shared async HTTP client for product lookups (OpenFoodFacts and the other
+    providers of MultiApiProductDatabase).
+
+    One pooled httpx.AsyncClient is kept for the life of the app so lookups
+    reuse keep-alive connections instead of paying a TCP+TLS handshake per
+    request. ``max_connections`` bounds the whole pool; ``max_per_host`` bounds
+    concurrent requests to any single host so one slow provider cannot take
+    every connection. HTTP/2 is negotiated when h2 is installed. ``transport``
+    replaces the network (e.g. httpx.MockTransport in tests).
+    """
+
+    def __init__(self, max_connections: int = 100, max_per_host: int = 20,
+                 max_keepalive: int = 20, keepalive_expiry: float = 30.0,
+                 connect_timeout: float = 3.0, timeout: float = 5.0, http2: bool = True,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.http2 = http2 and _http2_available()
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._stats = {"requests": 0, "errors": 0, "timeouts": 0}
+
+    async def start(self):
+        """Open the connection pool (get() also opens it on first use)"""
+        self._ensure_client()
+
+    async def shutdown(self):
+        """Close every pooled connection"""
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+    async def __aenter__(self) -> "UpstreamClient":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.shutdown()
+
+    async def get(self, url: str, params: Optional[Dict[str, Any]] = None,
+                  timeout: Optional[float] = None) -> httpx.Response:
+        """
+        GET a URL through the shared pool
+        Args:
+            url: Absolute URL
+            params: Optional query parameters
+            timeout: Overall read timeout in seconds for this call (default: the client's)
+        Returns:
+            The response; status codes are left to the caller.
+            httpx.TimeoutException and httpx.HTTPError propagate.
+        """
+        client = self._ensure_client()
+        host = urlsplit(url).netloc
+        slots = self._host_slots.get(host)
+        if slots is None:
+            slots = self._host_slots[host] = asyncio.Semaphore(self.max_per_host)
+
+        request_timeout = None
+        if timeout is not None:
+            request_timeout = httpx.Timeout(timeout, connect=min(self.connect_timeout, timeout))
+
+        async with slots:
+            self._stats["requests"] += 1
+            self._in_flight[host] = self._in_flight.get(host, 0) + 1
+            try:
+                if request_timeout is None:
+                    return await client.get(url, params=params)
+                return await client.get(url, params=params, timeout=request_timeout)
+            except httpx.TimeoutException:
+                self._stats["timeouts"] += 1
+                raise
+            except httpx.HTTPError:
+                self._stats["errors"] += 1
+                raise
+            finally:
+                self._in_flight[host] -= 1
+
+    async def download(self, url: str, path: str, timeout: float = 300.0) -> int:
+        """
+        Stream a (possibly large) file to disk without buffering it; returns the bytes written.
+        Disk writes run on a worker thread so other requests never wait behind them.
+        """
+        client = self._ensure_client()
+        self._stats["requests"] += 1
+        written = 0
+        try:
+            async with client.stream("GET", url, timeout=httpx.Timeout(timeout, connect=self.connect_timeout)) as response:
+                response.raise_for_status()
+                f = await asyncio.to_thread(open, path, "wb")
+                try:
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        await asyncio.to_thread(f.write, chunk)
+                        written += len(chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+        except httpx.TimeoutException:
+            self._stats["timeouts"] += 1
+            raise
+        except httpx.HTTPError:
+            self._stats["errors"] += 1
+            raise
+        return written
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "open": self._client is not None,
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "max_per_host": self.max_per_host,
+            "in_flight": {host: count for host, count in self._in_flight.items() if count},
+            **self._stats,
+        }
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                headers={"User-Agent": USER_AGENT},
+                follow_redirects=True,
+                transport=self.transport,
+            )
+        return self._client
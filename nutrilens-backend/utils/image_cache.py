@@ -0,0 +1,147 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+import cv2
+import numpy as np
+
+from utils.barcode_scanner import load_grayscale
+
+# What a cached image decoded to: the barcode of a single scan, or every barcode of a multi scan
+Decoded = Union[str, Tuple[str, ...]]
+
+
+def content_key(image_bytes: bytes) -> str:
+    """Hash of the exact uploaded bytes"""
+    return hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+
+def perceptual_hash(image_bytes: bytes) -> Optional[int]:
+    """
+    64-bit DCT hash of the image, stable across re-encodes and resizes.
+    Decodes at 1/8 scale, so it costs a fraction of a barcode decode.
+    """
+    try:
+        gray = load_grayscale(image_bytes, 8)
+        small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+        # The lowest frequencies describe the layout of the picture, not its compression noise
+        low = cv2.dct(small)[:8, :8].flatten()
+        bits = low > np.median(low[1:])
+        return int(np.packbits(bits).view('>u8')[0])
+    except Exception as e:
+        print(f"Error hashing image: {str(e)}")
+        return None
+
+
+class DecodedImageCache:
+    """
+    Bounded LRU cache from uploaded image to decoded barcode.
+
+    The exact tier is keyed by a hash of the bytes. The optional perceptual tier
+    matches near-identical re-encodes by the Hamming distance of their
+    perceptual hashes; the hash is split into ``max_distance + 1`` bands so any
+    match within the distance shares at least one band exactly and lookups stay
+    a handful of dict probes. "No barcode" results are cached too, but only for
+    ``negative_ttl`` seconds, since a retry of a failed scan is cheap to redo
+    and the decoder may improve.
+    """
+
+    def __init__(self, max_entries: int = 4096, negative_ttl: float = 60.0,
+                 perceptual: bool = False, max_distance: int = 4):
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.perceptual = perceptual
+        self.max_distance = max_distance
+        # key -> (decoded result or None, expires_at or None, perceptual hash or None)
+        self._entries: "OrderedDict[str, Tuple[Optional[Decoded], Optional[float], Optional[int]]]" = OrderedDict()
+        self._bands: Dict[Tuple[int, int], Set[str]] = {}
+        self._stats = {"hits": 0, "perceptual_hits": 0, "negative_hits": 0,
+                       "misses": 0, "evictions": 0, "expired": 0}
+
+    def get(self, key: str) -> Tuple[bool, Optional[Decoded]]:
+        """Return (found, barcode); barcode is None for a cached negative result"""
+        found, barcode = self._get_entry(key)
+        if found:
+            self._count_hit("hits", barcode)
+        return found, barcode
+
+    def get_similar(self, phash: Optional[int]) -> Tuple[bool, Optional[Decoded]]:
+        """Look up a near-identical image by perceptual hash"""
+        if phash is None or not self.perceptual:
+            return False, None
+        candidates: Set[str] = set()
+        for band in self._band_keys(phash):
+            candidates.update(self._bands.get(band, ()))
+        for key in candidates:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] is None:
+                continue
+            if bin(entry[2] ^ phash).count("1") <= self.max_distance:
+                found, barcode = self._get_entry(key)
+                if found:
+                    self._count_hit("perceptual_hits", barcode)
+                    return True, barcode
+        return False, None
+
+    def miss(self):
+        """Record a lookup that went through every tier without a hit"""
+        self._stats["misses"] += 1
+
+    def put(self, key: str, barcode: Optional[Decoded], phash: Optional[int] = None):
+        """Cache what an image decoded to; None is a "no barcode" result, kept for negative_ttl only"""
+        if key in self._entries:
+            self._remove(key)
+        expires_at = None if barcode else time.monotonic() + self.negative_ttl
+        if not self.perceptual:
+            phash = None
+        self._entries[key] = (barcode, expires_at, phash)
+        if phash is not None:
+            for band in self._band_keys(phash):
+                self._bands.setdefault(band, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["perceptual_hits"] + self._stats["misses"]
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "perceptual": self.perceptual,
+            "hit_rate": (lookups - self._stats["misses"]) / lookups if lookups else 0.0,
+            **self._stats,
+        }
+
+    def _get_entry(self, key: str) -> Tuple[bool, Optional[Decoded]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        barcode, expires_at, _ = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._remove(key)
+            self._stats["expired"] += 1
+            return False, None
+        self._entries.move_to_end(key)
+        return True, barcode
+
+    def _count_hit(self, counter: str, barcode: Optional[Decoded]):
+        self._stats[counter] += 1
+        if barcode is None:
+            self._stats["negative_hits"] += 1
+
+    def _remove(self, key: str):
+        _, _, phash = self._entries.pop(key)
+        if phash is not None:
+            for band in self._band_keys(phash):
+                keys = self._bands.get(band)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._bands[band]
+
+    def _band_keys(self, phash: int) -> List[Tuple[int, int]]:
+        bands = self.max_distance + 1
+        width = -(-64 // bands)
+        mask = (1 << width) - 1
+        return [(index, (phash >> (index * width)) & mask) for index in range(bands)]
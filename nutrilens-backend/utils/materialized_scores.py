@@ -0,0 +1,212 @@
+"""
+Nutri-Scores computed ahead of time and stored next to the products.
+
+A product's score only changes when its data or the rule set does, so it is
+computed when the product enters the product store (ingestion, delta sync) or
+the product cache (an API fetch) and served from there. Every stored score
+carries the hash of the product data it was computed from and the fingerprint
+of the rule set tables, and is ignored (the product is scored live) as soon as
+either no longer matches, so a stale score is never served. When the tables of
+a version change, ScoreMaterializer recomputes that version across the store
+in the background:
+
+    python -m utils.materialized_scores data/products.sqlite3 --versions 2023,2017
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+if __package__ in (None, ""):
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.health_rating import calculate_nutriscore, extract_nutrients, health_score_from_grade
+from utils.nutriscore_rules import get_ruleset
+from utils.product_store import ProductStore, ScoreRow, content_hash, open_for_writing, set_meta, upsert_scores
+
+# meta key prefix -> fingerprint of the tables the last full pass of a version used
+RULES_META_PREFIX = "scores_rules:"
+
+
+def compute_scores(nutrition_data: Dict[str, Any], versions: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Score one product with several rule set versions, reading its nutrients once
+    Returns:
+        {version: {'nutriscore': calculate_nutriscore result, 'health_score': int, 'rules_hash': str}}
+    """
+    record = extract_nutrients(nutrition_data)
+    scores = {}
+    for version in versions:
+        nutriscore = calculate_nutriscore(record, version)
+        scores[version] = {
+            "nutriscore": nutriscore,
+            "health_score": int(health_score_from_grade(nutriscore["grade"])),
+            "rules_hash": get_ruleset(version).fingerprint,
+        }
+    return scores
+
+
+def stored_scores(product: Dict[str, Any], version: str) -> Optional[Dict[str, Any]]:
+    """The scores a product carries for a version (as compute_scores), or None if there are none or the rules changed since"""
+    scores = (product.get("scores") or {}).get(version)
+    if scores is None or scores.get("rules_hash") != get_ruleset(version).fingerprint:
+        return None
+    if "encoded" in scores:  # as read from the product store
+        return decode_scores(scores["encoded"], version, scores["rules_hash"])
+    return scores
+
+
+def encode_scores(scores: Dict[str, Any]) -> str:
+    """
+    Compact JSON of one version's scores for the store: the breakdown is a list in the
+    order of the rule set's breakdown keys, so decoding costs a fraction of scoring
+    """
+    nutriscore = scores["nutriscore"]
+    ruleset = get_ruleset(nutriscore["version"])
+    return json.dumps([
+        nutriscore["score"], nutriscore["grade"], nutriscore["negative_points"], nutriscore["positive_points"],
+        int(nutriscore["is_beverage"]), nutriscore["category"], scores["health_score"],
+        [nutriscore["breakdown"][key] for key in ruleset.breakdown_keys],
+    ], separators=(",", ":"), ensure_ascii=False)
+
+
+def decode_scores(encoded: str, version: str, rules_hash: str) -> Dict[str, Any]:
+    """encode_scores reversed; only valid while the version's rules_hash is unchanged"""
+    score, grade, negative, positive, is_beverage, category, health_score, points = json.loads(encoded)
+    return {
+        "nutriscore": {
+            'score': score,
+            'grade': grade,
+            'negative_points': negative,
+            'positive_points': positive,
+            'is_beverage': bool(is_beverage),
+            'category': category,
+            'version': version,
+            'breakdown': dict(zip(get_ruleset(version).breakdown_keys, points)),
+        },
+        "health_score": health_score,
+        "rules_hash": rules_hash,
+    }
+
+
+def score_rows(key: str, data: str, versions: Sequence[str]) -> List[ScoreRow]:
+    """Score rows of one product row, ``data`` being the product's stored JSON"""
+    if not versions:
+        return []
+    digest = content_hash(data)
+    rows = []
+    for version, scores in compute_scores(json.loads(data), versions).items():
+        rows.append((key, version, digest, scores["rules_hash"], encode_scores(scores)))
+    return rows
+
+
+def mark_materialized(db: sqlite3.Connection, versions: Iterable[str]):
+    """Record that every product of the store is scored with the current tables of ``versions``"""
+    for version in versions:
+        set_meta(db, RULES_META_PREFIX + version, get_ruleset(version).fingerprint)
+
+
+def materialize_scores(db_path: str, versions: Sequence[str], batch_size: int = 5000) -> Dict[str, int]:
+    """
+    Bring the stored scores of ``versions`` up to date across the whole store.
+    Only products whose data or rule set changed since their score was stored are scored.
+    Returns:
+        Counts of products checked, scores computed and scores already current
+    """
+    stats = {"checked": 0, "computed": 0, "current": 0}
+    writer = open_for_writing(db_path)  # creates the scores table in stores built before it existed
+    reader = sqlite3.connect(db_path)
+    try:
+        for version in versions:
+            fingerprint = get_ruleset(version).fingerprint
+            batch: List[ScoreRow] = []
+            rows = reader.execute(
+                "SELECT p.gtin, p.data, s.content_hash, s.rules_hash "
+                "FROM products p LEFT JOIN scores s ON s.gtin = p.gtin AND s.version = ?",
+                (version,),
+            )
+            for key, data, stored_hash, rules_hash in rows:
+                stats["checked"] += 1
+                if rules_hash == fingerprint and stored_hash == content_hash(data):
+                    stats["current"] += 1
+                    continue
+                batch.extend(score_rows(key, data, [version]))
+                if len(batch) >= batch_size:
+                    upsert_scores(writer, batch)
+                    writer.commit()
+                    stats["computed"] += len(batch)
+                    batch.clear()
+            upsert_scores(writer, batch)
+            stats["computed"] += len(batch)
+            mark_materialized(writer, [version])
+            writer.commit()
+    finally:
+        reader.close()
+        writer.close()
+    return stats
+
+
+class ScoreMaterializer:
+    """
+    Recomputes stored scores in the background, only for the versions whose tables
+    changed since their last full pass (ingestion and delta sync score the products
+    they write, so product changes never need a full pass).
+    """
+
+    def __init__(self, store: ProductStore, versions: Sequence[str]):
+        self.store = store
+        self.versions = list(versions)
+        self._lock = asyncio.Lock()
+        self._state: Dict[str, Any] = {"runs": 0, "failures": 0, "computed": 0, "last_run": None,
+                                       "last_versions": [], "last_error": None}
+
+    def stale_versions(self) -> List[str]:
+        return [version for version in self.versions
+                if self.store.get_meta(RULES_META_PREFIX + version) != get_ruleset(version).fingerprint]
+
+    async def run_once(self) -> Dict[str, Any]:
+        """Recompute the stale versions, if any"""
+        async with self._lock:
+            if not os.path.exists(self.store.path):
+                return {"versions": []}
+            stale = self.stale_versions()
+            if not stale:
+                return {"versions": []}
+            self._state["runs"] += 1
+            started = time.perf_counter()
+            try:
+                stats = await asyncio.to_thread(materialize_scores, self.store.path, stale)
+                self._state["last_error"] = None
+            except Exception as e:
+                self._state["failures"] += 1
+                self._state["last_error"] = str(e)
+                print(f"Error materializing scores: {e}")
+                raise
+            finally:
+                self._state["last_run"] = time.time()
+                self._state["last_versions"] = stale
+            self._state["computed"] += stats["computed"]
+            print(f"Materialized scores for {', '.join(stale)}: {stats['computed']} computed, "
+                  f"{stats['current']} current ({time.perf_counter() - started:.0f}s)")
+            return {"versions": stale, **stats}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"versions": self.versions, **self._state}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from utils.nutriscore_rules import DEFAULT_VERSION
+
+    parser = argparse.ArgumentParser(description="Precompute the Nutri-Scores stored in the product store")
+    parser.add_argument("db", help="product store SQLite file")
+    parser.add_argument("--versions", default=DEFAULT_VERSION, help="comma-separated rule set versions")
+    args = parser.parse_args()
+
+    result = materialize_scores(args.db, [version for version in args.versions.split(",") if version])
+    print(f"{result['checked']} products checked: {result['computed']} scores computed, {result['current']} current")
@@ -1,112 +1,228 @@
-import requests
-from typing import Any, Dict, Optional, List
+import asyncio
+from typing import Any, Dict, Optional, List, Tuple
 import logging
 
+from utils.gtin import canonical_gtin, gtin14, gtin_form
+from utils.http_client import UpstreamClient
+from utils.provider_health import ProviderRegistry, ProviderUnavailable
+from utils.product_cache import ProductCache
+
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
+# Namespace of resolved lookups in a shared ProductCache
+CACHE_NAMESPACE = "multi_api"
+
+
+class IncompleteLookup(Exception):
+    """Nothing was found, but a provider failed or the deadline hit, so "not found" is not certain"""
+
+
 class MultiApiProductDatabase:
-    def __init__(self):
-        """Initialize with multiple API endpoints for better coverage"""
+    def __init__(self, client: Optional[UpstreamClient] = None, timeout: float = 10.0,
+                 deadline: float = 8.0, grace: float = 0.3, hedge_after: Optional[float] = None,
+                 cache: Optional[ProductCache] = None, providers: Optional[ProviderRegistry] = None):
+        """
+        Initialize with multiple API endpoints for better coverage
+        Args:
+            client: Shared pooled HTTP client (a private one is created if omitted)
+            timeout: Per-request timeout in seconds
+            deadline: Overall budget in seconds for one barcode lookup across every provider
+            grace: Seconds to keep waiting for nutrition data once a name-only match has arrived
+            hedge_after: Re-issue a provider request that has not answered after this many
+                seconds and take whichever copy answers first (None disables hedging)
+            cache: Product cache consulted before any provider is queried
+            providers: Health, circuit breakers and quotas per provider (shared with other callers
+                of the same APIs; a private registry is created if omitted)
+        """
+        self.client = client or UpstreamClient()
+        self.timeout = timeout
+        self.deadline = deadline
+        self.grace = grace
+        self.hedge_after = hedge_after
+        self.cache = cache
+        self.providers = providers or ProviderRegistry()
         self.apis: List[Dict[str, Any]] = [
             {
                 'name': 'OpenFoodFacts',
                 'url_template': 'https://world.openfoodfacts.org/api/v0/product/{barcode}.json',
-                'parser': self._parse_openfoodfacts
+                'parser': self._parse_openfoodfacts,
+                'nutrition': True,  # results carry nutrients, so they win over name-only matches
+                'forms': (13,),  # code lengths the provider indexes, preferred first
+                'quotas': [(100, 60)],  # (requests, seconds): 100 product reads a minute
             },
             {
                 'name': 'UPCItemDB',
                 'url_template': 'https://api.upcitemdb.com/prod/trial/lookup?upc={barcode}',
-                'parser': self._parse_upcitemdb
+                'parser': self._parse_upcitemdb,
+                'forms': (12, 13),
+                'quotas': [(6, 60), (100, 86400)],  # trial plan: 6 a minute, 100 a day
             },
             {
                 'name': 'EAN-Search',
                 'url_template': 'https://api.ean-search.org/api?token=your_token&op=barcode-lookup&ean={barcode}&format=json',
-                'parser': self._parse_eansearch
+                'parser': self._parse_eansearch,
+                'forms': (13,),
             }
         ]
+        for api in self.apis:
+            api['health'] = self.providers.get(api['name'], api.get('quotas', ()))
         
-    def get_product_by_barcode(self, barcode: str) -> Optional[Dict[str, Any]]:
+    async def get_product_by_barcode(self, barcode: str) -> Optional[Dict[str, Any]]:
         """
-        Try multiple normalized barcode variants across APIs until a product is found
-        """
-        candidates = self._normalized_candidates(barcode)
-        logging.info(f"Trying barcode candidates: {candidates}")
-
-        for candidate in candidates:
-            for api in self.apis:
-                try:
-                    logging.info(f"Querying {api['name']} for barcode {candidate}...")
-                    product = self._query_api(api, candidate)
-                    if product:
-                        logging.info(f"✅ Found product in {api['name']} using {candidate}")
-                        # Ensure the response keeps the originally requested code for UI continuity
-                        product['barcode'] = candidate
-                        return product
-                except Exception as e:
-                    logging.error(f"Error with {api['name']}: {e}")
-
-        logging.warning("❌ Product not found in any API for any candidate")
-        return None
-
-    def _normalized_candidates(self, barcode: str) -> List[str]:
-        """Generate common EAN/UPC variants to improve hit rate.
-        Rules:
-        - If UPC-A (12 digits), try as-is and with a leading '0' (EAN-13 form)
-        - If EAN-13 starting with '0', also try without the leading zero (some sources store UPC-12)
-        - If length 14 and starts with leading zeros, try trimming leading zeros down to 13/12
-        - Always keep the original first
+        Query every API concurrently, each with the form of the code it indexes
+        Args:
+            barcode: Barcode as scanned or typed; every form of a code shares one cache entry
+        Returns:
+            The first nutrition-bearing product found. A name-only match is returned
+            if no nutrition data arrives within the grace window, or None when
+            nothing matches before the deadline. Outstanding requests are cancelled.
         """
-        s = ''.join(ch for ch in barcode if ch.isdigit())
-        candidates: List[str] = []
+        # Codes with a bad check digit are still tried as typed, keyed the same way
+        key = canonical_gtin(barcode) or gtin14(barcode)
+        if key is None:
+            logging.warning(f"❌ {barcode} is not a barcode")
+            return None
+        try:
+            if self.cache is None:
+                product = await self._resolve(key)
+            else:
+                product = await self.cache.get_or_load(CACHE_NAMESPACE, key, lambda: self._resolve(key))
+        except IncompleteLookup as e:
+            logging.warning(f"❌ {e}")
+            return None
+        if product is not None:
+            # Ensure the response keeps the originally requested code for UI continuity
+            product = {**product, 'barcode': barcode}
+        return product
 
-        def add(c: str):
-            if c and c not in candidates:
-                candidates.append(c)
+    async def _resolve(self, key: str) -> Optional[Dict[str, Any]]:
+        """Fan out over providers by GTIN-14 key; raises IncompleteLookup if "not found" is uncertain"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        grace_until: Optional[float] = None
+        # task -> (api rank, api, code queried); lower ranks are preferred
+        queries: Dict["asyncio.Task", Tuple[int, Dict[str, Any], str]] = {}
+        for api_rank, api in enumerate(self._ordered_apis()):
+            # Skip EAN-Search if no token configured
+            if 'your_token' in api['url_template']:
+                logging.debug(f"Skipping {api['name']} (no token configured)")
+                continue
+            code = self._provider_form(api, key)
+            logging.info(f"Querying {api['name']} for barcode {code}...")
+            task = asyncio.create_task(self._query_hedged(api, code))
+            queries[task] = (api_rank, api, code)
 
-        add(s)
+        best: Optional[Tuple[int, Dict[str, Any]]] = None
+        failures = 0
+        skipped = 0
+        pending = set(queries)
+        try:
+            while pending:
+                until = deadline if grace_until is None else min(deadline, grace_until)
+                remaining = until - loop.time()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda t: queries[t][0]):
+                    api_rank, api, code = queries[task]
+                    try:
+                        product = task.result()
+                    except ProviderUnavailable as e:
+                        logging.info(f"⏭️ {e}")
+                        skipped += 1
+                        continue
+                    except Exception as e:
+                        logging.error(f"Error with {api['name']}: {e}")
+                        failures += 1
+                        continue
+                    if not product:
+                        continue
+                    if api.get('nutrition'):
+                        logging.info(f"✅ Found product in {api['name']} using {code}")
+                        return product
+                    if best is None or api_rank < best[0]:
+                        best = (api_rank, product)
+                    if grace_until is None:
+                        grace_until = loop.time() + self.grace
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
 
-        # UPC-A (12) -> EAN-13 with leading 0
-        if len(s) == 12:
-            add('0' + s)
+        if best is not None:
+            product = best[1]
+            logging.info(f"✅ Found product in {product['source']} using {product['barcode']} (no nutrition data)")
+            return product
+        if pending:
+            raise IncompleteLookup(f"Product lookup for {key} hit the {self.deadline}s deadline")
+        if failures or skipped:
+            raise IncompleteLookup(f"Product not found for {key}; {failures} provider request(s) failed, "
+                                   f"{skipped} skipped")
+        logging.warning(f"❌ Product not found in any API for {key}")
+        return None
 
-        # EAN-13 starting with 0 -> also try without it (UPC-12)
-        if len(s) == 13 and s.startswith('0'):
-            add(s[1:])
+    async def _query_hedged(self, api: Dict[str, Any], barcode: str) -> Optional[Dict[str, Any]]:
+        """_query_api, re-issued once if the first request is slower than hedge_after"""
+        if self.hedge_after is None:
+            return await self._query_api(api, barcode)
 
-        # Length 14 with leading zeros -> try trimming
-        if len(s) == 14 and s.startswith('0'):
-            # trim one and two zeros
-            add(s[1:])
-            if s.startswith('00'):
-                add(s[2:])
+        attempts = [asyncio.create_task(self._query_api(api, barcode))]
+        try:
+            done, pending = await asyncio.wait(attempts, timeout=self.hedge_after)
+            if not done:
+                logging.info(f"Hedging slow {api['name']} request for {barcode}")
+                attempts.append(asyncio.create_task(self._query_api(api, barcode)))
+                pending = set(attempts)
+            # Take the first answer; a copy that fails (or is refused a quota token) leaves the other running
+            while True:
+                if not done:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                answered = [attempt for attempt in done if attempt.exception() is None]
+                if answered or not pending:
+                    return (answered or list(done))[0].result()
+                done = set()
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
 
-        # Also try stripping a single leading zero in general
-        if len(s) > 0 and s.startswith('0'):
-            add(s.lstrip('0'))
+    def _ordered_apis(self) -> List[Dict[str, Any]]:
+        """
+        Nutrition providers first, then the rest by observed cost (latency per hit);
+        providers with an open circuit go last. Every provider is queried at once,
+        so the order only decides which name-only match wins within the grace window.
+        """
+        rank = {name: i for i, name in enumerate(self.providers.order(api['name'] for api in self.apis))}
+        return sorted(self.apis, key=lambda api: (not api.get('nutrition'), rank[api['name']]))
 
-        return candidates
+    def _provider_form(self, api: Dict[str, Any], key: str) -> str:
+        """
+        The form of a GTIN-14 key a provider indexes: UPC-A codes go to UPC
+        databases as 12 digits and to EAN databases as 13; anything else is sent
+        in the first form its significant digits fit (the full 14 as a last resort)
+        """
+        for length in api['forms']:
+            code = gtin_form(key, length)
+            if code is not None:
+                return code
+        return gtin_form(key, 13) or key
     
-    def _query_api(self, api: Dict[str, Any], barcode: str) -> Optional[Dict[str, Any]]:
-        """Query a specific API"""
+    async def _query_api(self, api: Dict[str, Any], barcode: str) -> Optional[Dict[str, Any]]:
+        """Query a specific API; None means not found, raises if the API could not answer"""
         url = api['url_template'].format(barcode=barcode)
-        
-        # Skip EAN-Search if no token configured
-        if 'your_token' in url:
-            logging.debug("Skipping EAN-Search (no token configured)")
+        return await api['health'].call(lambda: self._request(api, url, barcode))
+
+    async def _request(self, api: Dict[str, Any], url: str, barcode: str) -> Optional[Dict[str, Any]]:
+        response = await self.client.get(url, timeout=self.timeout)
+        # Unknown or malformed codes are a definite "no"; rate limits and outages are not
+        if 400 <= response.status_code < 500 and response.status_code != 429:
             return None
-            
-        try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            data: Dict[str, Any] = response.json()
-            result: Optional[Dict[str, Any]] = api['parser'](data, barcode)
-            return result
-                
-        except Exception as e:
-            logging.error(f"{api['name']} request failed: {e}")
-        
-        return None
+        response.raise_for_status()
+
+        data: Dict[str, Any] = response.json()
+        result: Optional[Dict[str, Any]] = api['parser'](data, barcode)
+        return result
     
     def _parse_openfoodfacts(self, data: Dict[str, Any], barcode: str) -> Optional[Dict[str, Any]]:
         """Parse OpenFoodFacts API response"""
@@ -190,7 +306,7 @@ class MultiApiProductDatabase:
 
         return ', '.join(vitamins) if vitamins else 'None'
     
-    def search_products_by_name(self, query: str) -> List[Dict[str, Any]]:
+    async def search_products_by_name(self, query: str) -> List[Dict[str, Any]]:
         """Search products by name using OpenFoodFacts (most comprehensive for search)"""
         try:
             search_url = "https://world.openfoodfacts.org/cgi/search.pl"
@@ -202,8 +318,13 @@ class MultiApiProductDatabase:
                 'page_size': 10
             }
             
-            response = requests.get(search_url, params=params, timeout=10)
-            response.raise_for_status()
+            async def search() -> Any:
+                response = await self.client.get(search_url, params=params, timeout=self.timeout)
+                response.raise_for_status()
+                return response
+
+            # Searches have their own, much lower, rate limit
+            response = await self.providers.get('OpenFoodFacts search', [(10, 60)]).call(search)
             
             data = response.json()
             products = []
@@ -224,7 +345,12 @@ class MultiApiProductDatabase:
 # ------------------------------
 # Example usage
 # ------------------------------
+async def _example():
+    async with UpstreamClient() as client:
+        db = MultiApiProductDatabase(client)
+        product = await db.get_product_by_barcode("8901030372165")  # Example: Maggi noodles barcode
+        print(product)
+
+
 if __name__ == "__main__":
-    db = MultiApiProductDatabase()
-    product = db.get_product_by_barcode("8901030372165")  # Example: Maggi noodles barcode
-    print(product)
+    asyncio.run(_example())
@@ -0,0 +1,331 @@
+"""
+Compact, memory-mapped nutrient index over the whole product catalog.
+
+Built from the product store into a directory of flat arrays:
+
+    gtins.npy            int64, sorted: the barcode as a number (leading zeros do not matter)
+    <nutrient>.npy       float32 per nutrient, NaN where the product has no value
+    name_start.npy       uint32 offset of each product name in names.bin
+    name_length.npy      uint16 byte length of each name
+    names.bin            UTF-8 names, back to back
+    brand_id.npy         uint32 index into the interned brand table
+    brand_start.npy, brand_length.npy, brands.bin   the brand table
+    category.npy         uint8 index into meta["categories"], the Nutri-Score category
+                         under the rule set version in meta["nutriscore_version"]
+    non_nutritive_sweeteners.npy   bool, sweetener additives or ingredients
+    meta.json            row count, columns, categories, build time
+
+Everything is opened with mmap, so several worker processes share the same
+physical pages and opening the index costs nothing up front. A lookup is a
+binary search over ``gtins`` followed by reads from the columns; no Python
+object exists per product.
+
+    python -m utils.nutrient_index build data/products.sqlite3 data/nutrient_index
+
+NutrientIndex.scoring_columns() feeds calculate_nutriscore_batch directly.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+if __package__ in (None, ""):
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.health_rating import extract_nutrients
+from utils.nutriscore_rules import get_ruleset
+
+# Column name -> OpenFoodFacts nutriments (per 100 g/ml) it is filled from, first present wins
+NUTRIENT_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "energy_kj": ("energy-kj_100g", "energy_100g"),
+    "fat": ("fat_100g",),
+    "saturated_fat": ("saturated-fat_100g",),
+    "sugars": ("sugars_100g",),
+    "salt": ("salt_100g",),
+    "sodium": ("sodium_100g",),
+    "proteins": ("proteins_100g",),
+    "fiber": ("fiber_100g",),
+    "fruits_veg": ("fruits-vegetables-nuts-estimate-from-ingredients_100g",),
+}
+FORMAT_VERSION = 2
+MAX_STRING_BYTES = 0xFFFF
+
+
+def gtin_key(barcode: str) -> int:
+    """Numeric index key of a barcode; -1 for anything that is not 1-14 digits"""
+    digits = barcode.strip()
+    if not digits.isdigit() or len(digits) > 14:
+        return -1
+    return int(digits)
+
+
+class NutrientIndex:
+    """Read-only view of an index directory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported nutrient index version {self.meta.get('version')}")
+
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+
+        self.gtins = load("gtins")
+        self.columns: Dict[str, np.ndarray] = {name: load(name) for name in self.meta["columns"]}
+        self._name_start = load("name_start")
+        self._name_length = load("name_length")
+        self._names = np.memmap(os.path.join(directory, "names.bin"), dtype=np.uint8, mode="r") \
+            if self.meta["names_bytes"] else np.zeros(0, np.uint8)
+        self._brand_id = load("brand_id")
+        self._brand_start = load("brand_start")
+        self._brand_length = load("brand_length")
+        self._brands = np.memmap(os.path.join(directory, "brands.bin"), dtype=np.uint8, mode="r") \
+            if self.meta["brands_bytes"] else np.zeros(0, np.uint8)
+        self.category_ids = load("category")
+        self.categories = np.array(self.meta["categories"], dtype=object)
+        self.non_nutritive_sweeteners = load("non_nutritive_sweeteners")
+
+    def __len__(self) -> int:
+        return len(self.gtins)
+
+    def find(self, barcode: str) -> int:
+        """Row of a barcode, or -1"""
+        key = gtin_key(barcode)
+        if key < 0:
+            return -1
+        row = int(np.searchsorted(self.gtins, key))
+        return row if row < len(self.gtins) and self.gtins[row] == key else -1
+
+    def find_many(self, keys: np.ndarray) -> np.ndarray:
+        """Vectorized find over an int64 array of GTIN keys; -1 where absent"""
+        keys = np.asarray(keys, dtype=np.int64)
+        rows = np.searchsorted(self.gtins, keys)
+        rows = np.minimum(rows, max(len(self.gtins) - 1, 0))
+        found = (self.gtins[rows] == keys) if len(self.gtins) else np.zeros(len(keys), dtype=bool)
+        return np.where(found, rows, -1)
+
+    def nutrients(self, barcode: str) -> Optional[Dict[str, Optional[float]]]:
+        """Nutrients per 100 g/ml of one product (None for missing values), or None if unknown"""
+        row = self.find(barcode)
+        if row < 0:
+            return None
+        values = {}
+        for name, column in self.columns.items():
+            value = float(column[row])
+            values[name] = None if value != value else value
+        return values
+
+    def scoring_columns(self, version: Optional[str] = None) -> Dict[str, np.ndarray]:
+        """
+        Columns for health_rating.calculate_nutriscore_batch, categories included
+        Args:
+            version: Rule set the columns will be scored with; must be the one the index was
+                built with, since categories differ between rule sets (default: that one)
+        """
+        built = self.meta["nutriscore_version"]
+        if version is not None and version != built:
+            raise ValueError(f"Nutrient index categories are for Nutri-Score {built}, not {version}; "
+                             f"rebuild it with --nutriscore-version {version}")
+        return {
+            **self.columns,
+            "category": self.categories[self.category_ids],
+            "non_nutritive_sweeteners": self.non_nutritive_sweeteners,
+        }
+
+    def name(self, row: int) -> str:
+        start, length = int(self._name_start[row]), int(self._name_length[row])
+        return bytes(self._names[start:start + length]).decode("utf-8", errors="replace")
+
+    def brand(self, row: int) -> str:
+        brand = int(self._brand_id[row])
+        start, length = int(self._brand_start[brand]), int(self._brand_length[brand])
+        return bytes(self._brands[start:start + length]).decode("utf-8", errors="replace")
+
+    def memory_report(self) -> Dict[str, Any]:
+        """Bytes used by every array, in total and per million products"""
+        arrays = {"gtins": self.gtins, **self.columns,
+                  "name_start": self._name_start, "name_length": self._name_length, "names.bin": self._names,
+                  "brand_id": self._brand_id, "brand_start": self._brand_start,
+                  "brand_length": self._brand_length, "brands.bin": self._brands,
+                  "category": self.category_ids, "non_nutritive_sweeteners": self.non_nutritive_sweeteners}
+        sizes = {name: int(array.nbytes) for name, array in arrays.items()}
+        total = sum(sizes.values())
+        rows = len(self)
+        return {
+            "products": rows,
+            "brands": len(self._brand_start),
+            "total_bytes": total,
+            "bytes_per_product": total / rows if rows else 0.0,
+            "mb_per_million_products": total / rows * 1e6 / (1024 * 1024) if rows else 0.0,
+            "arrays": sizes,
+        }
+
+
+class _StringTable:
+    """Back-to-back UTF-8 strings written to a file as they arrive, with their offsets"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "wb")
+        self.start = array("I")
+        self.length = array("H")
+        self.size = 0
+
+    def add(self, value: str) -> int:
+        data = value.encode("utf-8")[:MAX_STRING_BYTES]
+        if self.size + len(data) > 0xFFFFFFFF:
+            raise ValueError("String table exceeds 4 GB")
+        self.start.append(self.size)
+        self.length.append(len(data))
+        self.file.write(data)
+        self.size += len(data)
+        return len(self.start) - 1
+
+    def close(self):
+        self.file.close()
+
+
+def build_index(rows: Iterable[Tuple[str, str, str, Dict[str, Any]]], directory: str,
+                version: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Write an index directory from (barcode, name, brand, product) rows, where product is the
+    stored product data (nutriments, categories, ingredients and additives).
+    Categories are those of the Nutri-Score rule set ``version`` (default: DEFAULT_VERSION).
+    Builds into a sibling directory and renames it into place when done,
+    so readers never see a half-written index.
+    """
+    building = directory.rstrip("/") + ".building"
+    os.makedirs(building, exist_ok=True)
+    started = time.perf_counter()
+    ruleset = get_ruleset(version)
+    category_ids = {name: i for i, name in enumerate(ruleset.categories)}
+
+    keys = array("q")
+    columns = {name: array("f") for name in NUTRIENT_COLUMNS}
+    names = _StringTable(os.path.join(building, "names.bin"))
+    brands = _StringTable(os.path.join(building, "brands.bin"))
+    brand_ids = array("I")
+    categories = array("B")
+    sweeteners = array("B")
+    interned: Dict[str, int] = {}
+    nan = float("nan")
+    try:
+        for barcode, name, brand, product in rows:
+            key = gtin_key(barcode)
+            if key < 0:
+                continue
+            keys.append(key)
+            nutriments = product.get("nutriments", {})
+            for column, fields in NUTRIENT_COLUMNS.items():
+                value = next((nutriments[field] for field in fields if nutriments.get(field) is not None), nan)
+                columns[column].append(value)
+            # Read the way calculate_nutriscore reads them
+            record = extract_nutrients(product)
+            categories.append(category_ids[ruleset.category(record.categories, record.categories_tags)])
+            sweeteners.append(bool(record.non_nutritive_sweeteners))
+            names.add(name)
+            brand_id = interned.get(brand)
+            if brand_id is None:
+                brand_id = interned[brand] = brands.add(brand)
+            brand_ids.append(brand_id)
+    finally:
+        names.close()
+        brands.close()
+
+    # Sort by key; for duplicate keys (e.g. UPC-A and EAN-13 forms) the last row wins
+    gtins = np.frombuffer(keys, dtype=np.int64)
+    order = np.argsort(gtins, kind="stable")
+    sorted_keys = gtins[order]
+    last = np.append(sorted_keys[1:] != sorted_keys[:-1], True) if len(sorted_keys) else np.zeros(0, bool)
+    order = order[last]
+
+    def save(name: str, values: np.ndarray):
+        np.save(os.path.join(building, name + ".npy"), np.ascontiguousarray(values))
+
+    save("gtins", gtins[order])
+    for column, values in columns.items():
+        save(column, np.frombuffer(values, dtype=np.float32)[order])
+    save("name_start", np.frombuffer(names.start, dtype=np.uint32)[order])
+    save("name_length", np.frombuffer(names.length, dtype=np.uint16)[order])
+    save("brand_id", np.frombuffer(brand_ids, dtype=np.uint32)[order])
+    save("brand_start", np.frombuffer(brands.start, dtype=np.uint32))
+    save("brand_length", np.frombuffer(brands.length, dtype=np.uint16))
+    save("category", np.frombuffer(categories, dtype=np.uint8)[order])
+    save("non_nutritive_sweeteners", np.frombuffer(sweeteners, dtype=np.bool_)[order])
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "products": int(len(order)),
+        "columns": list(NUTRIENT_COLUMNS),
+        "nutriscore_version": ruleset.version,
+        "categories": list(ruleset.categories),
+        "names_bytes": names.size,
+        "brands_bytes": brands.size,
+        "built_at": datetime.now(timezone.utc).isoformat(),
+    }
+    with open(os.path.join(building, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    if os.path.exists(directory):
+        retired = directory.rstrip("/") + ".old"
+        if os.path.exists(retired):
+            _remove_tree(retired)
+        os.rename(directory, retired)
+        os.rename(building, directory)
+        _remove_tree(retired)  # open mmaps keep their pages until closed
+    else:
+        os.rename(building, directory)
+    meta["seconds"] = round(time.perf_counter() - started, 2)
+    return meta
+
+
+def store_rows(store_path: str) -> Iterable[Tuple[str, str, str, Dict[str, Any]]]:
+    """Stream (barcode, name, brand, product data) out of a product store file"""
+    db = sqlite3.connect(store_path)
+    try:
+        for barcode, name, brand, data in db.execute("SELECT gtin, name, brand, data FROM products"):
+            yield barcode, name, brand, json.loads(data)
+    finally:
+        db.close()
+
+
+def _remove_tree(path: str):
+    for entry in os.listdir(path):
+        os.remove(os.path.join(path, entry))
+    os.rmdir(path)
+
+
+def _print_report(report: Dict[str, Any]):
+    print(f"{report['products']} products, {report['brands']} brands: "
+          f"{report['total_bytes'] / (1024 * 1024):.1f} MB "
+          f"({report['bytes_per_product']:.1f} bytes/product, "
+          f"{report['mb_per_million_products']:.1f} MB per million products)")
+    for name, size in report["arrays"].items():
+        print(f"  {name:<22} {size / (1024 * 1024):10.2f} MB")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or inspect the memory-mapped nutrient index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build the index from a product store")
+    build.add_argument("store", help="product store SQLite file")
+    build.add_argument("directory", help="index directory to (re)place")
+    build.add_argument("--nutriscore-version", help="rule set whose categories are stored (default: the default version)")
+    report = commands.add_parser("report", help="print the memory used by an index")
+    report.add_argument("directory")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        result = build_index(store_rows(args.store), args.directory, args.nutriscore_version)
+        print(f"Built index of {result['products']} products in {result['seconds']}s")
+    _print_report(NutrientIndex(args.directory).memory_report())
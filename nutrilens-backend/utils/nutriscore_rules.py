@@ -0,0 +1,376 @@
+"""
+Declarative Nutri-Score rule sets and the scorers compiled from them.
+
+A rule set lists, per category (food, beverage, cheese, fats, ...), the
+components that add negative and positive points and the grade cut-offs.
+Every component is a threshold table: a value scores points[i], where i is
+the number of thresholds it exceeds (``value <= thresholds[0]`` scores
+points[0]). Tables are compiled once into tuples searched with ``bisect``
+for single products and into numpy arrays for whole columns, and cached per
+version, so adding a version is a matter of adding a table here.
+"""
+
+import hashlib
+import json
+from bisect import bisect_left
+from operator import attrgetter
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.term_matcher import TermMatcher
+
+DEFAULT_VERSION = "2023"
+
+
+def _steps(start: float, step: float, count: int) -> List[float]:
+    """Evenly spaced thresholds, rounded to the decimals the published tables use"""
+    return [round(start + step * i, 4) for i in range(count)]
+
+
+# Components shared by several categories: breakdown key -> table
+_ENERGY_FOOD = {"input": "energy_kj", "thresholds": _steps(335, 335, 10)}
+_SUGARS_FOOD = {"input": "sugars", "thresholds": [4.5, 9, 13.5, 18, 22.5, 27, 31, 36, 40, 45]}
+_ENERGY_BEVERAGE = {"input": "energy_kj", "thresholds": _steps(0, 30, 10)}
+_SUGARS_BEVERAGE = {"input": "sugars", "thresholds": _steps(0, 1.5, 10)}
+_SATURATED_FAT = {"input": "saturated_fat", "thresholds": _steps(1, 1, 10)}
+_FIBER = {"input": "fiber", "thresholds": [0.9, 1.9, 2.8, 3.7, 4.7]}
+
+# The rules the app has always scored with (calculate_nutriscore_2023)
+_SALT_2023 = {"input": "salt", "thresholds": _steps(0.2, 0.2, 10), "points": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 20]}
+_POSITIVE_2023 = {
+    "protein_points": {"input": "proteins", "thresholds": _steps(1.6, 1.6, 7)},
+    "fiber_points": _FIBER,
+    "fruits_veg_points": {"input": "fruits_veg", "thresholds": [40, 60, 80], "points": [0, 1, 2, 6]},
+}
+NUTRISCORE_2023 = {
+    "categories": {
+        # First category whose terms appear in the categories text (or whose tags are among the
+        # categories_tags) wins; "food" is the fallback
+        "beverage": {
+            "terms": ["beverage", "drink", "water", "soda", "juice"],
+            "negative": {
+                "energy_points": _ENERGY_BEVERAGE,
+                "sugar_points": _SUGARS_BEVERAGE,
+                "saturated_fat_points": _SATURATED_FAT,
+                "salt_points": _SALT_2023,
+                "non_nutritive_sweeteners_points": {"input": "non_nutritive_sweeteners", "thresholds": [0],
+                                                    "points": [0, 4]},
+            },
+            "positive": _POSITIVE_2023,
+            "grades": {"thresholds": [1, 5, 9, 13], "letters": "ABCDE"},
+        },
+        "food": {
+            "negative": {
+                "energy_points": _ENERGY_FOOD,
+                "sugar_points": _SUGARS_FOOD,
+                "saturated_fat_points": _SATURATED_FAT,
+                "salt_points": _SALT_2023,
+            },
+            "positive": _POSITIVE_2023,
+            "grades": {"thresholds": [-1, 2, 10, 18], "letters": "ABCDE"},
+        },
+    },
+}
+
+# The original 2017 algorithm (Santé publique France), with its cheese, added fats and water rules
+_SODIUM_2017 = {"input": "sodium_mg", "thresholds": _steps(90, 90, 10)}
+_PROTEIN_2017 = {"input": "proteins", "thresholds": _steps(1.6, 1.6, 5)}
+_FRUITS_VEG_FOOD_2017 = {"input": "fruits_veg", "thresholds": [40, 60, 80], "points": [0, 1, 2, 5]}
+_GRADES_FOOD_2017 = {"thresholds": [-1, 2, 10, 18], "letters": "ABCDE"}
+NUTRISCORE_2017 = {
+    "categories": {
+        "water": {
+            "terms": ["spring water", "mineral water", "eaux"],
+            "tags": ["en:waters", "en:spring-waters", "en:mineral-waters"],
+            "negative": {},
+            "positive": {},
+            "grades": {"thresholds": [], "letters": "A"},
+        },
+        "beverage": {
+            "terms": ["beverage", "drink", "soda", "juice"],
+            "tags": ["en:beverages"],
+            "negative": {
+                "energy_points": _ENERGY_BEVERAGE,
+                "sugar_points": _SUGARS_BEVERAGE,
+                "saturated_fat_points": _SATURATED_FAT,
+                "sodium_points": _SODIUM_2017,
+            },
+            "positive": {
+                "protein_points": _PROTEIN_2017,
+                "fiber_points": _FIBER,
+                "fruits_veg_points": {"input": "fruits_veg", "thresholds": [40, 60, 80], "points": [0, 2, 4, 10]},
+            },
+            # Proteins stop counting at 11 negative points unless fruits/vegetables score the maximum
+            "protein_cap": {"negative_at_least": 11, "unless": ("fruits_veg_points", 10)},
+            "grades": {"thresholds": [1, 5, 9], "letters": "BCDE"},
+        },
+        "cheese": {
+            "terms": ["cheese", "fromage"],
+            "tags": ["en:cheeses"],
+            "negative": {
+                "energy_points": _ENERGY_FOOD,
+                "sugar_points": _SUGARS_FOOD,
+                "saturated_fat_points": _SATURATED_FAT,
+                "sodium_points": _SODIUM_2017,
+            },
+            "positive": {
+                "protein_points": _PROTEIN_2017,
+                "fiber_points": _FIBER,
+                "fruits_veg_points": _FRUITS_VEG_FOOD_2017,
+            },
+            "grades": _GRADES_FOOD_2017,
+        },
+        "fats": {
+            "terms": ["fats", "vegetable oils", "olive oils", "butter", "margarine"],
+            "tags": ["en:fats", "en:vegetable-oils", "en:olive-oils", "en:butters", "en:margarines"],
+            "negative": {
+                "energy_points": _ENERGY_FOOD,
+                "sugar_points": _SUGARS_FOOD,
+                # Saturated fat as a share of total fat, in percent
+                "saturated_fat_points": {"input": "saturated_fat_ratio", "thresholds": _steps(10, 6, 10)},
+                "sodium_points": _SODIUM_2017,
+            },
+            "positive": {
+                "protein_points": _PROTEIN_2017,
+                "fiber_points": _FIBER,
+                "fruits_veg_points": _FRUITS_VEG_FOOD_2017,
+            },
+            "protein_cap": {"negative_at_least": 11, "unless": ("fruits_veg_points", 5)},
+            "grades": _GRADES_FOOD_2017,
+        },
+        "food": {
+            "negative": {
+                "energy_points": _ENERGY_FOOD,
+                "sugar_points": _SUGARS_FOOD,
+                "saturated_fat_points": _SATURATED_FAT,
+                "sodium_points": _SODIUM_2017,
+            },
+            "positive": {
+                "protein_points": _PROTEIN_2017,
+                "fiber_points": _FIBER,
+                "fruits_veg_points": _FRUITS_VEG_FOOD_2017,
+            },
+            "protein_cap": {"negative_at_least": 11, "unless": ("fruits_veg_points", 5)},
+            "grades": _GRADES_FOOD_2017,
+        },
+    },
+}
+
+RULESETS: Dict[str, Dict[str, Any]] = {
+    "2023": NUTRISCORE_2023,
+    "2017": NUTRISCORE_2017,
+}
+
+# (breakdown key, input, thresholds, points)
+Component = Tuple[str, str, Tuple[float, ...], Tuple[int, ...]]
+
+
+class UnknownVersion(ValueError):
+    """No rule set is registered under the requested version"""
+
+
+class CompiledCategory:
+    """One category of a rule set, ready to score"""
+
+    __slots__ = ("name", "terms", "tags", "matcher", "negative", "positive", "protein_cap", "grade_thresholds", "letters",
+                 "inputs", "arrays", "read_negative", "read_positive")
+
+    def __init__(self, name: str, rules: Dict[str, Any]):
+        self.name = name
+        self.terms = tuple(rules.get("terms", ()))
+        self.tags = tuple(rules.get("tags", ()))
+        self.matcher = TermMatcher(self.terms, self.tags)
+        self.negative = tuple(_compile_component(key, table) for key, table in rules["negative"].items())
+        self.positive = tuple(_compile_component(key, table) for key, table in rules["positive"].items())
+        cap = rules.get("protein_cap")
+        self.protein_cap = (cap["negative_at_least"], cap["unless"][0], cap["unless"][1]) if cap else None
+        self.grade_thresholds = tuple(rules["grades"]["thresholds"])
+        self.letters = tuple(rules["grades"]["letters"])
+        if len(self.letters) != len(self.grade_thresholds) + 1:
+            raise ValueError(f"Category {name}: {len(self.grade_thresholds)} grade thresholds need "
+                             f"{len(self.grade_thresholds) + 1} letters")
+        self.inputs = frozenset(component[1] for component in self.negative + self.positive)
+        # Every input of a side read with one attrgetter call
+        self.read_negative = _reader(self.negative)
+        self.read_positive = _reader(self.positive)
+        # numpy copies of every table for calculate_nutriscore_batch
+        self.arrays = {
+            key: (np.array(thresholds, dtype=np.float64), np.array(points, dtype=np.int16))
+            for key, _, thresholds, points in self.negative + self.positive
+        }
+
+
+class CompiledRuleset:
+    """A rule set compiled for bisect (single product) and searchsorted (columns) scoring"""
+
+    def __init__(self, version: str, rules: Dict[str, Any]):
+        self.version = version
+        # Changes whenever the tables do, so scores stored under a version can be checked for staleness
+        self.fingerprint = hashlib.blake2b(json.dumps(rules, sort_keys=True).encode(), digest_size=8).hexdigest()
+        self.categories = {name: CompiledCategory(name, category) for name, category in rules["categories"].items()}
+        if "food" not in self.categories:
+            raise ValueError(f"Rule set {version} has no 'food' category")
+        self._detect = [(category.name, category.matcher) for category in self.categories.values() if len(category.matcher)]
+        keys: Dict[str, None] = {}
+        for category in self.categories.values():
+            for key, *_ in category.negative + category.positive:
+                keys[key] = None
+        self.breakdown_keys = tuple(keys)
+
+    def category(self, categories_text: str, categories_tags: Iterable[str] = ()) -> str:
+        """Category of a product from its categories text (any case) and categories_tags"""
+        for name, matcher in self._detect:
+            if matcher.matches(categories_text, categories_tags):
+                return name
+        return "food"
+
+    def score(self, values: Any, category: str) -> Dict[str, Any]:
+        """
+        Score one product
+        Args:
+            values: Object with every input the category reads as an attribute
+                (health_rating.NutrientRecord; see CompiledCategory.inputs)
+            category: One of the rule set's categories
+        Returns:
+            The calculate_nutriscore_2023 result layout, plus 'category' and 'version'
+        """
+        rules = self.categories[category]
+        breakdown = dict.fromkeys(self.breakdown_keys, 0)
+        negative = 0
+        for (key, _, thresholds, points), value in zip(rules.negative, rules.read_negative(values)):
+            # NaN fails every `<=` of a threshold ladder, so it scores the top band
+            earned = points[bisect_left(thresholds, value) if value == value else len(thresholds)]
+            breakdown[key] = earned
+            negative += earned
+        positive = 0
+        for (key, _, thresholds, points), value in zip(rules.positive, rules.read_positive(values)):
+            earned = points[bisect_left(thresholds, value) if value == value else len(thresholds)]
+            breakdown[key] = earned
+            positive += earned
+        if rules.protein_cap is not None:
+            negative_at_least, unless_key, unless_points = rules.protein_cap
+            if negative >= negative_at_least and breakdown[unless_key] < unless_points:
+                positive -= breakdown["protein_points"]
+                breakdown["protein_points"] = 0
+
+        score = negative - positive
+        return {
+            'score': score,
+            'grade': rules.letters[bisect_left(rules.grade_thresholds, score)],
+            'negative_points': negative,
+            'positive_points': positive,
+            'is_beverage': category in ("beverage", "water"),
+            'category': category,
+            'version': self.version,
+            'breakdown': breakdown,
+        }
+
+    def score_columns(self, columns: Mapping[str, np.ndarray], category: np.ndarray) -> Dict[str, Any]:
+        """
+        Score equal-length float64 input columns; ``category`` holds each row's category name.
+        Every category is scored on its own rows (a boolean mask), component by component.
+        """
+        size = len(category)
+        breakdown = {key: np.zeros(size, dtype=np.int16) for key in self.breakdown_keys}
+        negative = np.zeros(size, dtype=np.int16)
+        positive = np.zeros(size, dtype=np.int16)
+        grade = np.empty(size, dtype="<U1")
+        for rules in self.categories.values():
+            mask = category == rules.name
+            if not mask.any():
+                continue
+            rows_negative = np.zeros(int(mask.sum()), dtype=np.int16)
+            rows_positive = np.zeros_like(rows_negative)
+            earned_by_key = {}
+            for components, total in ((rules.negative, rows_negative), (rules.positive, rows_positive)):
+                for key, field, _, _ in components:
+                    thresholds, points = rules.arrays[key]
+                    # NaN sorts after every threshold, like the scalar top band
+                    earned = points[np.searchsorted(thresholds, columns[field][mask])]
+                    earned_by_key[key] = earned
+                    total += earned
+            if rules.protein_cap is not None:
+                negative_at_least, unless_key, unless_points = rules.protein_cap
+                capped = (rows_negative >= negative_at_least) & (earned_by_key[unless_key] < unless_points)
+                rows_positive -= np.where(capped, earned_by_key["protein_points"], 0).astype(np.int16)
+                earned_by_key["protein_points"] = np.where(capped, 0, earned_by_key["protein_points"]).astype(np.int16)
+            for key, earned in earned_by_key.items():
+                breakdown[key][mask] = earned
+            negative[mask] = rows_negative
+            positive[mask] = rows_positive
+            score = rows_negative - rows_positive
+            grade[mask] = np.array(rules.letters)[np.searchsorted(np.array(rules.grade_thresholds, dtype=np.int16), score)]
+
+        return {
+            'score': negative - positive,
+            'grade': grade,
+            'negative_points': negative,
+            'positive_points': positive,
+            'is_beverage': (category == "beverage") | (category == "water"),
+            'category': category,
+            'version': self.version,
+            'breakdown': breakdown,
+        }
+
+
+_compiled: Dict[str, CompiledRuleset] = {}
+
+
+def get_ruleset(version: Optional[str] = None) -> CompiledRuleset:
+    """The compiled scorer for a version (default: DEFAULT_VERSION), compiled on first use and shared"""
+    version = version or DEFAULT_VERSION
+    compiled = _compiled.get(version)
+    if compiled is None:
+        if version not in RULESETS:
+            raise UnknownVersion(f"Unknown Nutri-Score version {version!r}; available: {', '.join(sorted(RULESETS))}")
+        compiled = _compiled[version] = CompiledRuleset(version, RULESETS[version])
+    return compiled
+
+
+def register_ruleset(version: str, rules: Dict[str, Any]) -> CompiledRuleset:
+    """Add or replace a rule set; it is compiled (and validated) immediately"""
+    compiled = CompiledRuleset(version, rules)
+    RULESETS[version] = rules
+    _compiled[version] = compiled
+    return compiled
+
+
+def unregister_ruleset(version: str):
+    """Remove a rule set and its compiled scorer; the default version cannot be removed"""
+    if version == DEFAULT_VERSION:
+        raise ValueError(f"Nutri-Score version {version!r} is the default and cannot be removed")
+    if version not in RULESETS:
+        raise UnknownVersion(f"Unknown Nutri-Score version {version!r}; available: {', '.join(sorted(RULESETS))}")
+    del RULESETS[version]
+    _compiled.pop(version, None)
+
+
+def versions() -> List[str]:
+    return sorted(RULESETS)
+
+
+def _reader(components: Sequence[Component]) -> Callable[[Any], Tuple[float, ...]]:
+    """Callable returning the inputs of ``components`` from a record, always as a tuple"""
+    fields = [field for _, field, _, _ in components]
+    if len(fields) > 1:
+        return attrgetter(*fields)
+    if fields:
+        single = attrgetter(fields[0])
+        return lambda values: (single(values),)
+    return lambda values: ()
+
+
+def _compile_component(key: str, table: Dict[str, Any]) -> Component:
+    thresholds = tuple(float(t) for t in table["thresholds"])
+    if list(thresholds) != sorted(thresholds):
+        raise ValueError(f"Thresholds of {key} are not sorted")
+    points: Sequence[int] = table.get("points") or range(len(thresholds) + 1)
+    if len(points) != len(thresholds) + 1:
+        raise ValueError(f"{key}: {len(thresholds)} thresholds need {len(thresholds) + 1} points")
+    return key, table["input"], thresholds, tuple(int(p) for p in points)
+
+
+# Compile the built-in versions at import, so no request pays for it
+for _version in RULESETS:
+    get_ruleset(_version)
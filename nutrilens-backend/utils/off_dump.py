@@ -0,0 +1,225 @@
+"""
+Streaming ingestion of the OpenFoodFacts export into the local product store.
+
+Reads the JSONL export (openfoodfacts-products.jsonl.gz) or the tab-separated
+CSV export (en.openfoodfacts.org.products.csv.gz) one record at a time, keeps
+only the fields the API and the Nutri-Score need, and writes them into a fresh
+SQLite file that replaces the old one atomically when the load completes:
+
+    python -m utils.off_dump openfoodfacts-products.jsonl.gz --db data/products.sqlite3
+"""
+
+import csv
+import gzip
+import io
+import json
+import math
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional, Sequence, TextIO
+
+if __package__ in (None, ""):
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.gtin import gtin14
+from utils.materialized_scores import mark_materialized, score_rows
+from utils.nutriscore_rules import DEFAULT_VERSION
+from utils.product_store import ProductRow, open_for_writing, set_meta, upsert_products, upsert_scores
+
+# Per-100g nutriments read by fetch_from_openfoodfacts and calculate_nutriscore
+NUTRIMENT_FIELDS = [
+    "energy-kj_100g", "energy_100g", "energy-kcal_100g",
+    "fat_100g", "saturated-fat_100g", "sugars_100g", "salt_100g", "sodium_100g",
+    "proteins_100g", "fiber_100g", "fruits-vegetables-nuts-estimate-from-ingredients_100g",
+]
+TAG_FIELDS = ["categories_tags", "additives_tags"]
+TEXT_FIELDS = ["product_name", "brands", "categories", "ingredients_text"]
+
+BATCH_SIZE = 10000
+
+
+def open_dump(path: str) -> TextIO:
+    """Text stream over a dump, gunzipping on the fly when the file is gzip-compressed"""
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+    raw = gzip.open(path, "rb") if compressed else open(path, "rb")
+    return io.TextIOWrapper(raw, encoding="utf-8", errors="replace", newline="")
+
+
+def iter_dump_records(path: str, stats: Optional[Dict[str, int]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yield raw product records from a JSONL or tab-separated CSV export, one at a time
+    Args:
+        path: Dump file, optionally gzip-compressed; the format is detected from the first line
+        stats: Optional dict whose "malformed" counter is incremented for unreadable lines
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault("malformed", 0)
+    with open_dump(path) as stream:
+        first = stream.readline()
+        if not first:
+            return
+        if first.lstrip().startswith("{"):
+            for line in _chain(first, stream):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    stats["malformed"] += 1
+                    continue
+                if isinstance(record, dict):
+                    yield record
+                else:
+                    stats["malformed"] += 1
+        else:
+            csv.field_size_limit(sys.maxsize)
+            header = next(csv.reader([first], delimiter="\t"))
+            for row in csv.DictReader(stream, fieldnames=header, delimiter="\t", quoting=csv.QUOTE_NONE):
+                yield _csv_record(row)
+
+
+def normalize_record(record: Dict[str, Any]) -> Optional[ProductRow]:
+    """
+    Reduce one export record to a store row, or None if it has no usable barcode.
+    Rows are keyed by GTIN-14, so every form of a code finds the same row; the
+    code as OpenFoodFacts spells it is kept in ``data``, which holds the scoring
+    fields in the same layout as the API product so it scores like a live one.
+    """
+    barcode = "".join(ch for ch in str(record.get("code") or "") if ch.isdigit())
+    key = gtin14(barcode)
+    if key is None:
+        return None
+
+    source = record.get("nutriments") or {}
+    nutriments = {}
+    for field in NUTRIMENT_FIELDS:
+        value = _number(source.get(field))
+        if value is not None:
+            nutriments[field] = value
+
+    data: Dict[str, Any] = {"code": barcode, "nutriments": nutriments}
+    for field in TEXT_FIELDS:
+        value = record.get(field)
+        if isinstance(value, str) and value:
+            data[field] = value
+    for field in TAG_FIELDS:
+        value = record.get(field)
+        if isinstance(value, list) and value:
+            data[field] = [str(tag) for tag in value]
+
+    name = data.get("product_name", "Unknown Product")
+    brand = data.get("brands", "Unknown Brand")
+    return (
+        key, name, brand,
+        nutriments.get("fat_100g", 0.0),
+        nutriments.get("sugars_100g", 0.0),
+        nutriments.get("proteins_100g", 0.0),
+        json.dumps(data, separators=(",", ":"), ensure_ascii=False),
+    )
+
+
+def ingest_dump(dump_path: str, db_path: str, batch_size: int = BATCH_SIZE,
+                progress_every: int = 100000, score_versions: Sequence[str] = (DEFAULT_VERSION,)) -> Dict[str, Any]:
+    """
+    Build a new product store from a dump and swap it in place of ``db_path``
+    Args:
+        dump_path: OpenFoodFacts JSONL or CSV export (gzip or plain)
+        db_path: Product store file to (re)place
+        batch_size: Rows per insert batch
+        progress_every: Print progress every N records (0 disables)
+        score_versions: Nutri-Score versions precomputed for every product (see utils/materialized_scores.py)
+    Returns:
+        Counts of records read, products written and records skipped
+    """
+    tmp_path = db_path + ".building"
+    for leftover in (tmp_path, tmp_path + "-wal", tmp_path + "-shm"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+    stats = {"records": 0, "products": 0, "skipped": 0, "malformed": 0}
+    started = time.perf_counter()
+    db = open_for_writing(tmp_path, bulk=True)
+    try:
+        batch = []
+        scores = []
+        for record in iter_dump_records(dump_path, stats):
+            stats["records"] += 1
+            row = normalize_record(record)
+            if row is None:
+                stats["skipped"] += 1
+                continue
+            batch.append(row)
+            scores.extend(score_rows(row[0], row[6], score_versions))
+            if len(batch) >= batch_size:
+                upsert_products(db, batch)
+                upsert_scores(db, scores)
+                db.commit()
+                batch.clear()
+                scores.clear()
+            if progress_every and stats["records"] % progress_every == 0:
+                print(f"{stats['records']} records read ({time.perf_counter() - started:.0f}s)")
+        upsert_products(db, batch)
+        upsert_scores(db, scores)
+        mark_materialized(db, score_versions)
+        stats["products"] = db.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        set_meta(db, "products", str(stats["products"]))
+        set_meta(db, "ingested_at", datetime.now(timezone.utc).isoformat())
+        set_meta(db, "source", os.path.basename(dump_path))
+        db.commit()
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        db.close()
+
+    os.replace(tmp_path, db_path)
+    for stale in (db_path + "-wal", db_path + "-shm"):
+        if os.path.exists(stale):
+            os.remove(stale)
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+def _chain(first: str, stream: TextIO) -> Iterator[str]:
+    yield first
+    yield from stream
+
+
+def _number(value: Any) -> Optional[float]:
+    """Float from a dump value, or None for missing, non-numeric and non-finite values"""
+    if value is None or value == "":
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _csv_record(row: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    """Reshape a CSV row into the JSON export layout"""
+    record: Dict[str, Any] = {field: row.get(field) or "" for field in ["code"] + TEXT_FIELDS}
+    record["nutriments"] = {field: row.get(field) for field in NUTRIMENT_FIELDS if row.get(field)}
+    for field in TAG_FIELDS:
+        value = row.get(field) or ""
+        record[field] = [tag for tag in value.split(",") if tag]
+    return record
+
+
+if __name__ == "__main__":
+    import argparse
+
+    default_db = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "products.sqlite3")
+    parser = argparse.ArgumentParser(description="Load an OpenFoodFacts export into the local product store")
+    parser.add_argument("dump", help="openfoodfacts-products.jsonl(.gz) or en.openfoodfacts.org.products.csv(.gz)")
+    parser.add_argument("--db", default=os.getenv("PRODUCT_STORE_PATH", default_db))
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--score-versions", default=os.getenv("NUTRISCORE_MATERIALIZE", DEFAULT_VERSION),
+                        help="comma-separated Nutri-Score versions to precompute (empty for none)")
+    args = parser.parse_args()
+
+    versions = [version for version in args.score_versions.split(",") if version]
+    result = ingest_dump(args.dump, args.db, args.batch_size, score_versions=versions)
+    print(f"Ingested {result['products']} products from {result['records']} records into {args.db} "
+          f"({result['skipped']} without barcode, {result['malformed']} malformed, {result['seconds']}s)")
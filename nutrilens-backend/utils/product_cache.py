@@ -0,0 +1,245 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+Product = Dict[str, Any]
+
+
+class ProductCache:
+    """
+    Two-tier cache of product lookups: an in-process LRU in front of a SQLite file.
+
+    Entries are namespaced by source (e.g. "openfoodfacts"), so the same cache can
+    sit in front of several lookup paths. Found products live for ``ttl`` seconds;
+    "not found" results are cached too, for the shorter ``negative_ttl``. The
+    SQLite tier survives restarts, so a redeploy starts warm; with ``path=None``
+    only the memory tier is used. Expiry uses wall-clock time because entries
+    outlive the process.
+
+    Expired rows are purged when the file is opened and every ``purge_every``
+    writes after that; the same purge trims the file to ``max_disk_entries``
+    rows, dropping the entries closest to expiry first. Between purges the
+    file can hold up to ``purge_every`` rows more than the cap.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 10000,
+                 ttl: float = 24 * 3600, negative_ttl: float = 15 * 60,
+                 max_disk_entries: int = 1000000, purge_every: int = 1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_disk_entries = max_disk_entries
+        self.purge_every = purge_every
+        self._writes_since_purge = 0
+        # (namespace, key) -> (product or None, expires_at)
+        self._memory: "OrderedDict[Tuple[str, str], Tuple[Optional[Product], float]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "negative_hits": 0, "misses": 0,
+                       "loads": 0, "load_errors": 0, "evictions": 0, "expired": 0, "invalidated": 0,
+                       "purged": 0, "disk_evictions": 0}
+        self._namespaces: Set[str] = set()
+
+    async def open(self):
+        """Open (and create) the SQLite tier and drop entries that expired while the app was down"""
+        if self.path and self._db is None:
+            await asyncio.to_thread(self._open_db)
+
+    async def purge(self) -> int:
+        """Delete expired rows and trim the SQLite tier to ``max_disk_entries``; returns rows deleted"""
+        if self._db is None:
+            return 0
+        return await asyncio.to_thread(self._db_purge)
+
+    async def close(self):
+        with self._db_lock:
+            db, self._db = self._db, None
+            if db is not None:
+                db.close()
+
+    async def get(self, namespace: str, key: str) -> Tuple[bool, Optional[Product]]:
+        """Return (found, product); product is None for a cached "not found" result"""
+        entry = self._memory.get((namespace, key))
+        if entry is not None:
+            if entry[1] > time.time():
+                self._memory.move_to_end((namespace, key))
+                self._count_hit("memory_hits", entry[0])
+                return True, entry[0]
+            del self._memory[(namespace, key)]
+            self._stats["expired"] += 1
+
+        if self._db is not None:
+            row = await asyncio.to_thread(self._db_get, namespace, key)
+            if row is not None:
+                product, expires_at = row
+                self._remember(namespace, key, product, expires_at)
+                self._count_hit("disk_hits", product)
+                return True, product
+
+        self._stats["misses"] += 1
+        return False, None
+
+    async def put(self, namespace: str, key: str, product: Optional[Product]):
+        """Store a lookup result in both tiers; None records a "not found" result"""
+        expires_at = time.time() + (self.ttl if product is not None else self.negative_ttl)
+        self._remember(namespace, key, product, expires_at)
+        if self._db is not None:
+            await asyncio.to_thread(self._db_put, namespace, key, product, expires_at)
+
+    async def get_or_load(self, namespace: str, key: str,
+                          loader: Callable[[], Awaitable[Optional[Product]]]) -> Optional[Product]:
+        """
+        Return the cached result or call ``loader`` and cache what it returns
+        Args:
+            namespace: Source the result belongs to
+            key: Barcode
+            loader: Coroutine factory performing the real lookup. Returning None
+                means "not found" and is cached; raising means the answer is unknown
+                (network error, timeout) and nothing is cached.
+        Returns:
+            The product, or None if it is known not to exist
+        """
+        found, product = await self.get(namespace, key)
+        if found:
+            return product
+        self._stats["loads"] += 1
+        try:
+            product = await loader()
+        except Exception:
+            self._stats["load_errors"] += 1
+            raise
+        await self.put(namespace, key, product)
+        return product
+
+    async def invalidate(self, key: str, namespace: Optional[str] = None):
+        """Forget a barcode in one namespace, or in every namespace"""
+        await self.invalidate_many([key], namespace)
+
+    async def invalidate_many(self, keys: List[str], namespace: Optional[str] = None) -> int:
+        """Forget several barcodes at once (e.g. after a catalog sync); returns memory entries dropped"""
+        namespaces = [namespace] if namespace is not None else list(self._namespaces)
+        dropped = 0
+        for key in keys:
+            for ns in namespaces:
+                if self._memory.pop((ns, key), None) is not None:
+                    dropped += 1
+        if self._db is not None and keys:
+            await asyncio.to_thread(self._db_delete, keys, namespace)
+        self._stats["invalidated"] += dropped
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+        lookups = hits + self._stats["misses"]
+        return {
+            "memory_size": len(self._memory),
+            "max_entries": self.max_entries,
+            "persistent": self.path is not None,
+            "max_disk_entries": self.max_disk_entries,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            **self._stats,
+        }
+
+    def _remember(self, namespace: str, key: str, product: Optional[Product], expires_at: float):
+        self._namespaces.add(namespace)
+        self._memory[(namespace, key)] = (product, expires_at)
+        self._memory.move_to_end((namespace, key))
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _count_hit(self, counter: str, product: Optional[Product]):
+        self._stats[counter] += 1
+        if product is None:
+            self._stats["negative_hits"] += 1
+
+    # === SQLite tier (runs on worker threads) ===
+    def _open_db(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS product_cache ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, data TEXT, expires_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS product_cache_key ON product_cache (key)")
+        db.execute("CREATE INDEX IF NOT EXISTS product_cache_expires ON product_cache (expires_at)")
+        db.commit()
+        with self._db_lock:
+            self._db = db
+            self._purge_locked()
+
+    def _db_get(self, namespace: str, key: str) -> Optional[Tuple[Optional[Product], float]]:
+        with self._db_lock:
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT data, expires_at FROM product_cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= time.time():
+                self._db.execute("DELETE FROM product_cache WHERE namespace = ? AND key = ?", (namespace, key))
+                self._db.commit()
+                self._stats["expired"] += 1
+                return None
+        return (json.loads(row[0]) if row[0] is not None else None), row[1]
+
+    def _db_put(self, namespace: str, key: str, product: Optional[Product], expires_at: float):
+        data = json.dumps(product) if product is not None else None
+        with self._db_lock:
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO product_cache (namespace, key, data, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, data, expires_at),
+            )
+            self._db.commit()
+            self._writes_since_purge += 1
+            if self._writes_since_purge >= self.purge_every:
+                self._purge_locked()
+
+    def _db_purge(self) -> int:
+        with self._db_lock:
+            if self._db is None:
+                return 0
+            return self._purge_locked()
+
+    def _purge_locked(self) -> int:
+        """Drop expired rows, then the rows closest to expiry above the cap; caller holds _db_lock"""
+        self._writes_since_purge = 0
+        purged = self._db.execute("DELETE FROM product_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        excess = self._db.execute("SELECT COUNT(*) FROM product_cache").fetchone()[0] - self.max_disk_entries
+        evicted = 0
+        if excess > 0:
+            evicted = self._db.execute(
+                "DELETE FROM product_cache WHERE rowid IN"
+                " (SELECT rowid FROM product_cache ORDER BY expires_at LIMIT ?)",
+                (excess,),
+            ).rowcount
+        self._db.commit()
+        self._stats["purged"] += purged
+        self._stats["disk_evictions"] += evicted
+        return purged + evicted
+
+    def _db_delete(self, keys: List[str], namespace: Optional[str]):
+        with self._db_lock:
+            if self._db is None:
+                return
+            if namespace is None:
+                self._db.executemany("DELETE FROM product_cache WHERE key = ?", [(key,) for key in keys])
+            else:
+                self._db.executemany("DELETE FROM product_cache WHERE namespace = ? AND key = ?",
+                                     [(namespace, key) for key in keys])
+            self._db.commit()
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from utils.gtin import gtin14
+
+# products: one row per GTIN-14 key; the scoring inputs live in `data` as compact JSON
+# scores: precomputed Nutri-Score per product and rule set version (see utils/materialized_scores.py),
+#   valid while content_hash matches the product's data and rules_hash the version's tables
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    gtin TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    brand TEXT NOT NULL,
+    fat REAL NOT NULL,
+    sugar REAL NOT NULL,
+    protein REAL NOT NULL,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS scores (
+    gtin TEXT NOT NULL,
+    version TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    rules_hash TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (gtin, version)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# (gtin, name, brand, fat, sugar, protein, data)
+ProductRow = Tuple[str, str, str, float, float, float, str]
+# (gtin, version, content_hash, rules_hash, data)
+ScoreRow = Tuple[str, str, str, str, str]
+
+
+class ProductStore:
+    """
+    Read side of the local product database built from the OpenFoodFacts export.
+
+    A drop-in replacement for FakeDB: ``get_product_by_barcode`` returns the same
+    dict shape as ``fetch_from_openfoodfacts`` (name, brand, nutrients and the
+    scoring fields as ``raw_product_data``), or None. Lookups are a primary-key
+    probe on a SQLite file, well under a millisecond. Each thread gets its own
+    query-only connection, and the file is in WAL mode, so a sync job can write
+    while requests keep reading. When a fresh ingestion replaces the file,
+    connections notice the new inode and reopen on their next lookup.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._missing_logged = False
+
+    def get_product_by_barcode(self, barcode: str, score_version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Product for any form of a barcode (UPC-A, EAN-13, GTIN-14, ...), or None
+        Args:
+            barcode: Any form of the code
+            score_version: Also read the stored score of this rule set version, returned under
+                ``scores`` (as for cached API products) unless the product changed since it was computed
+        """
+        key = gtin14(barcode)
+        db = self._connection()
+        if db is None or key is None:
+            return None
+        if score_version is not None and not self._local.has_scores:
+            # The materializer or a sync adds the table to old stores in place, without a new inode
+            self._local.has_scores = _has_scores_table(db)
+        if score_version is None or not self._local.has_scores:
+            row = db.execute(
+                "SELECT gtin, name, brand, fat, sugar, protein, data FROM products WHERE gtin = ?",
+                (key,),
+            ).fetchone()
+            return row_to_product(row) if row is not None else None
+
+        row = db.execute(
+            "SELECT p.gtin, p.name, p.brand, p.fat, p.sugar, p.protein, p.data, s.content_hash, s.rules_hash, s.data "
+            "FROM products p LEFT JOIN scores s ON s.gtin = p.gtin AND s.version = ? WHERE p.gtin = ?",
+            (score_version, key),
+        ).fetchone()
+        if row is None:
+            return None
+        product = row_to_product(row[:7])
+        stored_hash, rules_hash, score = row[7:]
+        if score is not None and stored_hash == content_hash(row[6]):
+            product["scores"] = {score_version: {"rules_hash": rules_hash, "encoded": score}}
+        return product
+
+    def count(self) -> int:
+        db = self._connection()
+        return db.execute("SELECT COUNT(*) FROM products").fetchone()[0] if db is not None else 0
+
+    def get_meta(self, key: str) -> Optional[str]:
+        db = self._connection()
+        if db is None:
+            return None
+        row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "available": os.path.exists(self.path),
+            "products": int(self.get_meta("products") or 0),  # COUNT(*) would scan millions of rows
+            "ingested_at": self.get_meta("ingested_at"),
+        }
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            if not self._missing_logged:
+                print(f"Product store {self.path} not found; run the OpenFoodFacts ingestion (utils/off_dump.py)")
+                self._missing_logged = True
+            self.close()
+            return None
+        db = getattr(self._local, "db", None)
+        if db is not None and self._local.inode == inode:
+            return db
+        self.close()
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA query_only=ON")
+        self._local.db = db
+        self._local.inode = inode
+        # Stores built before scores were materialized have no scores table until their next write
+        self._local.has_scores = _has_scores_table(db)
+        return db
+
+
+def _has_scores_table(db: sqlite3.Connection) -> bool:
+    return db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scores'").fetchone() is not None
+
+
+def content_hash(data: str) -> str:
+    """Hash of a product's stored data, the part of a row its scores depend on"""
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def row_to_product(row: ProductRow) -> Dict[str, Any]:
+    key, name, brand, fat, sugar, protein, data = row
+    raw = json.loads(data)
+    return {
+        "barcode": raw.get("code", key),
+        "name": name,
+        "brand": brand,
+        "nutrients": {"fat": fat, "sugar": sugar, "protein": protein},
+        "raw_product_data": raw,
+    }
+
+
+def open_for_writing(path: str, bulk: bool = False) -> sqlite3.Connection:
+    """
+    Writable connection with the schema in place
+    Args:
+        path: SQLite file
+        bulk: Trade durability for speed while building a fresh file
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=OFF" if bulk else "PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+def upsert_products(db: sqlite3.Connection, rows: Iterable[ProductRow]):
+    db.executemany(
+        "INSERT OR REPLACE INTO products (gtin, name, brand, fat, sugar, protein, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+
+
+def upsert_scores(db: sqlite3.Connection, rows: Iterable[ScoreRow]):
+    db.executemany(
+        "INSERT OR REPLACE INTO scores (gtin, version, content_hash, rules_hash, data) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+
+
+def set_meta(db: sqlite3.Connection, key: str, value: str):
+    db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
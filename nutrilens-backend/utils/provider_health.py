@@ -0,0 +1,260 @@
+import asyncio
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+# (requests, seconds): e.g. (100, 86400) is 100 requests a day
+Quota = Tuple[int, float]
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+# Floor on the latency used for ordering, so fast failures do not look cheap
+MIN_COST_LATENCY = 0.01
+# Outcome of a call -> its counter in ProviderHealth.stats()
+OUTCOME_COUNTERS = {"hit": "hits", "miss": "misses", "error": "errors", "timeout": "timeouts", "throttled": "throttled"}
+
+
+class ProviderUnavailable(Exception):
+    """A provider was not called because its circuit is open or its quota is spent"""
+
+    def __init__(self, provider: str, reason: str):
+        super().__init__(f"{provider} skipped: {reason}")
+        self.provider = provider
+        self.reason = reason
+
+
+class TokenBucket:
+    """``limit`` requests per ``period`` seconds, refilled continuously"""
+
+    def __init__(self, limit: int, period: float, clock: Callable[[], float] = time.monotonic):
+        self.limit = limit
+        self.period = period
+        self.clock = clock
+        self.tokens = float(limit)
+        self.updated = clock()
+
+    def available(self) -> float:
+        now = self.clock()
+        self.tokens = min(self.limit, self.tokens + (now - self.updated) * self.limit / self.period)
+        self.updated = now
+        return self.tokens
+
+    def take(self):
+        self.tokens -= 1
+
+    def put_back(self):
+        self.tokens = min(self.limit, self.tokens + 1)
+
+
+class ProviderHealth:
+    """
+    Rolling health of one upstream provider, with a circuit breaker and quotas.
+
+    The last ``window`` calls are kept as (outcome, latency). Misses ("not
+    found") are healthy answers; errors, timeouts and rate limiting are not.
+    Once ``min_calls`` are in the window and the failure share reaches
+    ``failure_threshold`` the circuit opens, and a 429 opens it at once for
+    the Retry-After the provider asked for. An open circuit rejects calls for
+    ``open_for`` seconds, then lets a single probe through (half-open): a
+    healthy answer closes it, a failure reopens it for twice as long, up to
+    ``max_open_for``.
+
+    Quotas are token buckets checked before every call, so a provider's
+    published limits are never exceeded and a spent quota costs nothing.
+    """
+
+    def __init__(self, name: str, quotas: Sequence[Quota] = (), window: int = 50,
+                 min_calls: int = 5, failure_threshold: float = 0.5,
+                 open_for: float = 30.0, max_open_for: float = 600.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.clock = clock
+        self.buckets = [TokenBucket(limit, period, clock) for limit, period in quotas]
+        self.min_calls = min_calls
+        self.failure_threshold = failure_threshold
+        self.open_for = open_for
+        self.max_open_for = max_open_for
+        self._calls: Deque[Tuple[str, float]] = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_until = 0.0
+        self._backoff = open_for
+        self._probing = False
+        self._totals = {"calls": 0, "hits": 0, "misses": 0, "errors": 0, "timeouts": 0,
+                        "throttled": 0, "rejected_open": 0, "rejected_quota": 0, "opened": 0}
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self.clock() >= self._opened_until:
+            self._state = HALF_OPEN
+        return self._state
+
+    def acquire(self) -> bool:
+        """
+        Reserve a call; raises ProviderUnavailable instead of letting a doomed call through
+        Returns:
+            True if the call is the probe of a half-open circuit
+        """
+        state = self.state
+        if state == OPEN or (state == HALF_OPEN and self._probing):
+            self._totals["rejected_open"] += 1
+            raise ProviderUnavailable(self.name, "circuit open")
+        if any(bucket.available() < 1 for bucket in self.buckets):
+            self._totals["rejected_quota"] += 1
+            raise ProviderUnavailable(self.name, "quota exhausted")
+        for bucket in self.buckets:
+            bucket.take()
+        if state == HALF_OPEN:
+            self._probing = True
+        return state == HALF_OPEN
+
+    def release(self, probe: bool = False):
+        """Give back a reserved call that never got an answer (cancelled)"""
+        if probe:
+            self._probing = False
+        for bucket in self.buckets:
+            bucket.put_back()
+
+    def record(self, outcome: str, latency: float, retry_after: Optional[float] = None, probe: bool = False):
+        """
+        Record the answer to a reserved call
+        Args:
+            outcome: "hit", "miss", "error", "timeout" or "throttled"
+            latency: Seconds the call took
+            retry_after: For "throttled", how long the provider asked us to back off
+            probe: The call was the half-open probe (as returned by acquire)
+        """
+        self._calls.append((outcome, latency))
+        self._totals["calls"] += 1
+        self._totals[OUTCOME_COUNTERS[outcome]] += 1
+        if probe:
+            self._probing = False
+        healthy = outcome in ("hit", "miss")
+
+        if healthy:
+            if probe:
+                self._close()
+            return
+        if outcome == "throttled":
+            self._open(retry_after if retry_after is not None else self._backoff)
+        elif probe:
+            self._open(min(self._backoff * 2, self.max_open_for))
+        elif self._state == CLOSED and len(self._calls) >= self.min_calls:
+            failures = sum(1 for o, _ in self._calls if o not in ("hit", "miss"))
+            if failures / len(self._calls) >= self.failure_threshold:
+                self._open(self.open_for)
+
+    async def call(self, fn: Callable[[], Awaitable[Optional[T]]]) -> Optional[T]:
+        """
+        Run one provider request under the breaker and quotas
+        Args:
+            fn: The request; returns None for "not found" and raises if the provider could not answer
+        Returns:
+            fn's result. Raises ProviderUnavailable without calling fn when the provider is skipped.
+        """
+        probe = self.acquire()
+        started = self.clock()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            self.release(probe)
+            raise
+        except httpx.TimeoutException:
+            self.record("timeout", self.clock() - started, probe=probe)
+            raise
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 429:
+                self.record("throttled", self.clock() - started, _retry_after(e.response), probe)
+            else:
+                self.record("error", self.clock() - started, probe=probe)
+            raise
+        except Exception:
+            self.record("error", self.clock() - started, probe=probe)
+            raise
+        self.record("hit" if result is not None else "miss", self.clock() - started, probe=probe)
+        return result
+
+    def cost(self) -> float:
+        """
+        Expected seconds spent per product found, for ordering providers.
+        Hit rate is smoothed so a provider with no history is tried, not written off,
+        and failures count as calls without a hit, however quickly they fail.
+        """
+        if not self._calls:
+            return 0.0
+        hits = sum(1 for outcome, _ in self._calls if outcome == "hit")
+        hit_rate = (hits + 1) / (len(self._calls) + 2)
+        latency = _percentile(sorted(latency for _, latency in self._calls), 0.5)
+        return max(latency, MIN_COST_LATENCY) / hit_rate
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(latency for _, latency in self._calls)
+        window = len(self._calls)
+        state = self.state
+        return {
+            "state": state,
+            "open_seconds_left": round(max(0.0, self._opened_until - self.clock()), 1) if state == OPEN else 0.0,
+            "window": window,
+            "hit_rate": sum(1 for o, _ in self._calls if o == "hit") / window if window else None,
+            "failure_rate": sum(1 for o, _ in self._calls if o not in ("hit", "miss")) / window if window else None,
+            "latency_p50_ms": round(_percentile(latencies, 0.50) * 1000, 1) if window else None,
+            "latency_p95_ms": round(_percentile(latencies, 0.95) * 1000, 1) if window else None,
+            "cost": round(self.cost(), 4),
+            "quotas": [{"limit": b.limit, "period": b.period, "available": int(b.available())} for b in self.buckets],
+            **self._totals,
+        }
+
+    def _open(self, seconds: float):
+        self._state = OPEN
+        self._backoff = max(seconds, self.open_for)
+        self._opened_until = self.clock() + seconds
+        self._totals["opened"] += 1
+
+    def _close(self):
+        self._state = CLOSED
+        self._backoff = self.open_for
+        self._calls.clear()
+
+
+class ProviderRegistry:
+    """ProviderHealth per provider name, shared by everything that calls the same upstreams"""
+
+    def __init__(self, **defaults):
+        self.defaults = defaults
+        self._providers: Dict[str, ProviderHealth] = {}
+
+    def get(self, name: str, quotas: Sequence[Quota] = ()) -> ProviderHealth:
+        """The provider's health, created with ``quotas`` on first use"""
+        health = self._providers.get(name)
+        if health is None:
+            health = self._providers[name] = ProviderHealth(name, quotas, **self.defaults)
+        return health
+
+    def order(self, names: Iterable[str]) -> List[str]:
+        """Names ordered cheapest first; providers with an open circuit go last"""
+        return sorted(names, key=lambda name: (self.get(name).state == OPEN, self.get(name).cost()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: health.stats() for name, health in self._providers.items()}
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    """Retry-After in seconds (delta-seconds or HTTP date), or None"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,52 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one execution.
+
+    The first caller for a key starts the work as a task; callers that arrive
+    while it is running await the same task and get the same result or
+    exception. The task is shielded, so a caller that disconnects does not
+    cancel the work for everyone else. Nothing is kept once the task finishes,
+    so this only deduplicates in-flight work; caching is left to the caller.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, "asyncio.Task[Any]"] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self._stats = {"calls": 0, "executions": 0, "coalesced": 0, "failed": 0, "max_waiters": 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run ``fn()`` for ``key`` unless a call for the same key is already in flight"""
+        self._stats["calls"] += 1
+        task = self._calls.get(key)
+        if task is None:
+            self._stats["executions"] += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda done, key=key: self._finish(key, done))
+        else:
+            self._stats["coalesced"] += 1
+        self._waiters[key] += 1
+        self._stats["max_waiters"] = max(self._stats["max_waiters"], self._waiters[key])
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self._stats["calls"]
+        return {
+            "in_flight": len(self._calls),
+            "coalesce_rate": self._stats["coalesced"] / calls if calls else 0.0,
+            **self._stats,
+        }
+
+    def _finish(self, key: Hashable, task: "asyncio.Task[Any]"):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            del self._waiters[key]
+        if not task.cancelled() and task.exception() is not None:
+            self._stats["failed"] += 1
@@ -0,0 +1,86 @@
+"""
+Precompiled matching of many terms against free text and tag lists.
+
+Checking a product for sweeteners, allergens or category keywords used to
+loop over the term list, testing each term as a substring of the text and as
+a member of the tag list, so every term added made every call slower. A
+TermMatcher is built once per list: the text terms are folded into a trie
+and compiled into a single regular expression whose alternatives branch on
+one character at a time (a plain ``a|b|c`` alternation would still try every
+term at every position), and the tag terms go into a dict. A call then costs
+one regex scan of the text plus one hash lookup per tag on the product,
+whatever the size of the list.
+"""
+
+import re
+from typing import Dict, Iterable, Mapping, Optional, Set, Union
+
+# label -> terms, or just terms (each term is its own label)
+Terms = Union[Mapping[str, Iterable[str]], Iterable[str]]
+
+
+class TermMatcher:
+    """
+    Finds which terms occur in a text (case-insensitive substrings) or in a list
+    of tags (exact). Terms carry a label, so synonyms ("aspartam", "e951") can
+    report one flag.
+    """
+
+    def __init__(self, text_terms: Terms = (), tag_terms: Terms = ()):
+        self._text_labels = _labels(text_terms)
+        self._tag_labels = _labels(tag_terms)
+        # Texts are lower-cased rather than matched with re.IGNORECASE, which would lose the regex
+        # engine's first-character scan and be several times slower
+        self._pattern = re.compile(_trie_pattern(self._text_labels)) if self._text_labels else None
+
+    def matches(self, text: Optional[str] = None, tags: Optional[Iterable[str]] = None) -> bool:
+        """True if any term occurs in the text or any tag is a tag term"""
+        if tags and not self._tag_labels.keys().isdisjoint(tags):
+            return True
+        return bool(text) and self._pattern is not None and self._pattern.search(text.lower()) is not None
+
+    def labels(self, text: Optional[str] = None, tags: Optional[Iterable[str]] = None) -> Set[str]:
+        """
+        Labels of every term found. Text matches do not overlap: at each position the
+        longest term wins, so a term inside a longer one at the same spot is not reported.
+        """
+        found = set()
+        if tags:
+            labels = self._tag_labels
+            found.update(labels[tag] for tag in tags if tag in labels)
+        if text and self._pattern is not None:
+            labels = self._text_labels
+            found.update(labels[match.group(0)] for match in self._pattern.finditer(text.lower()))
+        return found
+
+    def __len__(self) -> int:
+        return len(self._text_labels) + len(self._tag_labels)
+
+
+def _labels(terms: Terms) -> Dict[str, str]:
+    """term -> label, terms lower-cased for case-insensitive text matching"""
+    if isinstance(terms, Mapping):
+        return {term.lower(): label for label, group in terms.items() for term in group if term}
+    return {term.lower(): term for term in terms if term}
+
+
+def _trie_pattern(terms: Iterable[str]) -> str:
+    """Regex matching exactly the given terms, shaped like their prefix trie"""
+    trie: Dict[str, dict] = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[""] = {}  # a term ends here
+    return _node_pattern(trie)
+
+
+def _node_pattern(node: Dict[str, dict]) -> str:
+    branches = [re.escape(ch) + _node_pattern(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if "" in node:
+        # A shorter term ends here; the longer continuation is tried first
+        pattern = "(?:" + pattern + ")?"
+    return pattern
@@ -0,0 +1,129 @@
+from typing import AsyncIterator, Optional
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # older python-multipart releases
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from utils.barcode_scanner import sniff_image_format
+
+# Multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+# Enough bytes to recognise every format sniff_image_format knows
+SNIFF_BYTES = 16
+
+
+class UploadError(Exception):
+    """Base class for rejected uploads"""
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+class UnsupportedUpload(UploadError):
+    pass
+
+
+class EmptyUpload(UploadError):
+    pass
+
+
+class _ImagePartCollector:
+    """
+    Callback target for MultipartParser: keeps the bytes of one named file field,
+    enforcing the size limit and sniffing the format as data arrives
+    """
+
+    def __init__(self, field_name: str, max_size: int):
+        self.field_name = field_name
+        self.max_size = max_size
+        self.data = bytearray()
+        self.image_format: Optional[str] = None
+        self.found = False
+        self._capturing = False
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._disposition = b""
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": lambda data, start, end: self._header_field.extend(data[start:end]),
+            "on_header_value": lambda data, start, end: self._header_value.extend(data[start:end]),
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        }
+
+    def _on_part_begin(self):
+        self._disposition = b""
+
+    def _on_header_end(self):
+        if bytes(self._header_field).lower() == b"content-disposition":
+            self._disposition = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _on_headers_finished(self):
+        _, params = parse_options_header(self._disposition)
+        self._capturing = not self.found and params.get(b"name") == self.field_name.encode()
+        self.found = self.found or self._capturing
+
+    def _on_part_data(self, data, start: int, end: int):
+        if not self._capturing:
+            return
+        if len(self.data) + (end - start) > self.max_size:
+            raise UploadTooLarge(f"Image too large (max {self.max_size // (1024 * 1024)}MB).")
+        self.data.extend(data[start:end])
+        if self.image_format is None and len(self.data) >= SNIFF_BYTES:
+            self._sniff()
+
+    def _on_part_end(self):
+        if self._capturing and self.image_format is None and self.data:
+            self._sniff()
+        self._capturing = False
+
+    def _sniff(self):
+        self.image_format = sniff_image_format(bytes(self.data[:SNIFF_BYTES]))
+        if self.image_format is None:
+            raise UnsupportedUpload("Unsupported file type. Please upload an image.")
+
+
+async def read_image_upload(content_type: Optional[str], content_length: Optional[str],
+                            stream: AsyncIterator[bytes], max_size: int,
+                            field_name: str = "file") -> bytearray:
+    """
+    Consume a multipart/form-data body chunk by chunk and return the bytes of one image field.
+
+    Bodies whose declared length is already too big are refused before any data is read;
+    otherwise the limit is enforced as bytes arrive and the format is checked from the
+    file's leading bytes, so neither oversized nor non-image uploads are buffered in full.
+    The returned bytearray is the only copy of the image and can be handed to the decoder as is.
+    Raises UploadTooLarge, UnsupportedUpload or EmptyUpload.
+    """
+    mime_type, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if mime_type != b"multipart/form-data" or not boundary:
+        raise UnsupportedUpload("Expected a multipart/form-data upload with an image file.")
+
+    max_body = max_size + MULTIPART_OVERHEAD
+    if content_length and content_length.isdigit() and int(content_length) > max_body:
+        raise UploadTooLarge(f"Image too large (max {max_size // (1024 * 1024)}MB).")
+
+    collector = _ImagePartCollector(field_name, max_size)
+    parser = MultipartParser(boundary, collector.callbacks())
+    received = 0
+    async for chunk in stream:
+        received += len(chunk)
+        if received > max_body:
+            raise UploadTooLarge(f"Image too large (max {max_size // (1024 * 1024)}MB).")
+        parser.write(chunk)
+    parser.finalize()
+
+    if not collector.found:
+        raise EmptyUpload(f"No '{field_name}' field in upload.")
+    if not collector.data:
+        raise EmptyUpload("Empty file uploaded.")
+    return collector.data